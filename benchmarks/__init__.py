@@ -0,0 +1 @@
+"""Reproducible benchmarks for dbcanlight (developer only)."""
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""Plot the results of benchmarks.run into the figures under misc/. Requires matplotlib and seaborn."""
+
+from __future__ import annotations
+
+import argparse
+import json
+from pathlib import Path
+
+import matplotlib.pyplot as plt
+import seaborn as sns
+
+MISC = Path(__file__).parents[1] / "misc"
+
+
+def _table(results: dict[str, dict]) -> list[dict]:
+    """Flatten the search cases into rows of mode, strategy, threads, blocksize, time and memory."""
+    rows = []
+    for case, values in results.items():
+        fields = case.split(":")
+        if fields[0] != "search":
+            continue
+        rows.append(
+            {
+                "mode": fields[1],
+                "threads": int(fields[2][1:]),
+                "blocksize": int(fields[3][1:]) if len(fields) > 3 else None,
+                "strategy": fields[4] if len(fields) > 4 else "auto",
+                "time (s)": values["wall_seconds"],
+                "peak memory (MB)": values["peak_rss_bytes"] / 2**20,
+            }
+        )
+    return rows
+
+
+def _series(row: dict) -> str:
+    """Name of the line or the bar of the row, which tells the strategies of the same mode apart."""
+    return row["mode"] if row["strategy"] == "auto" else f"{row['mode']} ({row['strategy']})"
+
+
+def plot(results: dict[str, dict], output: Path) -> None:
+    rows = _table(results)
+    output.mkdir(parents=True, exist_ok=True)
+    largest_blocksize = max(row["blocksize"] or 0 for row in rows)
+    by_threads = [row for row in rows if row["blocksize"] in (None, largest_blocksize)]
+
+    for y, name in (("time (s)", "performance_comparison.svg"), ("peak memory (MB)", "memory_peak_by_threads.svg")):
+        fig, ax = plt.subplots(figsize=(6, 4))
+        sns.lineplot(
+            x=[row["threads"] for row in by_threads],
+            y=[row[y] for row in by_threads],
+            hue=[_series(row) for row in by_threads],
+            marker="o",
+            ax=ax,
+        )
+        ax.set(xlabel="threads", ylabel=y)
+        fig.savefig(output / name, bbox_inches="tight")
+        plt.close(fig)
+
+    by_blocksize = [row for row in rows if row["blocksize"] is not None and row["threads"] == min(r["threads"] for r in rows)]
+    fig, ax = plt.subplots(figsize=(6, 4))
+    sns.barplot(
+        x=[row["blocksize"] for row in by_blocksize],
+        y=[row["peak memory (MB)"] for row in by_blocksize],
+        hue=[_series(row) for row in by_blocksize],
+        ax=ax,
+    )
+    ax.set(xlabel="blocksize", ylabel="peak memory (MB)")
+    fig.savefig(output / "memory_footprint.svg", bbox_inches="tight")
+    plt.close(fig)
+
+
+def main(args: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("input", type=Path, help="Results json output by benchmarks.run")
+    parser.add_argument("-o", "--output", type=Path, default=MISC, help="Output folder (default: misc)")
+    args = parser.parse_args(args)
+    plot(json.loads(args.input.read_text())["results"], args.output)
+
+
+if __name__ == "__main__":
+    main()
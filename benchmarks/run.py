@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""Benchmark dbcanlight on a synthetic proteome and compare against a stored baseline.
+
+Every search mode is run across the given threads and blocksizes, followed by dbcanlight-hmmparser and the conclude module. Each
+case runs in a fresh process for the given rounds and the median wall time and peak memory are recorded. When a baseline is
+given, cases slower or heavier than the baseline beyond the tolerance are reported as regressions and the script exits with 1.
+When the search strategies are given along with auto, the cases where auto is slower than the best strategy beyond the tolerance
+are reported as well.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from itertools import product
+from pathlib import Path
+
+from .synthetic import DEFAULT_HMMS, synthetic_proteome, write_fasta
+
+DEFAULT_DB = Path(__file__).parents[1] / "tests" / "databases"
+
+
+def run_case(cmd: list[str], env: dict[str, str]) -> dict[str, float]:
+    """Run the command in a fresh process and return its wall time, CPU time and peak memory."""
+    with tempfile.TemporaryFile() as log:
+        start = time.perf_counter()
+        p = subprocess.Popen(cmd, env=env, stdout=subprocess.DEVNULL, stderr=log)
+        _, status, rusage = os.wait4(p.pid, 0)
+        wall = time.perf_counter() - start
+        p.returncode = os.waitstatus_to_exitcode(status)
+        if p.returncode != 0:
+            log.seek(0)
+            raise RuntimeError(f"{' '.join(cmd)} failed: {log.read().decode()}")
+    maxrss = rusage.ru_maxrss if sys.platform == "darwin" else rusage.ru_maxrss * 1024
+    return {"wall_seconds": wall, "cpu_seconds": rusage.ru_utime + rusage.ru_stime, "peak_rss_bytes": maxrss}
+
+
+def benchmark(
+    input: Path,
+    workdir: Path,
+    *,
+    modes: list[str],
+    threads: list[int],
+    blocksizes: list[int],
+    strategies: list[str],
+    rounds: int,
+    env: dict[str, str],
+) -> dict[str, dict]:
+    """Run the benchmark matrix and return the median of each case."""
+    results = {}
+
+    def record(case: str, cmd: list[str], metrics: Path | None = None) -> None:
+        runs = []
+        for _ in range(rounds):
+            runs.append(run_case(cmd + (["--metrics", str(metrics)] if metrics else []), env))
+        results[case] = {key: statistics.median(run[key] for run in runs) for key in runs[0]}
+        if metrics:
+            results[case]["stages"] = {
+                stage: values["wall"] for stage, values in json.loads(metrics.read_text())["stages"].items()
+            }
+        print(f"{case}: {results[case]['wall_seconds']:.2f} s, {results[case]['peak_rss_bytes'] / 2**20:.1f} MB", flush=True)
+
+    for mode, t, b, strategy in product(modes, threads, blocksizes, strategies):
+        if mode == "diamond" and (b != blocksizes[0] or strategy != strategies[0]):
+            continue
+        output = workdir / f"{mode}_t{t}_b{b}_{strategy}"
+        cmd = ["dbcanlight", "search", "-i", str(input), "-o", str(output), "-m", mode, "-t", str(t), "-b", str(b)]
+        if mode == "diamond":
+            case = f"search:{mode}:t{t}"
+        else:
+            cmd += ["--strategy", strategy]
+            case = f"search:{mode}:t{t}:b{b}" + (f":{strategy}" if strategy != "auto" else "")
+        record(case, cmd, output / "metrics.json")
+
+    t, b, strategy = threads[0], blocksizes[0], strategies[0]
+    conclude_dir = workdir / "conclude"
+    for mode in modes:
+        src = workdir / f"{mode}_t{t}_b{b}_{strategy}"
+        shutil.copytree(src, conclude_dir, dirs_exist_ok=True, ignore=shutil.ignore_patterns("metrics.json"))
+    if "cazyme" in modes:
+        cmd = ["dbcanlight-hmmparser", "-i", str(conclude_dir / "cazymes.tsv"), "-o", str(workdir / "hmmparser.tsv")]
+        record("hmmparser", cmd)
+    if len(modes) > 1:
+        record("conclude", ["dbcanlight", "conclude", str(conclude_dir)], workdir / "conclude_metrics.json")
+    return results
+
+
+def compare(results: dict[str, dict], baseline: dict[str, dict], tolerance: float) -> list[str]:
+    """Return the cases that regress against the baseline beyond the tolerance."""
+    regressions = []
+    for case, values in results.items():
+        if case not in baseline:
+            continue
+        for key in ("wall_seconds", "peak_rss_bytes"):
+            ref = baseline[case][key]
+            if ref and values[key] > ref * (1 + tolerance):
+                regressions.append(f"{case} {key}: {values[key]:.4g} > {ref:.4g} (+{values[key] / ref - 1:.1%})")
+    return regressions
+
+
+def compare_strategies(results: dict[str, dict], tolerance: float) -> list[str]:
+    """Return the search cases where the auto strategy is slower than the best strategy beyond the tolerance."""
+    slower = []
+    for case, values in results.items():
+        if not case.startswith("search:") or case.count(":") != 3:
+            continue
+        others = {key.rsplit(":", 1)[1]: results[key]["wall_seconds"] for key in results if key.startswith(f"{case}:")}
+        if not others:
+            continue
+        best = min(others, key=others.get)
+        if values["wall_seconds"] > others[best] * (1 + tolerance):
+            slower.append(f"{case} auto: {values['wall_seconds']:.4g} > {best}: {others[best]:.4g}")
+    return slower
+
+
+def main(args: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-i", "--input", type=Path, help="Protein fasta. Generate a synthetic proteome if not given")
+    parser.add_argument("-n", "--size", type=int, default=10000, help="Size of the synthetic proteome (default: 10000)")
+    parser.add_argument("-d", "--density", type=float, default=0.05, help="CAZyme density of the synthetic proteome")
+    parser.add_argument("-s", "--seed", type=int, default=42, help="Seed of the synthetic proteome (default: 42)")
+    parser.add_argument("--db", type=Path, default=DEFAULT_DB, help="Database folder (default: tests/databases)")
+    parser.add_argument("-m", "--modes", nargs="+", default=["cazyme", "sub", "diamond"], help="Modes to benchmark")
+    parser.add_argument("-t", "--threads", type=int, nargs="+", default=[1, 2, 4], help="Threads to benchmark")
+    parser.add_argument("-b", "--blocksizes", type=int, nargs="+", default=[100000, 10000], help="Blocksizes to benchmark")
+    parser.add_argument(
+        "-S",
+        "--strategies",
+        nargs="+",
+        default=["auto"],
+        choices=("auto", "search", "scan"),
+        help="Search strategies to benchmark (default: auto)",
+    )
+    parser.add_argument("-r", "--rounds", type=int, default=3, help="Rounds of each case (default: 3)")
+    parser.add_argument("-o", "--output", type=Path, default=Path("benchmark.json"), help="Output json")
+    parser.add_argument("--baseline", type=Path, help="Baseline json to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="Allowed regression over the baseline (default: 0.1)")
+    args = parser.parse_args(args)
+
+    modes = args.modes
+    if "diamond" in modes and not shutil.which("diamond"):
+        print("diamond not found. Skip the diamond mode.", file=sys.stderr)
+        modes = [mode for mode in modes if mode != "diamond"]
+
+    env = {**os.environ, "DBCANLIGHT_DB": str(args.db.resolve())}
+    with tempfile.TemporaryDirectory(prefix="dbcanlight_benchmark_") as tmpdir:
+        workdir = Path(tmpdir)
+        input = args.input
+        if input is None:
+            records = synthetic_proteome(DEFAULT_HMMS, size=args.size, density=args.density, seed=args.seed)
+            input = write_fasta(records, workdir / "synthetic.faa")
+        results = benchmark(
+            input,
+            workdir,
+            modes=modes,
+            threads=args.threads,
+            blocksizes=args.blocksizes,
+            strategies=args.strategies,
+            rounds=args.rounds,
+            env=env,
+        )
+
+    report = {
+        "input": str(args.input) if args.input else {"size": args.size, "density": args.density, "seed": args.seed},
+        "database": str(args.db),
+        "rounds": args.rounds,
+        "results": results,
+    }
+    args.output.write_text(json.dumps(report, indent=4))
+    print(f"Results written to {args.output}")
+    for slower in compare_strategies(results, args.tolerance):
+        print(f"Strategy: {slower}", file=sys.stderr)
+
+    if args.baseline:
+        baseline = json.loads(args.baseline.read_text())
+        if baseline["input"] != report["input"] or baseline["database"] != report["database"]:
+            print("The input or database differs from the baseline. The comparison may not be meaningful.", file=sys.stderr)
+        regressions = compare(results, baseline["results"], args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""Generate synthetic proteomes of configurable size and CAZyme density.
+
+CAZyme-like proteins are made by emitting a domain from the HMM profiles (by default the ones under tests/databases) and
+embedding it in random flanking regions. The other proteins are random sequences drawn from the background residue
+frequencies. The output is fully determined by the seed.
+"""
+
+from __future__ import annotations
+
+import argparse
+import random
+from pathlib import Path
+from typing import Iterator
+
+import pyhmmer
+
+DEFAULT_HMMS = (
+    Path(__file__).parents[1] / "tests" / "databases" / "cazyme.hmm",
+    Path(__file__).parents[1] / "tests" / "databases" / "substrate.hmm",
+)
+
+# Order of the transitions in HMMER: MM, MI, MD, IM, II, DM, DD
+MM, MI, MD, IM, II, DM, DD = range(7)
+
+
+def emit_domain(hmm: pyhmmer.plan7.HMM, rng: random.Random, sharpness: float = 1.0) -> str:
+    """Emit a sequence from the profile by walking through the match, insert and delete states.
+
+    Match emissions are raised to the power of sharpness so that values above 1 emit sequences closer to the consensus.
+    """
+    symbols = hmm.alphabet.symbols[: hmm.alphabet.K]
+    match, insert, trans = hmm.match_emissions, hmm.insert_emissions, hmm.transition_probabilities
+    residues = []
+    state = "M"
+    for k in range(1, hmm.M + 1):
+        if state == "M":
+            residues.append(rng.choices(symbols, weights=[p**sharpness for p in match[k]])[0])
+        t = list(trans[k])
+        if state == "D":
+            state = rng.choices("MD", weights=(t[DM], t[DD]))[0]
+            continue
+        state = rng.choices("MID", weights=(t[MM], t[MI], t[MD]))[0]
+        while state == "I":
+            residues.append(rng.choices(symbols, weights=list(insert[k]))[0])
+            state = rng.choices("MI", weights=(t[IM], t[II]))[0]
+    return "".join(residues)
+
+
+def synthetic_proteome(
+    hmm_files: tuple[Path, ...] = DEFAULT_HMMS,
+    *,
+    size: int = 10000,
+    density: float = 0.05,
+    mean_length: int = 350,
+    duplicates: float = 0.0,
+    sharpness: float = 2.0,
+    seed: int = 42,
+) -> Iterator[tuple[str, str]]:
+    """Yield (name, sequence) of a synthetic proteome.
+
+    Args:
+        size: Number of proteins.
+        density: Fraction of proteins which contain a domain emitted from the profiles.
+        mean_length: Mean length of the proteins. Lengths follow a gamma distribution.
+        duplicates: Fraction of proteins that are an exact copy of a previous protein under another name.
+        sharpness: Sharpness of the match emissions. Higher values emit domains closer to the consensus.
+        seed: Seed of the random number generator.
+    """
+    rng = random.Random(seed)
+    hmms = [hmm for hmm_file in hmm_files for hmm in pyhmmer.plan7.HMMFile(hmm_file)]
+    alphabet = pyhmmer.easel.Alphabet.amino()
+    symbols = alphabet.symbols[: alphabet.K]
+    background = list(pyhmmer.plan7.Background(alphabet).residue_frequencies)
+
+    def random_seq(length: int) -> str:
+        return "".join(rng.choices(symbols, weights=background, k=max(length, 0)))
+
+    proteins: list[str] = []
+    for i in range(size):
+        length = max(int(rng.gammavariate(4.0, mean_length / 4.0)), 30)
+        if proteins and rng.random() < duplicates:
+            seq = rng.choice(proteins)
+        elif rng.random() < density:
+            domain = emit_domain(rng.choice(hmms), rng, sharpness)
+            flank = max(length - len(domain), 0)
+            left = rng.randint(0, flank)
+            seq = random_seq(left) + domain + random_seq(flank - left)
+        else:
+            seq = random_seq(length)
+        if duplicates:
+            proteins.append(seq)
+        yield f"synthetic_{i + 1:08d}", "M" + seq
+
+
+def write_fasta(records: Iterator[tuple[str, str]], output: Path, *, width: int = 60) -> Path:
+    """Write the records to a fasta file."""
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, "w") as f:
+        for name, seq in records:
+            f.write(f">{name}\n")
+            for i in range(0, len(seq), width):
+                f.write(f"{seq[i : i + width]}\n")
+    return output
+
+
+def main(args: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-o", "--output", type=Path, required=True, help="Output fasta")
+    parser.add_argument("-n", "--size", type=int, default=10000, help="Number of proteins (default: 10000)")
+    parser.add_argument("-d", "--density", type=float, default=0.05, help="Fraction of CAZyme-like proteins (default: 0.05)")
+    parser.add_argument("-l", "--mean-length", type=int, default=350, help="Mean protein length (default: 350)")
+    parser.add_argument("--duplicates", type=float, default=0.0, help="Fraction of duplicated proteins (default: 0)")
+    parser.add_argument("--sharpness", type=float, default=2.0, help="Sharpness of the match emissions (default: 2)")
+    parser.add_argument("--hmms", type=Path, nargs="+", default=DEFAULT_HMMS, help="HMM files to emit the domains from")
+    parser.add_argument("-s", "--seed", type=int, default=42, help="Random seed (default: 42)")
+    args = parser.parse_args(args)
+    records = synthetic_proteome(
+        tuple(args.hmms),
+        size=args.size,
+        density=args.density,
+        mean_length=args.mean_length,
+        duplicates=args.duplicates,
+        sharpness=args.sharpness,
+        seed=args.seed,
+    )
+    write_fasta(records, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,7 @@
 """Required actions when initiating the package."""
 
 import logging
+import math
 import os
 
 try:
@@ -8,7 +9,7 @@ try:
 except ImportError:
     from importlib.metadata import entry_points, metadata
 from pathlib import Path
-from typing import Literal
+from typing import Literal, Optional, Tuple
 
 
 def _map_entry_point_module(project_name):
@@ -20,6 +21,56 @@ def _map_entry_point_module(project_name):
     return d
 
 
+def _cgroup_quota(root: Path = Path("/sys/fs/cgroup")) -> Optional[float]:
+    """Number of CPUs allowed by the cgroup v2 cpu.max or the cgroup v1 cfs quota. Return None if not limited."""
+    try:
+        with open("/proc/self/cgroup") as f:
+            paths = {
+                controller: path.strip().lstrip("/")
+                for _, controllers, path in (line.split(":", 2) for line in f)
+                for controller in controllers.split(",")
+            }
+    except OSError:
+        paths = {}
+    # The process may see its own cgroup as the root inside a container
+    candidates = [(root / paths.get("", "") / "cpu.max", None), (root / "cpu.max", None)]
+    for folder in (root / "cpu" / paths.get("cpu", ""), root / "cpu", root / "cpu,cpuacct"):
+        candidates.append((folder / "cpu.cfs_quota_us", folder / "cpu.cfs_period_us"))
+    for quota_file, period_file in candidates:
+        try:
+            if period_file is None:
+                quota, period = quota_file.read_text().split()[:2]
+            else:
+                quota, period = quota_file.read_text().strip(), period_file.read_text().strip()
+        except (OSError, ValueError):
+            continue
+        if quota in ("max", "-1"):
+            return None
+        return int(quota) / int(period)
+    return None
+
+
+def _available_cpus() -> Tuple[int, str]:
+    """Number of CPUs the process can use and where it comes from.
+
+    Take the smallest of the Slurm allocation, the CPU affinity of the process and the cgroup CPU quota, so the threads do not
+    oversubscribe the quota of a container.
+    """
+    if hasattr(os, "sched_getaffinity"):
+        limits = {"affinity": len(os.sched_getaffinity(0))}
+    else:
+        limits = {"cpu_count": os.cpu_count() or 1}
+    quota = _cgroup_quota()
+    if quota:
+        limits["cgroup"] = max(1, math.ceil(quota))
+    for var in ("SLURM_CPUS_PER_TASK", "SLURM_CPUS_ON_NODE"):
+        if os.environ.get(var, "").isdigit():
+            limits[var] = int(os.environ[var])
+            break
+    source = min(limits, key=limits.get)
+    return limits[source], source
+
+
 # Create logger for the package
 logger = logging.basicConfig(format="%(asctime)s %(name)s %(levelname)s %(message)s", level="INFO")
 logger = logging.getLogger(__name__)
@@ -28,7 +79,7 @@ logger = logging.getLogger(__name__)
 VERSION: str = metadata("dbcanlight")["Version"]
 AUTHOR: str = metadata("dbcanlight")["Author-email"]
 ENTRY_POINTS: dict[str, str] = _map_entry_point_module(metadata("dbcanlight")["Name"])
-AVAIL_CPUS = int(os.environ.get("SLURM_CPUS_ON_NODE", os.cpu_count()))
+AVAIL_CPUS, CPUS_SOURCE = _available_cpus()
 DATABASE_METADATA = "https://raw.githubusercontent.com/chtsai0105/dbcanlight/refs/heads/main/database_metadata.json"
 
 _dbcanlight_db = os.getenv("DBCANLIGHT_DB")
@@ -38,6 +89,12 @@ else:
     CFG_DIR: Path = Path.home() / ".dbcanlight"
     CFG_DIR.mkdir(exist_ok=True)
 
+_press_cache = os.getenv("DBCANLIGHT_PRESS_CACHE")
+if _press_cache:
+    PRESS_CACHE = Path(_press_cache)
+else:
+    PRESS_CACHE: Path = Path(os.getenv("XDG_CACHE_HOME") or Path.home() / ".cache") / "dbcanlight" / "pressed"
+
 DB_PATH: dict[Literal["cazyme_hmms", "subs_hmms", "subs_mapper", "diamond"], Path] = {
     "cazyme_hmms": CFG_DIR / "cazyme.hmm",
     "subs_hmms": CFG_DIR / "substrate.hmm",
@@ -46,3 +103,5 @@ DB_PATH: dict[Literal["cazyme_hmms", "subs_hmms", "subs_mapper", "diamond"], Pat
 }
 
 AVAIL_MODES = {"cazyme": "cazymes.tsv", "sub": "substrates.tsv", "diamond": "diamond.tsv"}
+FASTA_SUFFIXES = ("faa", "fa", "fasta", "fas", "pep")
+COMPRESSION_SUFFIXES = ("gz", "bgz", "zst")
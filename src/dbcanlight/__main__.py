@@ -5,9 +5,11 @@ from __future__ import annotations
 
 import argparse
 
-from . import AUTHOR, AVAIL_CPUS, AVAIL_MODES, ENTRY_POINTS, VERSION
+from . import AUTHOR, AVAIL_CPUS, AVAIL_MODES, CFG_DIR, ENTRY_POINTS, VERSION
+from ._cache import DEFAULT_CACHE_SIZE
 from ._args_parser import CustomHelpFormatter, args_parser
-from .pipeline import build, conclude, search
+from ._utils import parse_size
+from .pipeline import build, conclude, index, query, search
 
 
 def _menu_build(
@@ -27,6 +29,11 @@ def _menu_build(
         action="store_true",
         help="Force to rebuild the databases.",
     )
+    p_build.add_argument(
+        "--offline",
+        action="store_true",
+        help="Check the databases against the cached or bundled metadata without accessing the network.",
+    )
     p_build.add_argument(
         "-t",
         "--threads",
@@ -37,6 +44,16 @@ def _menu_build(
     p_build.set_defaults(func=build)
 
 
+def _blocksize(value: str) -> int | str:
+    """Blocksize of an integer, "auto" or "auto:<memory limit>"."""
+    auto, sep, mem_limit = value.partition(":")
+    if auto != "auto":
+        return int(value)
+    if sep:
+        parse_size(mem_limit)
+    return value
+
+
 def _menu_search(
     subparser: argparse._SubParsersAction, parent_parser: argparse.ArgumentParser | None = None
 ) -> argparse.ArgumentParser:
@@ -48,7 +65,17 @@ def _menu_search(
         help="Search the databases for cazyme candidates",
         description=search.__doc__,
     )
-    p_search.add_argument("-i", "--input", metavar="file", type=str, required=True, help="Plain or gzipped protein fasta")
+    input_group = p_search.add_mutually_exclusive_group(required=True)
+    input_group.add_argument(
+        "-i", "--input", metavar="file", type=str, help="Plain or compressed (gzip, bgzf or zstd) protein fasta"
+    )
+    input_group.add_argument(
+        "--input-list",
+        metavar="file/directory",
+        type=str,
+        help="Search many genomes in one go. Either a directory of protein fasta or a tsv listing a protein fasta and "
+        "optionally its output directory per line. The results are output to a directory per genome under the output directory",
+    )
     p_search.add_argument("-o", "--output", metavar="directory", type=str, default=".", help="Output directory")
     p_search.add_argument(
         "-m", "--mode", choices=AVAIL_MODES.keys(), required=True, help="Search against cazyme or substrate database"
@@ -61,19 +88,189 @@ def _menu_search(
         help="Evalue cutoff. Use 1e-15 for hmmsearch and 1e-102 for diamond when specifying AUTO (default: AUTO)",
     )
     p_search.add_argument("-c", "--coverage", metavar="float", type=float, default=0.35, help="Coverage cutoff")
-    p_search.add_argument("-t", "--threads", metavar="int", type=int, default=AVAIL_CPUS, help="Number of CPU to use")
+    p_search.add_argument(
+        "-t",
+        "--threads",
+        metavar="int",
+        type=int,
+        default=AVAIL_CPUS,
+        help="Number of CPU to use (default: the CPUs available to the process within its affinity, cgroup quota and Slurm "
+        "allocation)",
+    )
     p_search.add_argument(
         "-b",
         "--blocksize",
+        metavar="int|auto[:size]",
+        type=_blocksize,
+        default=100000,
+        help="Number of sequence to search per batch. Lower the blocksize to use fewer memory. Set as 0 to disable batching, or "
+        "auto to adapt it to the runtime and the memory usage of each batch under the memory limit given after the colon, e.g. "
+        "auto:16G (default: 100000, not applicable on diamond. The memory limit defaults to the memory available to the process, "
+        "including the cgroup limit)",
+    )
+    p_search.add_argument(
+        "-Z",
+        "--Z",
         metavar="int",
         type=int,
-        default=100000,
-        help="Number of sequence to search per batch. Lower the blocksize to use fewer memory. "
-        "Set as 0 to disable batching (default: 100000, not applicable on diamond)",
+        help="Compute the evalues as if Z sequences were searched, regardless of the blocksize. Use the same Z to make the "
+        "results of the shards of a large input identical to searching it as a whole "
+        "(default: number of sequences in the input, not applicable on diamond)",
+    )
+    p_search.add_argument(
+        "--strategy",
+        choices=("auto", "search", "scan"),
+        default="auto",
+        help="Run hmmsearch or hmmscan on each block, or pick the one keeping more threads busy from the number of sequences "
+        "and profiles of the block. The results are identical (default: auto, not applicable on diamond)",
+    )
+    p_search.add_argument(
+        "--prune",
+        action="store_true",
+        help="Skip the profiles a sequence is likely too short to satisfy at the coverage cutoff. Faster on fragmented ORFs but "
+        "approximate: the domains spanning more than twice as many profile positions as the residues of the sequence are missed "
+        "(not applicable on diamond)",
+    )
+    p_search.add_argument(
+        "--gate",
+        metavar="file",
+        nargs="?",
+        const=True,
+        help="Search each gene only against the substrate profiles of the CAZy families it hits in the cazyme results. Use the "
+        "cazymes.tsv under the output directory if specified without a file, and run the cazyme search first if it does not "
+        "exist (only applicable on sub)",
+    )
+    p_search.add_argument(
+        "--verify-gate",
+        action="store_true",
+        help="Run the exhaustive substrate search as well and output the hits missed by --gate to substrates.missed.tsv",
+    )
+    p_search.add_argument(
+        "--max-target-seqs",
+        metavar="int",
+        type=int,
+        default=1,
+        help="Number of hits to report per gene, e.g. for the genes of multiple families (only applicable on diamond)",
+    )
+    p_search.add_argument(
+        "--top",
+        metavar="float",
+        type=float,
+        help="Report all the hits within the percentage range of the best bitscore of each gene instead of --max-target-seqs "
+        "(only applicable on diamond)",
+    )
+    p_search.add_argument(
+        "--start",
+        metavar="ID/int",
+        type=str,
+        help="Search from the sequence of the ID or 1-based position, e.g. to resume an interrupted search. "
+        "Require a plain fasta, which is indexed first if not indexed yet",
+    )
+    p_search.add_argument(
+        "--shard",
+        metavar="k/n",
+        type=str,
+        help="Search the k-th of n shards of the input balanced by the number of residues. The evalues are computed against "
+        "the whole input unless -Z is specified. Require a plain fasta, which is indexed first if not indexed yet",
+    )
+    p_search.add_argument(
+        "--conclude",
+        dest="run_conclude",
+        action="store_true",
+        help="Conclude each genome once the results of at least 2 modes are in its directory (only applicable with --input-list)",
+    )
+    p_search.add_argument(
+        "--sorted-output",
+        action="store_true",
+        help="Sort the results by the gene ID across all the blocks, spilling the sorted runs to temporary files to bound the "
+        "memory (default: sorted within each block only)",
+    )
+    p_search.add_argument(
+        "--db",
+        metavar="file",
+        type=str,
+        help="Store the results in the SQLite database as well for the query module to look up across the samples",
+    )
+    p_search.add_argument(
+        "--sample",
+        metavar="str",
+        type=str,
+        help="Name of the sample to store the results under in the database (default: name of the output directory)",
+    )
+    p_search.add_argument(
+        "--record-profiles",
+        action="store_true",
+        help="Record the checksum of each profile and the cutoffs next to the results for updating them later with "
+        "--update-from (not applicable on diamond)",
+    )
+    p_search.add_argument(
+        "--update-from",
+        metavar="directory",
+        type=str,
+        help="Update the results in the directory made with an earlier release of the databases by searching only against "
+        "the profiles added or changed since then (not applicable on diamond)",
+    )
+    p_search.add_argument(
+        "--dedup",
+        action="store_true",
+        help="Search the identical sequences in the input only once and report the hits for every sequence",
+    )
+    p_search.add_argument(
+        "--cache",
+        metavar="file",
+        nargs="?",
+        const=str(CFG_DIR / "result_cache.sqlite"),
+        help="Reuse the hits of the proteins searched before and store the new ones in the cache file "
+        f"(default: {CFG_DIR / 'result_cache.sqlite'} if specified without a file, not applicable on diamond)",
+    )
+    p_search.add_argument(
+        "--cache-size",
+        metavar="int",
+        type=int,
+        default=DEFAULT_CACHE_SIZE,
+        help=f"Size limit of the cache in MB. Evict the least recently used entries beyond it (default: {DEFAULT_CACHE_SIZE})",
+    )
+    p_search.add_argument(
+        "--progress",
+        metavar="file",
+        type=str,
+        nargs="?",
+        const="-",
+        help="Report the residues searched, the throughput, the ETA and the current RSS as a bar on the terminal, or as json "
+        "lines appended to the file if given (not applicable on diamond)",
+    )
+    p_search.add_argument(
+        "--progress-interval",
+        metavar="float",
+        type=float,
+        default=30.0,
+        help="Seconds between the progress reports in between the blocks (default: 30, or 1 for the bar on the terminal)",
+    )
+    p_search.add_argument(
+        "--profile",
+        metavar="file",
+        type=str,
+        help="Profile the search with cProfile and output the stats to the file. "
+        "Use pyinstrument instead if the file ends with .html (require pyinstrument installed)",
     )
     p_search.set_defaults(func=search)
 
 
+def _menu_index(
+    subparser: argparse._SubParsersAction, parent_parser: argparse.ArgumentParser | None = None
+) -> argparse.ArgumentParser:
+    """Menu for index module."""
+    p_index: argparse.ArgumentParser = subparser.add_parser(
+        "index",
+        parents=[parent_parser] if parent_parser else [],
+        formatter_class=CustomHelpFormatter,
+        help="Index the sequences of a protein fasta for sharding and resuming the search",
+        description=index.__doc__,
+    )
+    p_index.add_argument("input", type=str, help="Plain protein fasta")
+    p_index.set_defaults(func=index)
+
+
 def _menu_conclude(
     subparser: argparse._SubParsersAction, parent_parser: argparse.ArgumentParser | None = None
 ) -> argparse.ArgumentParser:
@@ -86,10 +283,49 @@ def _menu_conclude(
         description=conclude.__doc__,
     )
     p_conclude.add_argument("output", type=str, help="Folder that contains dbcanlight search results")
+    p_conclude.add_argument(
+        "--db",
+        metavar="file",
+        type=str,
+        help="Store the overview in the SQLite database as well for the query module to look up across the samples",
+    )
+    p_conclude.add_argument(
+        "--sample",
+        metavar="str",
+        type=str,
+        help="Name of the sample to store the overview under in the database (default: name of the folder)",
+    )
     p_conclude.set_defaults(func=conclude)
     parent_parser.add_help
 
 
+def _menu_query(
+    subparser: argparse._SubParsersAction, parent_parser: argparse.ArgumentParser | None = None
+) -> argparse.ArgumentParser:
+    """Menu for query module."""
+    p_query: argparse.ArgumentParser = subparser.add_parser(
+        "query",
+        parents=[parent_parser] if parent_parser else [],
+        formatter_class=CustomHelpFormatter,
+        help="Look up the results stored in a database across the samples",
+        description=query.__doc__,
+    )
+    p_query.add_argument("db", type=str, help="SQLite database made by the search and conclude modules with --db")
+    p_query.add_argument(
+        "-m",
+        "--mode",
+        choices=AVAIL_MODES.keys(),
+        help="Report the hits of the mode instead of the overview rows (--substrate and --ec are not applicable)",
+    )
+    p_query.add_argument("-f", "--family", metavar="str", action="append", help="Genes with the family, e.g. GH5_4")
+    p_query.add_argument("-s", "--substrate", metavar="str", action="append", help="Genes with the substrate, e.g. cellulose")
+    p_query.add_argument("--ec", metavar="str", action="append", help="Genes with the EC number, e.g. 3.2.1.4")
+    p_query.add_argument("--sample", metavar="str", action="append", help="Only the genes of the sample")
+    p_query.add_argument("--gene", metavar="str", action="append", help="Only the gene of the ID")
+    p_query.add_argument("-o", "--output", metavar="file", type=str, help="Output file (default: stdout)")
+    p_query.set_defaults(func=query)
+
+
 def _menu(parser: argparse.ArgumentParser) -> argparse.ArgumentParser:
     """Menu for this entry point."""
     parser.add_argument("-V", "--version", action="version", version=VERSION)
@@ -99,10 +335,19 @@ def _menu(parser: argparse.ArgumentParser) -> argparse.ArgumentParser:
     # Module-wise shared args
     parent_parser = argparse.ArgumentParser(add_help=False)
     parent_parser.add_argument("-v", "--verbose", action="store_true", help="Verbose mode for debug")
+    parent_parser.add_argument(
+        "--metrics",
+        metavar="file",
+        type=str,
+        help="Output the per-stage timing, throughput and peak memory to the file. "
+        "Output in Prometheus textfile format if the file ends with .prom, otherwise in json",
+    )
 
     _menu_build(subparsers, parent_parser)
     _menu_search(subparsers, parent_parser)
+    _menu_index(subparsers, parent_parser)
     _menu_conclude(subparsers, parent_parser)
+    _menu_query(subparsers, parent_parser)
 
     return parser
 
@@ -113,7 +358,8 @@ def main(args: list[str] | None = None) -> int:
 
     DbcanLight comprises 3 modules - download, search and conclude. The download module downloads the required databases from
     dbcan website. The search module searches against protein HMM, substrate HMM or diamond databases and reports the hits
-    separately. The conclude module gathers all the results made by each module and reports a brief overview.
+    separately. The conclude module gathers all the results made by each module and reports a brief overview. The index module
+    indexes a large protein fasta so the search module can split it into shards or resume from any sequence.
     """
 
     return args_parser(_menu, args, prog=ENTRY_POINTS[__name__], description=main.__doc__, epilog=f"Written by {AUTHOR}")
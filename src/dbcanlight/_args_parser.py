@@ -9,7 +9,7 @@ import textwrap
 import traceback
 from typing import Callable
 
-from . import AVAIL_CPUS, logger
+from . import AVAIL_CPUS, CPUS_SOURCE, logger
 
 
 class CustomHelpFormatter(argparse.HelpFormatter):
@@ -65,16 +65,18 @@ def args_parser(
             raise SystemExit(0)
         args = parser.parse_args(args)
 
-        if hasattr(args, "threads"):
-            if args.threads > AVAIL_CPUS:
-                args.threads = AVAIL_CPUS
-
         if args.verbose:
             logger.setLevel("DEBUG")
             for handler in logger.handlers:
                 handler.setLevel("DEBUG")
             logger.debug("Debug mode enabled.")
 
+        if hasattr(args, "threads"):
+            logger.debug(f"{AVAIL_CPUS} CPUs available (limited by {CPUS_SOURCE}).")
+            if args.threads > AVAIL_CPUS:
+                logger.warning(f"{args.threads} threads exceed the {AVAIL_CPUS} available CPUs (limited by {CPUS_SOURCE}).")
+                args.threads = AVAIL_CPUS
+
         logger.debug(vars(args))
         args.func(**vars(args))
 
@@ -0,0 +1,165 @@
+"""On-disk cache of the per-sequence search results (internal use only)."""
+
+from __future__ import annotations
+
+import copy
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Sequence
+
+import pyhmmer
+
+from . import logger
+
+DEFAULT_CACHE_SIZE = 1024  # MB
+_SQLITE_MAX_VARIABLES = 500
+
+
+class _Cache:
+    """Base class of the caches keyed by the sequence and the scope of the search."""
+
+    _scope = b""
+
+    def scope(self, **fields) -> _Cache:
+        """Return a view of the cache whose keys are bound to the given fields."""
+        view = copy.copy(self)
+        view._scope = json.dumps(fields, sort_keys=True, default=str).encode()
+        return view
+
+    def key(self, sequence: pyhmmer.easel.DigitalSequence) -> bytes:
+        """Key of the sequence under the current scope."""
+        h = hashlib.blake2b(self._scope, digest_size=20)
+        h.update(bytes(sequence.sequence))
+        return h.digest()
+
+
+class MemoryCache(_Cache):
+    """In-memory store of the hits of each unique sequence, used to search the identical sequences of an input only once."""
+
+    def __init__(self) -> None:
+        self._entries: dict[bytes, list[list]] = {}
+
+    def get(self, keys: Sequence[bytes]) -> dict[bytes, list[list]]:
+        """Return the hits of the keys seen before."""
+        return {key: self._entries[key] for key in keys if key in self._entries}
+
+    def put(self, entries: dict[bytes, list[list]]) -> None:
+        """Store the hits."""
+        self._entries.update(entries)
+
+
+class ResultCache(_Cache):
+    """Content-addressed store of the hits of each sequence, bounded in size with least-recently-used eviction.
+
+    The entries are keyed by the hash of the digital sequence together with a scope that identifies the search, i.e. the mode,
+    the checksum of the database and the cutoffs, so the hits of a protein can be reused by any later search with the same scope
+    regardless of the sequence name. Sequences without any hit are stored as well. The cache is a SQLite database in WAL mode
+    and can be shared by parallel jobs on the same machine; writers wait for each other instead of failing.
+    """
+
+    def __init__(self, path: str | Path, *, max_size: int = DEFAULT_CACHE_SIZE * 2**20, timeout: float = 60.0) -> None:
+        self.path = Path(path)
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(self.path, timeout=timeout, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS results (key BLOB PRIMARY KEY, hits TEXT NOT NULL, size INTEGER NOT NULL, "
+            "atime REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS results_atime ON results (atime)")
+        # Keep the total size of the entries in a one-row table updated by triggers, seeded once from the existing entries
+        self._conn.execute("BEGIN IMMEDIATE")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (id INTEGER PRIMARY KEY CHECK (id = 0), total INTEGER NOT NULL)")
+        self._conn.execute(
+            "CREATE TRIGGER IF NOT EXISTS results_insert AFTER INSERT ON results "
+            "BEGIN UPDATE meta SET total = total + new.size; END"
+        )
+        self._conn.execute(
+            "CREATE TRIGGER IF NOT EXISTS results_delete AFTER DELETE ON results "
+            "BEGIN UPDATE meta SET total = total - old.size; END"
+        )
+        self._conn.execute("INSERT OR IGNORE INTO meta SELECT 0, COALESCE(SUM(size), 0) FROM results")
+        self._conn.execute("COMMIT")
+
+    def close(self) -> None:
+        self._conn.close()
+
+    def __enter__(self) -> ResultCache:
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def get(self, keys: Sequence[bytes]) -> dict[bytes, list[list]]:
+        """Return the cached hits of the keys found in the cache and mark them as recently used."""
+        found = {}
+        try:
+            with self._lock:
+                for i in range(0, len(keys), _SQLITE_MAX_VARIABLES):
+                    chunk = keys[i : i + _SQLITE_MAX_VARIABLES]
+                    rows = self._conn.execute(f"SELECT key, hits FROM results WHERE key IN ({','.join('?' * len(chunk))})", chunk)
+                    found.update((key, json.loads(hits)) for key, hits in rows)
+                if found:
+                    now = time.time()
+                    self._conn.execute("BEGIN IMMEDIATE")
+                    self._conn.executemany("UPDATE results SET atime = ? WHERE key = ?", ((now, key) for key in found))
+                    self._conn.execute("COMMIT")
+        except sqlite3.Error as err:
+            self._rollback()
+            logger.warning("Failed to read the result cache %s: %s", self.path, err)
+        return found
+
+    def put(self, entries: dict[bytes, list[list]]) -> None:
+        """Store the hits and evict the least recently used entries if the cache grows over the size limit."""
+        if not entries:
+            return
+        now = time.time()
+        items = []
+        for key, hits in entries.items():
+            data = json.dumps(hits, separators=(",", ":"))
+            items.append((key, data, len(key) + len(data), now))
+        try:
+            with self._lock:
+                self._conn.execute("BEGIN IMMEDIATE")
+                # Delete the replaced entries explicitly, as the replacement by a conflict does not fire the delete trigger
+                self._conn.executemany("DELETE FROM results WHERE key = ?", ((item[0],) for item in items))
+                self._conn.executemany("INSERT INTO results VALUES (?, ?, ?, ?)", items)
+                self._evict()
+                self._conn.execute("COMMIT")
+        except sqlite3.Error as err:
+            self._rollback()
+            logger.warning("Failed to write the result cache %s: %s", self.path, err)
+
+    def size(self) -> int:
+        """Total size of the cached entries in bytes."""
+        with self._lock:
+            return self._total()
+
+    def _evict(self) -> None:
+        """Drop the least recently used entries until the cache is under 90% of the size limit. Run within a transaction."""
+        total = self._total()
+        if total <= self.max_size:
+            return
+        target = total - int(self.max_size * 0.9)
+        evicted, freed = [], 0
+        for key, size in self._conn.execute("SELECT key, size FROM results ORDER BY atime"):
+            evicted.append((key,))
+            freed += size
+            if freed >= target:
+                break
+        self._conn.executemany("DELETE FROM results WHERE key = ?", evicted)
+        logger.debug(f"Evicted {len(evicted)} entries ({freed} bytes) from the result cache.")
+
+    def _total(self) -> int:
+        return self._conn.execute("SELECT total FROM meta").fetchone()[0]
+
+    def _rollback(self) -> None:
+        if self._conn.in_transaction:
+            self._conn.execute("ROLLBACK")
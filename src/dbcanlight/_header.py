@@ -32,5 +32,9 @@ class Headers:
         "send",
         "evalue",
         "bitscore",
+        "qlen",
+        "slen",
+        "qcovhsp",
+        "scovhsp",
     )
     overview: tuple = ("Gene_ID", "EC", *[f"{mode}_fam" for mode in AVAIL_MODES], "Substrate", "#ofTools")
@@ -0,0 +1,171 @@
+"""Offset index of the sequences of a fasta file (internal use only)."""
+
+from __future__ import annotations
+
+import bisect
+import contextlib
+import itertools
+import os
+import struct
+import sys
+from array import array
+from pathlib import Path
+from typing import BinaryIO
+
+from . import logger
+from ._input import detect_format, open_range
+
+INDEX_SUFFIX = ".dbi"
+_MAGIC = b"DBCLIDX2"
+# Magic, size and mtime of the fasta, number of sequences and bytes of the names
+_HEADER = struct.Struct("<8sQqQQ")
+
+
+class FastaIndex:
+    """Byte offset, length and residue count of every sequence of a plain fasta, kept in the sidecar file <fasta>.dbi.
+
+    The index is invalidated once the size or the modification time of the fasta changes.
+    """
+
+    def __init__(self, fasta: str | Path, names: list[str], offsets: array, lengths: array, residues: array) -> None:
+        self.fasta = Path(fasta)
+        self.names = names
+        self.offsets = offsets
+        self.lengths = lengths
+        self.residues = residues
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    @property
+    def path(self) -> Path:
+        return _index_path(self.fasta)
+
+    @classmethod
+    def build(cls, fasta: str | Path) -> FastaIndex:
+        """Index the fasta in a single pass."""
+        fmt = detect_format(fasta)
+        if fmt != "plain":
+            raise ValueError(f"{fasta} is {fmt} compressed. Only the plain fasta can be indexed.")
+        names, offsets, lengths, residues = [], array("Q"), array("Q"), array("Q")
+        offset = 0
+        with open(fasta, "rb") as f:
+            for line in f:
+                if line.startswith(b">"):
+                    if offsets:
+                        lengths.append(offset - offsets[-1])
+                    name = line[1:].split(maxsplit=1)
+                    names.append(name[0].decode() if name else "")
+                    offsets.append(offset)
+                    residues.append(0)
+                elif offsets:
+                    residues[-1] += len(line.rstrip())
+                offset += len(line)
+        if offsets:
+            lengths.append(offset - offsets[-1])
+        return cls(fasta, names, offsets, lengths, residues)
+
+    @classmethod
+    def load(cls, fasta: str | Path) -> FastaIndex | None:
+        """Load the index of the fasta. Return None if it is not indexed, or the index is outdated or corrupted.
+
+        The index is corrupted if its size does not match the header, e.g. truncated, or its offsets do not add up to the size of
+        the fasta. The index of an older format is treated as outdated.
+        """
+        path = _index_path(fasta)
+        if not path.is_file():
+            return None
+        stat = os.stat(fasta)
+        with open(path, "rb") as f:
+            header = f.read(_HEADER.size)
+            if len(header) < _HEADER.size or header[: len(_MAGIC)] != _MAGIC:
+                logger.warning(f"{path} is outdated or corrupted. Index {fasta} again to use it.")
+                return None
+            _, size, mtime, count, names_size = _HEADER.unpack(header)
+            if size != stat.st_size or mtime != stat.st_mtime_ns:
+                logger.warning(f"{path} is outdated. Index {fasta} again to use it.")
+                return None
+            if os.fstat(f.fileno()).st_size != _HEADER.size + 3 * 8 * count + names_size:
+                logger.warning(f"{path} is corrupted. Index {fasta} again to use it.")
+                return None
+            arrays = []
+            for _ in range(3):
+                arr = array("Q")
+                arr.fromfile(f, count)
+                if sys.byteorder == "big":
+                    arr.byteswap()
+                arrays.append(arr)
+            names = f.read().decode(errors="replace").split("\n") if count else []
+        offsets, lengths, _ = arrays
+        if len(names) != count or (count and offsets[-1] + lengths[-1] != stat.st_size):
+            logger.warning(f"{path} is corrupted. Index {fasta} again to use it.")
+            return None
+        return cls(fasta, names, *arrays)
+
+    @classmethod
+    def open_or_build(cls, fasta: str | Path) -> FastaIndex:
+        """Load the index of the fasta, or build and save it if it is not indexed or the index is outdated.
+
+        The index is kept in memory only if it cannot be written next to the fasta, e.g. in a read-only folder.
+        """
+        index = cls.load(fasta)
+        if index is None:
+            logger.info(f"Indexing {fasta}...")
+            index = cls.build(fasta)
+            try:
+                index.save()
+            except OSError as err:
+                logger.warning(f"Failed to write the index {index.path}: {err}. The index is used without saving it.")
+                with contextlib.suppress(OSError):
+                    index.path.unlink()
+        return index
+
+    def save(self) -> None:
+        """Write the index next to the fasta."""
+        stat = os.stat(self.fasta)
+        names = "\n".join(self.names).encode()
+        with open(self.path, "wb") as f:
+            f.write(_HEADER.pack(_MAGIC, stat.st_size, stat.st_mtime_ns, len(self), len(names)))
+            for arr in (self.offsets, self.lengths, self.residues):
+                if sys.byteorder == "big":
+                    arr = array("Q", arr)
+                    arr.byteswap()
+                arr.tofile(f)
+            f.write(names)
+
+    def find(self, name: str) -> int:
+        """Position of the sequence of the name in the fasta."""
+        try:
+            return self.names.index(name)
+        except ValueError:
+            raise KeyError(f"{name} is not found in {self.fasta}.")
+
+    def shard(self, shard: int, shards: int, *, start: int = 0) -> tuple[int, int]:
+        """Range [begin, end) of the sequences in the shard-th (0-based) of the shards split from the start by residues."""
+        cumulative = list(itertools.accumulate(self.residues[start:]))
+        total = cumulative[-1] if cumulative else 0
+
+        def bound(i: int) -> int:
+            if i == 0:
+                return start
+            if i == shards:
+                return len(self)
+            target = total * i / shards
+            n = bisect.bisect_left(cumulative, target)
+            # Cut after the sequence crossing the target if the cut is closer to the target
+            if n < len(cumulative) and cumulative[n] - target < target - (cumulative[n - 1] if n else 0):
+                n += 1
+            return start + n
+
+        return bound(shard), bound(shard + 1)
+
+    def open(self, begin: int, end: int) -> BinaryIO:
+        """Open the sequences in the range [begin, end) as a fasta stream."""
+        if begin >= end:
+            return open_range(self.fasta, 0, 0)
+        return open_range(self.fasta, self.offsets[begin], self.offsets[end - 1] + self.lengths[end - 1])
+
+
+def _index_path(fasta: str | Path) -> Path:
+    fasta = Path(fasta)
+    return fasta.with_name(fasta.name + INDEX_SUFFIX)
@@ -0,0 +1,208 @@
+"""Readers of the plain and compressed fasta inputs (internal use only)."""
+
+from __future__ import annotations
+
+import collections
+import contextlib
+import io
+import queue
+import struct
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import BinaryIO, Callable, Iterator, Literal
+
+import pyhmmer
+
+_CHUNK_SIZE = 2**20
+_QUEUE_SIZE = 16
+
+
+def detect_format(path: str | Path) -> Literal["plain", "gzip", "bgzf", "zstd"]:
+    """Detect the compression of the file from its magic bytes."""
+    with open(path, "rb") as f:
+        header = f.read(16)
+    if header[:4] == b"\x28\xb5\x2f\xfd":
+        return "zstd"
+    if header[:2] == b"\x1f\x8b":
+        # BGZF is a series of gzip members with the block size in the "BC" extra subfield
+        if len(header) >= 14 and header[3] & 4 and header[12:14] == b"BC":
+            return "bgzf"
+        return "gzip"
+    return "plain"
+
+
+def open_input(path: str | Path, *, threads: int = 1) -> BinaryIO:
+    """Open the file as a stream of decompressed bytes.
+
+    The compressed inputs are decompressed ahead in a background thread so the decompression runs alongside the search. The
+    blocks of BGZF are decompressed in parallel by the given threads. Gzip and zstd are decompressed on that one background
+    thread regardless of the threads, since neither the gzip stream nor the streaming decompressor of zstandard can be split
+    across threads. Reading zstd requires the zstandard package.
+    """
+    fmt = detect_format(path)
+    if fmt == "plain":
+        return open(path, "rb")
+    if fmt == "gzip":
+        return io.BufferedReader(_Prefetcher(lambda: _inflate(path)), buffer_size=_CHUNK_SIZE)
+    if fmt == "bgzf":
+        return io.BufferedReader(_Prefetcher(lambda: _inflate_bgzf(path, threads=threads)), buffer_size=_CHUNK_SIZE)
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError(
+            f"zstandard is required to read the zstd compressed {path}. Install it by pip install 'dbcanlight[zstd]'."
+        )
+
+    def decompress() -> Iterator[bytes]:
+        with open(path, "rb") as f, zstandard.ZstdDecompressor().stream_reader(f, read_across_frames=True) as reader:
+            yield from iter(lambda: reader.read(_CHUNK_SIZE), b"")
+
+    return io.BufferedReader(_Prefetcher(decompress), buffer_size=_CHUNK_SIZE)
+
+
+def open_range(path: str | Path, begin: int, end: int) -> BinaryIO:
+    """Open the byte range [begin, end) of the plain file as a stream."""
+    return io.BufferedReader(_Range(path, begin, end), buffer_size=_CHUNK_SIZE)
+
+
+@contextlib.contextmanager
+def sequence_file(
+    path: str | Path | BinaryIO, *, digital: bool = False, threads: int = 1
+) -> Iterator[pyhmmer.easel.SequenceFile]:
+    """Open the plain or compressed fasta, or the fasta stream which is closed afterward, as a pyhmmer SequenceFile."""
+    if not isinstance(path, (str, Path)):
+        with path, pyhmmer.easel.SequenceFile(path, digital=digital, format="fasta") as seq_file:
+            yield seq_file
+    elif detect_format(path) == "plain":
+        with pyhmmer.easel.SequenceFile(Path(path), digital=digital) as seq_file:
+            yield seq_file
+    else:
+        with open_input(path, threads=threads) as handle, pyhmmer.easel.SequenceFile(handle, digital=digital) as seq_file:
+            yield seq_file
+
+
+def _inflate(path: str | Path) -> Iterator[bytes]:
+    """Decompress a gzip file, including the ones concatenated from multiple members."""
+    decompressor, started = zlib.decompressobj(wbits=31), False
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_CHUNK_SIZE), b""):
+            while chunk:
+                yield decompressor.decompress(chunk)
+                started = True
+                if not decompressor.eof:
+                    break
+                yield decompressor.flush()
+                chunk = decompressor.unused_data
+                decompressor, started = zlib.decompressobj(wbits=31), False
+    if started:
+        raise EOFError(f"{path} ended before the end-of-stream marker was reached.")
+
+
+def _bgzf_blocks(path: str | Path) -> Iterator[bytes]:
+    """Read the compressed blocks of a BGZF file."""
+    with open(path, "rb") as f:
+        while True:
+            header = f.read(12)
+            if not header:
+                return
+            xlen = struct.unpack("<H", header[10:12])[0]
+            extra = f.read(xlen)
+            bsize = None
+            offset = 0
+            while offset < xlen:
+                subfield, length = extra[offset : offset + 2], struct.unpack("<H", extra[offset + 2 : offset + 4])[0]
+                if subfield == b"BC":
+                    bsize = struct.unpack("<H", extra[offset + 4 : offset + 6])[0]
+                offset += 4 + length
+            if bsize is None:
+                raise ValueError(f"{path} is not a valid BGZF file.")
+            yield header + extra + f.read(bsize - xlen - 11)
+
+
+def _inflate_bgzf(path: str | Path, *, threads: int) -> Iterator[bytes]:
+    """Decompress the blocks of a BGZF file in parallel while keeping their order."""
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        pending = collections.deque()
+        for block in _bgzf_blocks(path):
+            pending.append(executor.submit(zlib.decompress, block, 31))
+            if len(pending) >= threads * 16:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+class _Prefetcher(io.RawIOBase):
+    """Readable stream of the chunks produced by a generator running in a background thread."""
+
+    def __init__(self, producer: Callable[[], Iterator[bytes]]) -> None:
+        self._queue: queue.Queue = queue.Queue(maxsize=_QUEUE_SIZE)
+        self._stop = threading.Event()
+        self._buffer = memoryview(b"")
+        self._eof = False
+        self._thread = threading.Thread(target=self._run, args=(producer,), daemon=True)
+        self._thread.start()
+
+    def _run(self, producer: Callable[[], Iterator[bytes]]) -> None:
+        try:
+            for chunk in producer():
+                if chunk and not self._put(chunk):
+                    return
+            self._put(None)
+        except Exception as err:  # noqa: BLE001
+            # Raised in the reading thread
+            self._put(err)
+
+    def _put(self, item) -> bool:
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        while not self._buffer and not self._eof:
+            item = self._queue.get()
+            if item is None:
+                self._eof = True
+            elif isinstance(item, Exception):
+                self._eof = True
+                raise item
+            else:
+                self._buffer = memoryview(item)
+        n = min(len(b), len(self._buffer))
+        b[:n] = self._buffer[:n]
+        self._buffer = self._buffer[n:]
+        return n
+
+    def close(self) -> None:
+        self._stop.set()
+        self._thread.join()
+        super().close()
+
+
+class _Range(io.RawIOBase):
+    """Readable stream of a byte range of a file."""
+
+    def __init__(self, path: str | Path, begin: int, end: int) -> None:
+        self._file = open(path, "rb")
+        self._file.seek(begin)
+        self._remaining = end - begin
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        n = self._file.readinto(memoryview(b)[: min(len(b), self._remaining)])
+        self._remaining -= n
+        return n
+
+    def close(self) -> None:
+        self._file.close()
+        super().close()
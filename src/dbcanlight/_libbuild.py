@@ -2,40 +2,74 @@ from __future__ import annotations
 
 from pathlib import Path
 
+import urllib3
+
 from . import DB_PATH, logger
-from ._utils import Downloader
+from ._utils import Downloader, http_cache, http_pool
 from .libdiamond import diamond_build
-from .libhmm import press_hmms
+from .libhmm import press_hmms, write_profile_checksums
+
+
+def _not_modified(url: str, filepath: Path, *, md5: str | None = None) -> bool:
+    """Whether the server still serves the local copy downloaded earlier from the url.
+
+    The local copy is always considered modified if it does not match the md5 checksum in the database metadata.
+    """
+    cache = http_cache()
+    if not filepath.is_file() or cache.get(url).get("md5") != cache.md5(filepath):
+        return False
+    if md5 and cache.md5(filepath) != md5:
+        return False
+    if cache.fresh(url):
+        return True
+    headers = cache.conditional_headers(url)
+    if not headers:
+        return False
+    try:
+        response = http_pool().request("HEAD", url, headers=headers, retries=False)
+    except urllib3.exceptions.HTTPError as err:
+        logger.debug("Conditional request to %s failed: %s", url, err)
+        return False
+    if response.status == 304:
+        cache.update(url, response.headers)
+        return True
+    return False
 
 
-def _download(url: str, filepath: Path, *, threads: int = 1):
+def _download(url: str, filepath: Path, *, md5: str | None = None, threads: int = 1):
+    if _not_modified(url, filepath, md5=md5):
+        logger.info("%s not modified since the last download. Skip downloading.", url)
+        return
     filepath.unlink(missing_ok=True)
-    Downloader(url, filepath, overwrite=True, threads=threads)
+    downloader = Downloader(url, filepath, overwrite=True, threads=threads)
+    cache = http_cache()
+    cache.update(url, downloader.headers, md5=cache.md5(filepath))
 
 
 def _hmms(db_file: Path):
-    hmm_binaries = [Path(f"{db_file}.{suffix}") for suffix in ("h3f", "h3i", "h3m", "h3p")]
+    hmm_binaries = [Path(f"{db_file}.{suffix}") for suffix in ("h3f", "h3i", "h3m", "h3p", "press.json", "profiles.json")]
     for hmm_binary in hmm_binaries:
         hmm_binary.unlink(missing_ok=True)
     logger.info("Running hmmpress...")
     press_hmms(db_file)
+    write_profile_checksums(db_file)
 
 
-def cazyme_hmms(url: str, filepath: Path, *, threads: int = 1):
-    _download(url, filepath, threads=threads)
+def cazyme_hmms(url: str, filepath: Path, *, md5: str | None = None, threads: int = 1):
+    _download(url, filepath, md5=md5, threads=threads)
     _hmms(Path(DB_PATH["cazyme_hmms"]))
 
 
-def subs_hmms(url: str, filepath: Path, *, threads: int = 1):
-    _download(url, filepath, threads=threads)
+def subs_hmms(url: str, filepath: Path, *, md5: str | None = None, threads: int = 1):
+    _download(url, filepath, md5=md5, threads=threads)
     _hmms(Path(DB_PATH["subs_hmms"]))
 
 
-def subs_mapper(url: str, filepath: Path, *, threads: int = 1):
-    _download(url, filepath, threads=threads)
+def subs_mapper(url: str, filepath: Path, *, md5: str | None = None, threads: int = 1):
+    _download(url, filepath, md5=md5, threads=threads)
 
 
-def diamond(url, filepath, *, threads: int = 1):
-    _download(url, filepath, threads=threads)
+def diamond(url, filepath, *, md5: str | None = None, threads: int = 1):
+    _download(url, filepath, md5=md5, threads=threads)
     logger.info("Building diamond database...")
     diamond_build(filepath, Path(DB_PATH["diamond"]), threads=threads)
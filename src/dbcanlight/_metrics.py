@@ -0,0 +1,432 @@
+"""Per-stage timing and throughput metrics (internal use only)."""
+
+from __future__ import annotations
+
+import cProfile
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from pathlib import Path
+from typing import Any, Callable, Generator, Iterable, Iterator, TypeVar
+
+from . import AVAIL_CPUS, CPUS_SOURCE, VERSION, logger
+
+_C = TypeVar("Callable", bound=Callable[..., Any])
+_T = TypeVar("_T")
+
+
+def peak_rss() -> int | None:
+    """Peak resident set size of the process in bytes. Return None if not supported on the platform."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+
+def current_rss() -> int | None:
+    """Current resident set size of the process in bytes. Return None if not supported on the platform."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return peak_rss()
+
+
+def available_memory() -> int | None:
+    """Memory the process can use in bytes, i.e. the lesser of the cgroup limit and the available memory of the system plus the
+    current RSS. Return None if unknown.
+    """
+    limits = []
+    try:
+        with open("/proc/self/cgroup") as f:
+            paths = {
+                controller: path.strip().lstrip("/")
+                for _, controllers, path in (line.split(":", 2) for line in f)
+                for controller in controllers.split(",")
+            }
+    except OSError:
+        paths = {}
+    root = Path("/sys/fs/cgroup")
+    for file in (
+        root / paths.get("", "") / "memory.max",
+        root / "memory.max",
+        root / "memory" / paths.get("memory", "") / "memory.limit_in_bytes",
+        root / "memory" / "memory.limit_in_bytes",
+    ):
+        try:
+            value = file.read_text().strip()
+        except OSError:
+            continue
+        if value.isdigit():
+            limits.append(int(value))
+        break
+    try:
+        with open("/proc/meminfo") as f:
+            meminfo = dict(line.split(":", 1) for line in f)
+        limits.append(int(meminfo["MemAvailable"].split()[0]) * 1024 + (current_rss() or 0))
+    except (OSError, KeyError, ValueError):
+        pass
+    return min(limits) if limits else None
+
+
+class Metrics:
+    """Recorder of the wall/CPU time spent in each stage and the per-block throughput.
+
+    Stages can be nested, e.g. a lazy generator pulling from another timed generator, and only the time exclusively spent in a
+    stage is accounted to it, so the stage times add up to the total time. CPU time is the process time, which includes the
+    threads spawned by pyhmmer. Nothing is recorded unless enabled.
+    """
+
+    def __init__(self) -> None:
+        self.reset()
+
+    def reset(self, enabled: bool = False) -> None:
+        """Clear the recorded metrics."""
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._start = (time.perf_counter(), time.process_time())
+        self.stages: dict[str, dict[str, float]] = {}
+        self.blocks: list[dict[str, Any]] = []
+        self.counters: dict[str, int] = {}
+        self.info: dict[str, Any] = {}
+
+    @property
+    def _stack(self) -> list[list]:
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    def _account(self, name: str, wall: float, cpu: float, calls: int = 0) -> None:
+        with self._lock:
+            stage = self.stages.setdefault(name, {"wall": 0.0, "cpu": 0.0, "calls": 0})
+            stage["wall"] += wall
+            stage["cpu"] += cpu
+            stage["calls"] += calls
+
+    @contextmanager
+    def stage(self, name: str) -> Generator[None, None, None]:
+        """Time the code run in the context as the given stage."""
+        if not self.enabled:
+            yield
+            return
+        stack = self._stack
+        now = (time.perf_counter(), time.process_time())
+        if stack:
+            parent = stack[-1]
+            self._account(parent[0], now[0] - parent[1], now[1] - parent[2])
+        stack.append([name, *now])
+        try:
+            yield
+        finally:
+            end = (time.perf_counter(), time.process_time())
+            _, wall_start, cpu_start = stack.pop()
+            self._account(name, end[0] - wall_start, end[1] - cpu_start, 1)
+            if stack:
+                stack[-1][1:] = end
+
+    def timed(self, name: str, iterable: Iterable[_T]) -> Iterator[_T]:
+        """Time the iteration over a (lazy) iterable as the given stage."""
+        if not self.enabled:
+            yield from iterable
+            return
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def count(self, name: str, n: int = 1) -> None:
+        """Increase the counter."""
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def block(self, **fields) -> None:
+        """Record the metrics of a block."""
+        if not self.enabled:
+            return
+        fields.setdefault("rss_bytes", current_rss())
+        with self._lock:
+            self.blocks.append(fields)
+
+    def report(self) -> dict[str, Any]:
+        """Summarize the recorded metrics."""
+        wall = time.perf_counter() - self._start[0]
+        cpu = time.process_time() - self._start[1]
+        throughput = {f"{name}_per_second": n / wall if wall else 0.0 for name, n in self.counters.items()}
+        return {
+            "version": VERSION,
+            "avail_cpus": AVAIL_CPUS,
+            "cpus_source": CPUS_SOURCE,
+            **self.info,
+            "wall_seconds": wall,
+            "cpu_seconds": cpu,
+            "peak_rss_bytes": peak_rss(),
+            "counters": dict(self.counters),
+            "throughput": throughput,
+            "stages": {name: dict(stage) for name, stage in self.stages.items()},
+            "blocks": list(self.blocks),
+        }
+
+    def dump(self, output: str | Path) -> None:
+        """Write the report in Prometheus textfile format if the file ends with .prom, otherwise in json."""
+        output = Path(output)
+        output.parent.mkdir(parents=True, exist_ok=True)
+        report = self.report()
+        with open(output, "w") as f:
+            if output.suffix == ".prom":
+                f.write(_prometheus(report))
+            else:
+                json.dump(report, f, indent=4, default=str)
+        logger.info(f"Metrics written to {output}")
+
+
+def _prometheus(report: dict[str, Any]) -> str:
+    """Format the report in Prometheus text exposition format."""
+    labels = ",".join(f'{key}="{report[key]}"' for key in ("command", "mode") if key in report)
+    lines = []
+    described = set()
+
+    def metric(name: str, value: float | None, help: str, extra: str = "") -> None:
+        if value is None:
+            return
+        label = ",".join(x for x in (labels, extra) if x)
+        if name not in described:
+            described.add(name)
+            lines.append(f"# HELP dbcanlight_{name} {help}")
+            lines.append(f"# TYPE dbcanlight_{name} gauge")
+        lines.append(f"dbcanlight_{name}{{{label}}} {value}")
+
+    metric("wall_seconds", report["wall_seconds"], "Total wall time.")
+    metric("cpu_seconds", report["cpu_seconds"], "Total CPU time.")
+    metric("peak_rss_bytes", report["peak_rss_bytes"], "Peak resident set size.")
+    metric("avail_cpus", report["avail_cpus"], "CPUs available to the process.", f'source="{report["cpus_source"]}"')
+    for name, stage in report["stages"].items():
+        metric("stage_wall_seconds", stage["wall"], "Wall time spent in the stage.", f'stage="{name}"')
+    for name, stage in report["stages"].items():
+        metric("stage_cpu_seconds", stage["cpu"], "CPU time spent in the stage.", f'stage="{name}"')
+    for name, n in report["counters"].items():
+        metric(f"{name}_total", n, f"Number of {name} processed.")
+    for name, rate in report["throughput"].items():
+        metric(name, rate, f"Throughput of {name.replace('_per_second', '')}.")
+    return "\n".join(lines) + "\n"
+
+
+@contextmanager
+def profiler(output: str | Path | None) -> Generator[None, None, None]:
+    """Profile the code run in the context with cProfile, or with pyinstrument if the output ends with .html."""
+    if not output:
+        yield
+        return
+    output = Path(output)
+    if output.suffix == ".html":
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            raise ImportError("pyinstrument is required to output the profile in html.")
+        profile = Profiler()
+        profile.start()
+        try:
+            yield
+        finally:
+            profile.stop()
+            output.write_text(profile.output_html())
+    else:
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            profile.dump_stats(output)
+    logger.info(f"Profile written to {output}")
+
+
+def record_metrics(command: str) -> _C:
+    """Decorator that reset the metrics before running a module and write them to the file given by the metrics argument."""
+
+    def decorator(func: _C) -> _C:
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            output = kwargs.get("metrics")
+            metrics.reset(enabled=bool(output))
+            metrics.info.update(
+                {"command": command, **{k: v for k, v in kwargs.items() if k in ("mode", "threads", "blocksize")}}
+            )
+            try:
+                return func(*args, **kwargs)
+            finally:
+                if output:
+                    metrics.dump(output)
+                metrics.reset()
+
+        return wrapper
+
+    return decorator
+
+
+class Progress:
+    """Reporter of the residues searched, the throughput, the ETA and the current RSS while searching.
+
+    The progress is drawn as a bar on the terminal, written as plain lines if stderr is not a terminal, or appended as json lines
+    to a file. It is reported at the end of each block and every interval (in seconds) in between, so a stuck job is still seen
+    alive with its RSS. Nothing is reported unless tracking.
+    """
+
+    def __init__(self) -> None:
+        self.enabled = False
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def track(
+        self, output: str | Path | None, *, total: int | None, estimated: bool = False, interval: float = 30.0
+    ) -> Generator[None, None, None]:
+        """Report the progress to the output, or to stderr if "-", while running the code in the context.
+
+        The total is the number of residues to search, or its upper bound if estimated, e.g. from the file size. The ETA is not
+        reported if the total is unknown.
+        """
+        if not output:
+            yield
+            return
+        self._output = None if str(output) == "-" else Path(output)
+        self._tty = self._output is None and sys.stderr.isatty()
+        self._total, self._estimated = total, estimated
+        self._start = time.perf_counter()
+        self._blocks = self._sequences = self._residues = 0
+        self._block_rate = None
+        if self._output:
+            self._output.parent.mkdir(parents=True, exist_ok=True)
+        self._handle = open(self._output, "a") if self._output else sys.stderr
+        self._clear = _ClearLine(self._handle) if self._tty else None
+        for handler in logging.getLogger().handlers if self._clear else ():
+            handler.addFilter(self._clear)
+        stop = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(stop, 1.0 if self._tty else interval), daemon=True)
+        self.enabled = True
+        heartbeat.start()
+        try:
+            yield
+            with self._lock:
+                # All the residues are searched
+                self._total, self._estimated = self._residues, False
+        finally:
+            stop.set()
+            heartbeat.join()
+            self.enabled = False
+            self._emit(done=True)
+            for handler in logging.getLogger().handlers if self._clear else ():
+                handler.removeFilter(self._clear)
+            if self._output:
+                self._handle.close()
+
+    def advance(self, *, sequences: int, residues: int, wall: float) -> None:
+        """Add the block of the sequences and residues searched in the wall time."""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._blocks += 1
+            self._sequences += sequences
+            self._residues += residues
+            self._block_rate = residues / wall if wall else None
+        self._emit()
+
+    def _heartbeat(self, stop: threading.Event, interval: float) -> None:
+        while not stop.wait(interval):
+            self._emit()
+
+    def snapshot(self) -> dict[str, Any]:
+        """Current progress of the search."""
+        with self._lock:
+            elapsed = time.perf_counter() - self._start
+            rate = self._residues / elapsed if elapsed else 0.0
+            total = max(self._total, self._residues) if self._total is not None else None
+            return {
+                "time": time.time(),
+                "elapsed_seconds": elapsed,
+                "blocks": self._blocks,
+                "sequences": self._sequences,
+                "residues": self._residues,
+                "total_residues": total,
+                "estimated_total": self._estimated,
+                "fraction": self._residues / total if total else None,
+                "residues_per_second": rate,
+                "block_residues_per_second": self._block_rate,
+                "eta_seconds": (total - self._residues) / rate if total is not None and rate else None,
+                "rss_bytes": current_rss(),
+            }
+
+    def _emit(self, *, done: bool = False) -> None:
+        snapshot = self.snapshot()
+        with self._lock:
+            if self._output:
+                self._handle.write(json.dumps({**snapshot, "done": done}) + "\n")
+            elif self._tty:
+                self._handle.write("\r\x1b[K" + _progress_line(snapshot, bar=True) + ("\n" if done else ""))
+                self._clear.drawn = not done
+            else:
+                self._handle.write(_progress_line(snapshot, bar=False) + "\n")
+            self._handle.flush()
+
+
+class _ClearLine(logging.Filter):
+    """Logging filter which clears the progress bar before a log record is printed below it."""
+
+    def __init__(self, handle) -> None:
+        super().__init__()
+        self.handle = handle
+        self.drawn = False
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.drawn:
+            self.handle.write("\r\x1b[K")
+            self.drawn = False
+        return True
+
+
+def _progress_line(snapshot: dict[str, Any], *, bar: bool) -> str:
+    """Format the progress snapshot as a line."""
+    fields = []
+    if snapshot["fraction"] is not None:
+        if bar:
+            filled = int(snapshot["fraction"] * 30)
+            fields.append(f"[{'#' * filled}{'.' * (30 - filled)}]")
+        fields.append(f"{snapshot['fraction']:.1%}{'~' if snapshot['estimated_total'] else ''}")
+    total = f"/{_human(snapshot['total_residues'])}" if snapshot["total_residues"] is not None else ""
+    fields.append(f"{_human(snapshot['residues'])}{total} residues")
+    fields.append(f"{_human(snapshot['residues_per_second'])} res/s")
+    if snapshot["eta_seconds"] is not None:
+        fields.append(f"ETA {_duration(snapshot['eta_seconds'])}")
+    fields.append(f"elapsed {_duration(snapshot['elapsed_seconds'])}")
+    if snapshot["rss_bytes"] is not None:
+        fields.append(f"RSS {snapshot['rss_bytes'] / 2**30:.2f} GB")
+    return " ".join(fields)
+
+
+def _duration(seconds: float) -> str:
+    seconds = int(seconds)
+    return f"{seconds // 3600}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+def _human(n: float) -> str:
+    for unit in ("", "k", "M", "G"):
+        if abs(n) < 1000:
+            break
+        n /= 1000
+    return f"{n:.3g}{unit}" if unit else f"{n:.0f}"
+
+
+metrics = Metrics()
+progress = Progress()
@@ -0,0 +1,233 @@
+"""SQLite store of the results of many samples for cross-sample queries (internal use only)."""
+
+from __future__ import annotations
+
+import contextlib
+import itertools
+import re
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Generator, Iterable, Sequence
+
+from . import AVAIL_MODES, logger
+from ._header import Headers
+from .libdiamond import sseqid_families
+from .libhmm import _profile_label
+
+_BATCH_SIZE = 10000
+_STAGING = itertools.count()
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS samples (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE);
+CREATE TABLE IF NOT EXISTS hits (
+    sample_id INTEGER NOT NULL, mode TEXT NOT NULL, gene TEXT NOT NULL, family TEXT NOT NULL, evalue REAL, line TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS hits_sample ON hits (sample_id, mode);
+CREATE INDEX IF NOT EXISTS hits_gene ON hits (gene);
+CREATE INDEX IF NOT EXISTS hits_family ON hits (family);
+CREATE TABLE IF NOT EXISTS overview (
+    sample_id INTEGER NOT NULL, gene TEXT NOT NULL, line TEXT NOT NULL, PRIMARY KEY (sample_id, gene)
+);
+CREATE INDEX IF NOT EXISTS overview_gene ON overview (gene);
+CREATE TABLE IF NOT EXISTS annotations (sample_id INTEGER NOT NULL, gene TEXT NOT NULL, kind TEXT NOT NULL, value TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS annotations_value ON annotations (kind, value);
+CREATE INDEX IF NOT EXISTS annotations_gene ON annotations (sample_id, gene);
+"""
+
+
+class ResultStore:
+    """Results of the search and conclude modules of many samples in a SQLite database.
+
+    The hits of each mode and the overview rows are stored under the sample name, and the families, ECs and substrates of each
+    gene in the overview are indexed for the lookups across the samples. Storing the results of a sample again replaces the
+    previous ones. The results are staged in temporary tables and swapped in at once, so an interrupted run keeps the previous
+    results. The database is in WAL mode and can be written by parallel jobs; writers wait for each other.
+    """
+
+    def __init__(self, path: str | Path, *, timeout: float = 60.0) -> None:
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(self.path, timeout=timeout, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+
+    def close(self) -> None:
+        self._conn.close()
+
+    def __enter__(self) -> ResultStore:
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def record_hits(self, lines: Iterable[list], *, sample: str, mode: str) -> Generator[list, None, None]:
+        """Pass the result lines of the mode through and store them under the sample once all of them are passed."""
+        sample_id = self._sample_id(sample)
+        with self._staging("hits") as hits:
+            batch = []
+            for line in lines:
+                batch.extend((sample_id, mode, *row) for row in _hit_rows(line, mode))
+                yield line
+                if len(batch) >= _BATCH_SIZE:
+                    self._insert((f"INSERT INTO {hits} VALUES (?, ?, ?, ?, ?, ?)", batch))
+                    batch = []
+            self._insert((f"INSERT INTO {hits} VALUES (?, ?, ?, ?, ?, ?)", batch))
+            self._swap(
+                ("DELETE FROM hits WHERE sample_id = ? AND mode = ?", (sample_id, mode)),
+                (f"INSERT INTO hits SELECT * FROM {hits}", ()),
+            )
+
+    def record_overview(self, lines: Iterable[list], *, sample: str) -> Generator[list, None, None]:
+        """Pass the overview lines through and store them under the sample with the annotations of each gene once all of them
+        are passed.
+        """
+        sample_id = self._sample_id(sample)
+        with self._staging("overview") as overview, self._staging("annotations") as annotations:
+            rows, gene_annotations = [], []
+            for line in lines:
+                rows.append((sample_id, line[0], "\t".join(str(x) for x in line)))
+                gene_annotations.extend((sample_id, line[0], kind, value) for kind, value in set(_annotations(line)))
+                yield line
+                if len(rows) >= _BATCH_SIZE:
+                    self._insert_overview(rows, gene_annotations, tables=(overview, annotations))
+                    rows, gene_annotations = [], []
+            self._insert_overview(rows, gene_annotations, tables=(overview, annotations))
+            self._swap(
+                ("DELETE FROM overview WHERE sample_id = ?", (sample_id,)),
+                ("DELETE FROM annotations WHERE sample_id = ?", (sample_id,)),
+                (f"INSERT INTO overview SELECT * FROM {overview}", ()),
+                (f"INSERT INTO annotations SELECT * FROM {annotations}", ()),
+            )
+
+    def query(
+        self,
+        *,
+        mode: str | None = None,
+        family: Sequence[str] = (),
+        substrate: Sequence[str] = (),
+        ec: Sequence[str] = (),
+        sample: Sequence[str] = (),
+        gene: Sequence[str] = (),
+    ) -> Generator[list[str], None, None]:
+        """Yield the overview rows, or the hits of the mode, with the sample name prepended, that match all the criteria.
+
+        The genes must have all the given families, substrates and ECs. The substrates and ECs are only available in the overview.
+        """
+        if mode and (substrate or ec):
+            raise ValueError("The substrates and ECs can only be queried from the overview.")
+        table = "hits" if mode else "overview"
+        where, params = [], []
+        if mode:
+            where.append("t.mode = ?")
+            params.append(mode)
+        for column, values in (("s.name", sample), ("t.gene", gene)):
+            if values:
+                where.append(f"{column} IN ({','.join('?' * len(values))})")
+                params.extend(values)
+        if mode:
+            for value in family:
+                where.append("EXISTS (SELECT 1 FROM hits h WHERE h.sample_id = t.sample_id AND h.gene = t.gene AND h.family = ?)")
+                params.append(value)
+        else:
+            for kind, values in (("family", family), ("substrate", substrate), ("ec", ec)):
+                for value in values:
+                    where.append(
+                        "EXISTS (SELECT 1 FROM annotations a WHERE a.sample_id = t.sample_id AND a.gene = t.gene "
+                        "AND a.kind = ? AND a.value = ?)"
+                    )
+                    params.extend((kind, value))
+        sql = f"SELECT DISTINCT s.name, t.line FROM {table} t JOIN samples s ON s.id = t.sample_id"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY s.name, t.rowid"
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        for name, line in rows:
+            yield [name, *line.split("\t")]
+
+    def _sample_id(self, sample: str) -> int:
+        with self._lock:
+            self._conn.execute("INSERT OR IGNORE INTO samples (name) VALUES (?)", (sample,))
+            return self._conn.execute("SELECT id FROM samples WHERE name = ?", (sample,)).fetchone()[0]
+
+    @contextlib.contextmanager
+    def _staging(self, table: str) -> Generator[str, None, None]:
+        """Temporary table of the same columns as the table, dropped afterward."""
+        staging = f"temp.staging_{table}_{next(_STAGING)}"
+        with self._lock:
+            self._conn.execute(f"CREATE TABLE {staging} AS SELECT * FROM {table} WHERE 0")
+        try:
+            yield staging
+        finally:
+            with self._lock:
+                self._conn.execute(f"DROP TABLE {staging}")
+
+    def _swap(self, *statements: tuple[str, tuple]) -> None:
+        """Replace the stored results by the staged ones in a transaction."""
+        with self._lock:
+            try:
+                self._conn.execute("BEGIN IMMEDIATE")
+                for sql, params in statements:
+                    self._conn.execute(sql, params)
+                self._conn.execute("COMMIT")
+            except sqlite3.Error:
+                if self._conn.in_transaction:
+                    self._conn.execute("ROLLBACK")
+                raise
+
+    def _insert_overview(self, rows: list[tuple], annotations: list[tuple], *, tables: tuple[str, str]) -> None:
+        self._insert(
+            (f"INSERT INTO {tables[0]} VALUES (?, ?, ?)", rows), (f"INSERT INTO {tables[1]} VALUES (?, ?, ?, ?)", annotations)
+        )
+
+    def _insert(self, *statements: tuple[str, list[tuple]]) -> None:
+        """Insert the rows by the statements in a transaction."""
+        pairs = [(sql, rows) for sql, rows in statements if rows]
+        if not pairs:
+            return
+        with self._lock:
+            try:
+                self._conn.execute("BEGIN IMMEDIATE")
+                for sql, rows in pairs:
+                    self._conn.executemany(sql, rows)
+                self._conn.execute("COMMIT")
+            except sqlite3.Error:
+                if self._conn.in_transaction:
+                    self._conn.execute("ROLLBACK")
+                raise
+        logger.debug(f"Stored {sum(len(rows) for _, rows in pairs)} rows to {self.path}.")
+
+
+def _hit_rows(line: list, mode: str) -> Generator[tuple, None, None]:
+    """Rows of (gene, family, evalue, line) in the hits table of a result line, one per family of the diamond target.
+
+    The line is stored as it is written to the output file.
+    """
+    text = "\t".join(str(x) for x in [line[0].rstrip(".hmm"), *line[1:]])  # noqa: B005 - same as the writer
+    if mode == "cazyme":
+        yield line[2], _profile_label(line[0]), float(line[4]), text
+    elif mode == "sub":
+        yield line[5], _profile_label(line[0]), float(line[7]), text
+    else:
+        for family in sseqid_families(line[1]):
+            yield line[0], family, float(line[10]), text
+
+
+def _annotations(line: list) -> Generator[tuple[str, str], None, None]:
+    """The (kind, value) of the families, ECs and substrates of an overview line."""
+    columns = dict(zip(Headers.overview, line))
+    for mode in AVAIL_MODES:
+        for family in _split(columns[f"{mode}_fam"]):
+            # Drop the gene range of the cazyme families, e.g. GH5_4(66-346)
+            yield "family", re.sub(r"\(\d+-\d+\)$", "", family)
+    for ec in _split(columns["EC"]):
+        # Drop the count of the subfamily members with the EC, e.g. 3.2.1.4:6
+        yield "ec", ec.split(":")[0]
+    for substrate in _split(columns["Substrate"]):
+        yield "substrate", substrate
+
+
+def _split(value: str) -> list[str]:
+    return [] if value == "-" else value.split("+")
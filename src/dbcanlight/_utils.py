@@ -2,21 +2,33 @@
 
 from __future__ import annotations
 
+import contextlib
+import hashlib
+import heapq
+import importlib.resources
+import itertools
 import json
+import re
 import shutil
+import tempfile
 import threading
 import time
 import warnings
-from functools import wraps
+from functools import lru_cache, wraps
+from operator import itemgetter
 from pathlib import Path
-from typing import Any, Callable, Iterator, Literal, Sequence, TypeVar
+from typing import Any, Callable, Generator, Iterable, Iterator, Literal, Sequence, TypeVar
 
 import urllib3
 
-from . import AVAIL_CPUS, DATABASE_METADATA
+from . import AVAIL_CPUS, CFG_DIR, CPUS_SOURCE, DATABASE_METADATA, logger
+from ._metrics import metrics
 
 _C = TypeVar("Callable", bound=Callable[..., Any])
 URLLIB_TIMEOUT = urllib3.util.Timeout(connect=5.0, read=10.0)
+HTTP_CACHE = ".http_cache.json"
+BUNDLED_METADATA = "database_metadata.json"
+SORT_BUFFER_SIZE = 500000
 
 
 def load_db(db_config_path: Path, cfg_dir: Path):
@@ -44,7 +56,7 @@ class CheckDB:
                     missing_dbs.append(db)
             if missing_dbs:
                 raise FileNotFoundError(
-                    f"Database file missing {', '.join(missing_dbs)}. "
+                    f"Database file missing {', '.join(str(db) for db in missing_dbs)}. "
                     "Please use the build module to download the required databases."
                 )
             return func(*args, **kwargs)
@@ -93,7 +105,10 @@ def check_threads(func: _C) -> _C:
         if threads <= 0:
             raise ValueError("Argument threads must be an integer greater than 0.")
         if threads > 0 and threads > AVAIL_CPUS:
-            warnings.warn(f"Argument threads={threads} exceeds available CPU cores {AVAIL_CPUS}. Setting it to {AVAIL_CPUS}.")
+            warnings.warn(
+                f"Argument threads={threads} exceeds available CPU cores {AVAIL_CPUS} (limited by {CPUS_SOURCE}). "
+                f"Setting it to {AVAIL_CPUS}."
+            )
             threads = AVAIL_CPUS
         return threads
 
@@ -134,20 +149,155 @@ def check_binary(prog: str, bins: tuple, conda_url: str | None = None, source_ur
     raise RuntimeError(f"{prog} not found.{install_msg}{conda_msg}{source_msg}")
 
 
-def fetch_database_metadata():
-    http = urllib3.PoolManager(timeout=URLLIB_TIMEOUT)
-    response = http.request("GET", DATABASE_METADATA)
+class HttpCache:
+    """Persistent store of HTTP validators, cached responses and file checksums.
+
+    Keeps the ETag/Last-Modified of every url fetched by the build module so that later requests can be made conditional,
+    together with the body of small responses (the database metadata) and the md5 checksum of the downloaded files keyed by
+    their size and mtime, so that an unchanged database does not need to be rehashed.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self._path = path
+        try:
+            with open(path) as f:
+                self._data: dict[str, dict] = json.load(f)
+        except (OSError, ValueError):
+            self._data = {}
+        self._data.setdefault("urls", {})
+        self._data.setdefault("files", {})
+
+    def save(self) -> None:
+        """Write the cache back to disk. Failures are ignored since the cache is optional."""
+        try:
+            tmp = self._path.with_name(f"{self._path.name}.tmp")
+            with open(tmp, "w") as f:
+                json.dump(self._data, f, indent=4)
+            tmp.replace(self._path)
+        except OSError as err:
+            logger.debug("Cannot write the http cache %s: %s", self._path, err)
+
+    def get(self, url: str) -> dict:
+        """Return the cached entry of the url."""
+        return self._data["urls"].get(url, {})
+
+    def forget(self, url: str) -> None:
+        """Drop the cached entry of the url."""
+        self._data["urls"].pop(url, None)
+        self.save()
+
+    def fresh(self, url: str) -> bool:
+        """Whether the cached response of the url is still within its max-age."""
+        return self.get(url).get("expires", 0) > time.time()
+
+    def conditional_headers(self, url: str) -> dict[str, str]:
+        """Headers that turn a request into a conditional request."""
+        entry = self.get(url)
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def update(self, url: str, headers: Any, **fields) -> None:
+        """Record the validators and freshness carried by the response headers."""
+        entry = self._data["urls"].setdefault(url, {})
+        for key, header in (("etag", "ETag"), ("last_modified", "Last-Modified")):
+            if headers.get(header):
+                entry[key] = headers[header]
+        max_age = re.search(r"max-age=(\d+)", headers.get("Cache-Control", ""))
+        entry["expires"] = time.time() + int(max_age[1]) if max_age else 0
+        entry.update(fields)
+        self.save()
+
+    def md5(self, file: Path) -> str:
+        """Return the md5 checksum of the file. Reuse the recorded one if the file is not modified since then."""
+        stat = file.stat()
+        key = str(file.resolve())
+        entry = self._data["files"].get(key, {})
+        if entry.get("size") == stat.st_size and entry.get("mtime_ns") == stat.st_mtime_ns:
+            return entry["md5"]
+
+        md5 = file_md5(file)
+        self._data["files"][key] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "md5": md5}
+        self.save()
+        return md5
+
+
+def file_md5(file: Path) -> str:
+    """Return the md5 checksum of the file."""
+    md5 = hashlib.md5()
+    with open(file, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+@lru_cache(maxsize=None)
+def http_pool() -> urllib3.PoolManager:
+    """Return the connection pool shared by all the requests made by the package."""
+    return urllib3.PoolManager(num_pools=4, maxsize=4, timeout=URLLIB_TIMEOUT)
+
+
+@lru_cache(maxsize=None)
+def http_cache() -> HttpCache:
+    """Return the http cache under the config folder."""
+    return HttpCache(CFG_DIR / HTTP_CACHE)
+
+
+def fetch_database_metadata(cache: HttpCache | None = None, *, offline: bool = False) -> dict[str, list[str]]:
+    """Fetch the database metadata.
+
+    The request is skipped if the cached response is still fresh and is made conditional on the cached ETag/Last-Modified
+    otherwise. Fall back to the cached metadata, or the one bundled with the package, when offline or the request failed.
+    """
+    cache = cache or http_cache()
+    cached = cache.get(DATABASE_METADATA).get("data")
 
-    if response.status == 200:
-        data = json.loads(response.data.decode("utf-8"))
-        return data
-    else:
-        print(f"Failed to fetch data: HTTP {response.status}")
+    if not offline:
+        if cached and cache.fresh(DATABASE_METADATA):
+            logger.debug("Use the cached database metadata.")
+            return cached
+        try:
+            response = http_pool().request(
+                "GET", DATABASE_METADATA, headers=cache.conditional_headers(DATABASE_METADATA), retries=False
+            )
+        except urllib3.exceptions.HTTPError as err:
+            logger.warning("Failed to fetch the database metadata: %s", err)
+        else:
+            if response.status == 304 and cached:
+                logger.debug("Database metadata not modified.")
+                cache.update(DATABASE_METADATA, response.headers)
+                return cached
+            elif response.status == 200:
+                data = json.loads(response.data.decode("utf-8"))
+                cache.update(DATABASE_METADATA, response.headers, data=data)
+                return data
+            logger.warning("Failed to fetch the database metadata: HTTP %s", response.status)
+
+    log = logger.info if offline else logger.warning
+    if cached:
+        log("Use the cached database metadata.")
+        return cached
+    log("Use the database metadata bundled with the package.")
+    return bundled_metadata()
+
+
+def bundled_metadata() -> dict[str, list[str]]:
+    """Return the database metadata bundled with the package."""
+    try:
+        text = importlib.resources.files(__package__).joinpath(BUNDLED_METADATA).read_text()
+    except AttributeError:
+        # importlib.resources.files is not available before python 3.9
+        text = importlib.resources.read_text(__package__, BUNDLED_METADATA)
+    return json.loads(text)
 
 
 class Downloader:
     def __init__(self, url: str, dest: str | Path, *, overwrite: bool = False, threads: int = 4, update_interval: int = 2):
         self._url = url
+        self.headers: urllib3.HTTPHeaderDict = urllib3.HTTPHeaderDict()
 
         dest = Path(dest)
         self._dest: Path = dest
@@ -219,6 +369,7 @@ class Downloader:
     def get_file_size(self):
         """Get file size from the server."""
         response = self._http.request("HEAD", self._url)
+        self.headers = response.headers
         content_length = response.headers.get("Content-Length")
         return int(content_length) if content_length else None
 
@@ -239,6 +390,8 @@ class Downloader:
 
     def merge_chunks(self):
         """Merge downloaded file chunks into the final file."""
+        if self._chunk_files == [self._dest]:
+            return
         with open(self._dest, "wb") as outfile:
             for file in self._chunk_files:
                 with open(file, "rb") as infile:
@@ -265,9 +418,42 @@ def writer(results: Iterator[list[str]], output: Path, *, header: Sequence) -> N
     output.parent.mkdir(parents=True, exist_ok=True)
 
     # logger.info(f"Write output to {output}")
-    with open(output, "w") as f:
+    with metrics.stage("writer"), open(output, "w") as f:
         f.write("\t".join(header) + "\n")
 
         for line in results:
             line[0] = line[0].rstrip(".hmm")
             f.write("\t".join([str(x) for x in line]) + "\n")
+            metrics.count("hits")
+
+
+def sort_lines(lines: Iterable[list], *, key: int, buffer_size: int = SORT_BUFFER_SIZE) -> Generator[list, None, None]:
+    """Sort the lines by the column of the key in bounded memory. The lines with the same key keep their order.
+
+    The lines are sorted by runs of the buffer size, which are spilled to temporary files and merged at the end if there are more
+    than one. The merged lines are read back as strings.
+    """
+    lines = iter(lines)
+    run = sorted(itertools.islice(lines, buffer_size), key=itemgetter(key))
+    if len(run) < buffer_size:
+        yield from run
+        return
+    with tempfile.TemporaryDirectory(prefix="dbcanlight_") as tmpdir, contextlib.ExitStack() as stack:
+        runs = []
+        while run:
+            path = Path(tmpdir) / f"run{len(runs)}.tsv"
+            with metrics.stage("spill"), open(path, "w") as f:
+                f.writelines("\t".join(str(x) for x in line) + "\n" for line in run)
+            runs.append(stack.enter_context(open(path)))
+            run = sorted(itertools.islice(lines, buffer_size), key=itemgetter(key))
+        logger.debug(f"Merge {len(runs)} sorted runs.")
+        yield from heapq.merge(*((line.rstrip("\n").split("\t") for line in f) for f in runs), key=itemgetter(key))
+
+
+def parse_size(size: str | int) -> int:
+    """Number of bytes of the size in bytes or with the suffix K, M, G or T, e.g. 16G."""
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([KMGT]?)B?\s*", str(size), flags=re.IGNORECASE)
+    if not match:
+        raise ValueError(f"{size} is not a valid size.")
+    number, unit = match.groups()
+    return int(float(number) * 1024 ** "BKMGT".index(unit.upper() or "B"))
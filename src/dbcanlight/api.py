@@ -0,0 +1,375 @@
+"""In-memory Python API for searching sequences without going through files."""
+
+from __future__ import annotations
+
+import asyncio
+import functools
+import os
+import queue
+import tempfile
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+from typing import AsyncGenerator, Callable, Generator, Iterable, Literal, NamedTuple, Union
+
+import pyhmmer
+
+from . import AVAIL_CPUS, DB_PATH, logger
+from ._utils import CheckDB
+from .libdiamond import _blastp_cmd, _diamond_bin, diamond_search, parse_line, sseqid_families
+from .libhmm import ProfilesLike, SequencesLike, _load_hmms, _search_pipeline
+from .substrate_parser import substrate_mapping
+
+
+class CazymeHit(NamedTuple):
+    """A hit reported by the cazyme mode. Same fields as the columns in cazymes.tsv."""
+
+    hmm_profile: str
+    profile_length: int
+    gene_id: str
+    gene_length: int
+    evalue: float
+    profile_start: int
+    profile_end: int
+    gene_start: int
+    gene_end: int
+    coverage: float
+
+
+class SubstrateHit(NamedTuple):
+    """A hit reported by the sub mode. Same fields as the columns in substrates.tsv."""
+
+    dbcan_subfam: str
+    subfam_composition: str
+    subfam_ec: str
+    substrate: str
+    profile_length: int
+    gene_id: str
+    gene_length: int
+    evalue: float
+    profile_start: int
+    profile_end: int
+    gene_start: int
+    gene_end: int
+    coverage: float
+
+
+class DiamondHit(NamedTuple):
+    """A hit reported by the diamond mode. Same fields as the columns in diamond.tsv, plus the families of the target."""
+
+    qseqid: str
+    sseqid: str
+    pident: float
+    length: int
+    mismatch: int
+    gapopen: int
+    qstart: int
+    qend: int
+    sstart: int
+    send: int
+    evalue: float
+    bitscore: float
+    qlen: int
+    slen: int
+    qcovhsp: float
+    scovhsp: float
+
+    @property
+    def families(self) -> list[str]:
+        return sseqid_families(self.sseqid)
+
+
+Hit = Union[CazymeHit, SubstrateHit, DiamondHit]
+
+
+class Profiles:
+    """HMM profiles loaded once and shared by the searches made from multiple threads.
+
+    The optimized profiles are reconfigured in-place by pyhmmer for every target sequence, so a search cannot share them with
+    another search running at the same time. Each concurrent search borrows a private copy from a pool instead, which is
+    returned to the pool and reused by the later searches once done. The loaded profiles are kept as the template of the copies
+    and are never searched themselves.
+
+    A copy is put into the empty pool right before the process forks, so the forked workers borrow the copy inherited
+    copy-on-write instead of making their own.
+    """
+
+    def __init__(self, hmms: ProfilesLike) -> None:
+        if isinstance(hmms, (str, Path)):
+            hmms = _load_hmms(Path(hmms))
+        self._profiles = list(hmms)
+        self._pool: queue.SimpleQueue[list] = queue.SimpleQueue()
+        _instances.add(self)
+
+    def __len__(self) -> int:
+        return len(self._profiles)
+
+    @contextmanager
+    def acquire(self) -> Generator[list[pyhmmer.plan7.OptimizedProfile | pyhmmer.plan7.HMM], None, None]:
+        """Borrow a copy of the profiles for exclusive use."""
+        try:
+            profiles = self._pool.get_nowait()
+        except queue.Empty:
+            profiles = [profile.copy() for profile in self._profiles]
+        try:
+            yield profiles
+        finally:
+            self._pool.put(profiles)
+
+    def fill(self) -> None:
+        """Put a copy of the profiles into the pool if it is empty."""
+        if self._pool.empty():
+            self._pool.put([profile.copy() for profile in self._profiles])
+
+
+_instances: weakref.WeakSet[Profiles] = weakref.WeakSet()
+
+
+_shared_profiles: dict[Path, tuple[tuple, Profiles]] = {}
+_shared_lock = threading.Lock()
+
+
+def load_profiles(mode: Literal["cazyme", "sub"]) -> Profiles:
+    """Load the profiles of the cazyme or substrate database in the config folder.
+
+    The profiles are loaded once per process and shared by all the callers, including search_sequences called without profiles,
+    until the database is modified. Load them before forking the worker processes, e.g. by a ProcessPoolExecutor with the fork
+    context, and the workers search the copy made before forking, inherited copy-on-write, instead of loading their own.
+    """
+    if mode == "cazyme":
+        hmm_file = DB_PATH["cazyme_hmms"]
+    elif mode == "sub":
+        hmm_file = DB_PATH["subs_hmms"]
+    else:
+        raise KeyError(f"{mode} is not an available mode for hmmsearch.")
+    key = _database_key(hmm_file)
+    with _shared_lock:
+        if hmm_file in _shared_profiles and _shared_profiles[hmm_file][0] == key:
+            return _shared_profiles[hmm_file][1]
+        logger.debug(f"Load the profiles of {hmm_file} shared by the process.")
+        profiles = Profiles(hmm_file)
+        _shared_profiles[hmm_file] = (key, profiles)
+        return profiles
+
+
+def _database_key(hmm_file: Path) -> tuple:
+    """Size and modification time of the hmm file and its pressed files, which change once the database is rebuilt."""
+    key = []
+    for file in (hmm_file, *(hmm_file.with_name(f"{hmm_file.name}.{ext}") for ext in ("h3m", "h3i", "h3f", "h3p"))):
+        try:
+            stat = file.stat()
+            key.append((stat.st_size, stat.st_mtime_ns))
+        except OSError:
+            key.append(None)
+    return tuple(key)
+
+
+def _fill_pools() -> None:
+    # Copy the profiles in the parent so the forked workers share the copies instead of each making its own
+    for profiles in list(_instances):
+        profiles.fill()
+
+
+def _reset_shared_lock() -> None:
+    # The lock may be held by another thread of the parent at the time of fork
+    global _shared_lock
+    _shared_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(before=_fill_pools, after_in_child=_reset_shared_lock)
+
+
+def search_sequences(
+    sequences: SequencesLike,
+    mode: Literal["cazyme", "sub", "diamond"] = "cazyme",
+    *,
+    profiles: Profiles | None = None,
+    evalue: float | None = None,
+    coverage: float = 0.35,
+    threads: int = 1,
+    blocksize: int = 100000,
+    callback: Callable[[pyhmmer.plan7.OptimizedProfile | pyhmmer.plan7.HMM, int], None] | None = None,
+    Z: int | None = None,
+    max_target_seqs: int = 1,
+    top: float | None = None,
+) -> list[Hit]:
+    """Search the sequences in memory and return the hits as typed records.
+
+    The sequences can be an iterable of (name, sequence) or a DigitalSequenceBlock. Pass the profiles returned by
+    load_profiles to reuse them across calls; the function is safe to call concurrently with the same profiles from multiple
+    threads. The callback is called every time a profile is searched and can raise to abort the search. Specify Z to compute the
+    evalues as if Z sequences were searched, e.g. to get the same hits when searching a large set of sequences by parts. Use
+    max_target_seqs or top to report more than the best hit of each sequence in the diamond mode.
+    """
+    if mode == "diamond":
+        return _diamond_sequences(
+            sequences,
+            evalue=1e-102 if evalue is None else evalue,
+            coverage=coverage,
+            threads=threads,
+            max_target_seqs=max_target_seqs,
+            top=top,
+        )
+
+    profiles = profiles or load_profiles(mode)
+    evalue = 1e-15 if evalue is None else evalue
+    with profiles.acquire() as hmms:
+        results = _search_pipeline(
+            sequences,
+            hmms,
+            evalue=evalue,
+            coverage=coverage,
+            threads=threads,
+            blocksize=blocksize,
+            formatted=False,
+            callback=callback,
+            Z=Z,
+        )
+        if mode == "sub":
+            return [SubstrateHit(line[0].rstrip(".hmm"), *line[1:]) for line in substrate_mapping(results, formatted=False)]
+        return [CazymeHit(line[0].rstrip(".hmm"), *line[1:]) for line in results]
+
+
+def to_frame(hits: Iterable[Hit], kind: Literal["pandas", "arrow"] = "pandas", *, fields: tuple[str, ...] | None = None):
+    """Convert the hits to a pandas DataFrame or a pyarrow Table. Requires pandas or pyarrow installed."""
+    hits = list(hits)
+    fields = fields or (hits[0]._fields if hits else CazymeHit._fields)
+    columns = {field: [getattr(hit, field) for hit in hits] for field in fields}
+    if kind == "pandas":
+        try:
+            import pandas as pd
+        except ImportError:
+            raise ImportError("pandas is required to convert the hits to a DataFrame.")
+        return pd.DataFrame(columns, columns=list(fields))
+    elif kind == "arrow":
+        try:
+            import pyarrow as pa
+        except ImportError:
+            raise ImportError("pyarrow is required to convert the hits to a Table.")
+        return pa.table(columns)
+    raise KeyError(f"{kind} is not an available kind.")
+
+
+def _write_fasta(sequences: SequencesLike, fasta: Path) -> Path:
+    """Write the sequences in memory to a fasta. Return the input as it is if it is already a file."""
+    if isinstance(sequences, (str, Path)):
+        return Path(sequences)
+    if isinstance(sequences, pyhmmer.easel.DigitalSequenceBlock):
+        sequences = ((seq.name.decode(), seq.textize().sequence) for seq in sequences)
+    with open(fasta, "w") as f:
+        for name, seq in sequences:
+            f.write(f">{name}\n{seq}\n")
+    return fasta
+
+
+def _diamond_sequences(sequences: SequencesLike, **options) -> list[DiamondHit]:
+    """Run diamond on the sequences through a temporary fasta."""
+    with tempfile.TemporaryDirectory(prefix="dbcanlight_") as tmpdir:
+        query = _write_fasta(sequences, Path(tmpdir) / "query.faa")
+        return [DiamondHit(*line) for line in diamond_search(query, **options)]
+
+
+class SearchCancelled(Exception):
+    """Raised in the worker thread to abort a search whose awaiting task was cancelled."""
+
+
+_executor: ThreadPoolExecutor | None = None
+_executor_lock = threading.Lock()
+
+
+def set_max_concurrency(max_workers: int) -> None:
+    """Set the number of searches run at the same time by search_async. Searches beyond the limit wait in a queue."""
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False)
+        _executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="dbcanlight")
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    """Return the executor managed by the module. Run at most AVAIL_CPUS searches at the same time by default."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=AVAIL_CPUS, thread_name_prefix="dbcanlight")
+        return _executor
+
+
+async def search_async(
+    sequences: SequencesLike,
+    mode: Literal["cazyme", "sub", "diamond"] = "cazyme",
+    **kwargs,
+) -> list[Hit]:
+    """Asyncio counterpart of search_sequences which runs the search in the executor managed by the module.
+
+    The keyword arguments are the same as search_sequences. Cancelling the awaiting task aborts the search in the worker thread
+    once the profiles being searched are done, so the CPUs are freed for the other requests.
+    """
+    if mode == "diamond":
+        return [hit async for hit in diamond_search_async(sequences, **kwargs)]
+
+    cancelled = threading.Event()
+    user_callback = kwargs.pop("callback", None)
+
+    def callback(query, total):
+        if cancelled.is_set():
+            raise SearchCancelled()
+        if user_callback:
+            user_callback(query, total)
+
+    func = functools.partial(search_sequences, sequences, mode, callback=callback, **kwargs)
+    future = asyncio.get_running_loop().run_in_executor(_get_executor(), func)
+    try:
+        return await asyncio.shield(future)
+    except asyncio.CancelledError:
+        cancelled.set()
+        future.cancel()
+        # Nobody awaits the search aborting in the worker thread anymore
+        future.add_done_callback(_retrieve_exception)
+        raise
+
+
+def _retrieve_exception(future: asyncio.Future) -> None:
+    """Mark the exception of the future as retrieved so asyncio does not log it as never retrieved."""
+    if not future.cancelled():
+        future.exception()
+
+
+@CheckDB(DB_PATH["diamond"])
+@_diamond_bin
+async def diamond_search_async(
+    sequences: SequencesLike,
+    *,
+    evalue: float | None = None,
+    coverage: float = 0.35,
+    threads: int = 1,
+    max_target_seqs: int = 1,
+    top: float | None = None,
+    **kwargs,
+) -> AsyncGenerator[DiamondHit, None]:
+    """Asyncio counterpart of diamond search which streams the hits as an async iterator.
+
+    The diamond process is killed if the iteration is cancelled or stopped early.
+    """
+    evalue = 1e-102 if evalue is None else evalue
+    with tempfile.TemporaryDirectory(prefix="dbcanlight_") as tmpdir:
+        query = _write_fasta(sequences, Path(tmpdir) / "query.faa")
+        cmd = _blastp_cmd(query, evalue=evalue, coverage=coverage, threads=threads, max_target_seqs=max_target_seqs, top=top)
+        logger.debug(f"Command: {' '.join(cmd)}")
+        p = await asyncio.create_subprocess_exec(*cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+        stderr = asyncio.ensure_future(p.stderr.read())
+        try:
+            async for line in p.stdout:
+                yield DiamondHit(*parse_line(line))
+            await p.wait()
+            err = await stderr
+            if err or p.returncode != 0:
+                raise RuntimeError(err.decode())
+        finally:
+            if p.returncode is None:
+                p.kill()
+                await p.wait()
+            stderr.cancel()
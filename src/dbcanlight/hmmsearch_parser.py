@@ -5,9 +5,14 @@ from __future__ import annotations
 
 import argparse
 import csv
+import glob
+import io
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
 from operator import itemgetter
 from pathlib import Path
-from typing import Generator, Iterator, Sequence
+from typing import Generator, Iterator, Sequence, TextIO
 
 from Bio import SearchIO
 
@@ -15,20 +20,31 @@ from ._header import Headers
 
 from . import ENTRY_POINTS, VERSION, logger
 from ._args_parser import args_parser
+from ._input import open_range
 from ._utils import writer
 
+_CHUNK_SIZE = 2**26
+
 
 class HmmsearchParser:
     """Parser class that help to process hmmer3/dbcanLight hmmsearch output."""
 
-    def __init__(self, input: str | Path) -> None:
-        """Initiate the object, determine whether the input is hmmer3 or dbcan format."""
+    def __init__(self, input: str | Path, *, begin: int = 0, end: int | None = None, dbcanformat: bool | None = None) -> None:
+        """Initiate the object, determine whether the input is hmmer3 or dbcan format.
+
+        Set begin and end to read only the byte range [begin, end) of the input, and dbcanformat to skip the format detection.
+        """
         input = Path(input)
-        try:
-            self._data = self._hmmer_reader(input)
-            logger.info("Input is hmmer3 format")
-        except AssertionError:
-            self._data = self._dbcan_reader(input)
+        self._span = (begin, end)
+        if dbcanformat is None:
+            try:
+                self._data = self._hmmer_reader(input)
+                logger.info("Input is hmmer3 format")
+            except AssertionError:
+                logger.info("Input is dbcan format")
+                self._data = self._dbcan_reader(input)
+        else:
+            self._data = self._dbcan_reader(input) if dbcanformat else self._hmmer_reader(input)
 
     @property
     def data(self) -> list[list]:
@@ -38,7 +54,7 @@ class HmmsearchParser:
     def _hmmer_reader(self, input: Path) -> list[list]:
         """Reader for files in hmmer3 domtblout format."""
         lines = []
-        with open(input) as f:
+        with self._open(input) as f:
             for hmm in SearchIO.parse(f, "hmmsearch3-domtab"):
                 for hit in hmm.hits:
                     for hsp in hit.hsps:
@@ -62,15 +78,18 @@ class HmmsearchParser:
 
     def _dbcan_reader(self, input: Path) -> list[list]:
         """Reader for files in dbcan format."""
-        with open(input) as f:
-            logger.info("Input is dbcan format")
-            first_3_lines = f.readline() + f.readline() + f.readline()
-            try:
-                dialect = csv.Sniffer().has_header(first_3_lines)
-            except csv.Error:
-                raise RuntimeError("Cannot found delimiter. The input does not appear to be in table format.")
+        with self._open(input) as f:
+            first_3_lines = [f.readline(), f.readline(), f.readline()]
+            if self._span[0]:
+                # Only the beginning of the input has the header
+                dialect = False
+            else:
+                try:
+                    dialect = csv.Sniffer().has_header("".join(first_3_lines))
+                except csv.Error:
+                    raise RuntimeError("Cannot found delimiter. The input does not appear to be in table format.")
             first_line_idx = 1 if dialect else 0
-            first_line = first_3_lines.strip().split("\n")[first_line_idx].split("\t")
+            first_line = "".join(first_3_lines).strip().split("\n")[first_line_idx].split("\t")
 
             if len(first_line) == 10:
                 try:
@@ -82,15 +101,25 @@ class HmmsearchParser:
             else:
                 raise RuntimeError("Input is neither hmmer3 nor dbcan format.")
 
-            f.seek(0)
-            reader = csv.reader(f, delimiter="\t")
+            reader = csv.reader(itertools.chain(filter(None, first_3_lines), f), delimiter="\t")
             if dialect:
                 next(reader, None)
             lines = [(line) for line in reader]
         return lines
 
+    def _open(self, input: Path) -> TextIO:
+        begin, end = self._span
+        if not begin and end is None:
+            return open(input)
+        return io.TextIOWrapper(open_range(input, begin, os.path.getsize(input) if end is None else end))
+
     def eval_cov_filter(self, *, evalue: float, coverage: float) -> Generator[dict[str, list[list]], None, None]:
         """Filter the hits by the evalue."""
+        results = self._filter(evalue=evalue, coverage=coverage)
+        logger.info(f"Found {len(results)} genes have hits")
+        yield results
+
+    def _filter(self, *, evalue: float, coverage: float) -> dict[str, list[list]]:
         results = {}
         for line in self._data:
             if self._dbcanformat:
@@ -100,12 +129,13 @@ class HmmsearchParser:
             if line[4] > evalue or line[9] < coverage:
                 continue
             results.setdefault(line[2], []).append(line)
-        logger.info(f"Found {len(results)} genes have hits")
-        yield results
+        return results
 
 
-def overlap_filter(results: Sequence[dict[str, list[list]]] | Iterator[dict[str, list[list]]]) -> Generator[list, None, None]:
-    """Filter the overlapped hits."""
+def overlap_filter(
+    results: Sequence[dict[str, list[list]]] | Iterator[dict[str, list[list]]], *, formatted: bool = True
+) -> Generator[list, None, None]:
+    """Filter the overlapped hits. Set formatted to False to keep the evalue and coverage as float."""
     for results_batch in results:
         for gene in sorted(results_batch.keys()):
             hits = results_batch[gene]
@@ -138,7 +168,8 @@ def overlap_filter(results: Sequence[dict[str, list[list]]] | Iterator[dict[str,
             else:
                 pass
             for hit in hits:
-                hit[4], hit[9] = f"{hit[4]:0.1e}", f"{hit[9]:0.3}"
+                if formatted:
+                    hit[4], hit[9] = f"{hit[4]:0.1e}", f"{hit[9]:0.3}"
                 yield hit
 
 
@@ -157,24 +188,131 @@ def main(args: list[str] | None = None) -> int:
     return args_parser(_menu, args, prog=ENTRY_POINTS[__name__], description=main.__doc__)
 
 
-def _run(input: str | Path, output: str | Path, evalue: float = 1e-15, coverage: float = 0.35, **kwargs) -> None:
-    """Process the data."""
-    data_parser = HmmsearchParser(input)
-    results = data_parser.eval_cov_filter(evalue=evalue, coverage=coverage)
-    results = overlap_filter(results)
+def parallel_eval_cov_filter(
+    input: str | Path, *, evalue: float, coverage: float, threads: int, chunk_size: int = _CHUNK_SIZE
+) -> Generator[dict[str, list[list]], None, None]:
+    """Filter the hits of the input by chunks across the processes. The results are the same as HmmsearchParser.eval_cov_filter.
+
+    The input is split into chunks of about the chunk size (in bytes) at the boundaries of the targets, so the hits of a target
+    against a profile are never split.
+    """
+    dbcanformat = HmmsearchParser(input, end=_chunk_bounds(input, None, size=2**16)[1])._dbcanformat
+    bounds = _chunk_bounds(input, dbcanformat, size=chunk_size)
+    logger.debug(f"Split {input} into {len(bounds) - 1} chunks.")
+    results = {}
+    with ProcessPoolExecutor(max_workers=threads) as executor:
+        chunks = executor.map(
+            _filter_chunk,
+            itertools.repeat(input),
+            bounds[:-1],
+            bounds[1:],
+            itertools.repeat(dbcanformat),
+            itertools.repeat(evalue),
+            itertools.repeat(coverage),
+        )
+        for chunk in chunks:
+            for gene, hits in chunk.items():
+                results.setdefault(gene, []).extend(hits)
+    logger.info(f"Found {len(results)} genes have hits")
+    yield results
+
+
+def _filter_chunk(
+    input: str | Path, begin: int, end: int, dbcanformat: bool, evalue: float, coverage: float
+) -> dict[str, list[list]]:
+    return HmmsearchParser(input, begin=begin, end=end, dbcanformat=dbcanformat)._filter(evalue=evalue, coverage=coverage)
+
+
+def _chunk_bounds(input: str | Path, dbcanformat: bool | None, *, size: int) -> list[int]:
+    """Byte offsets splitting the input into chunks of about the size, aligned to the lines where the target changes.
+
+    The target is the gene of the dbcan format, or the target and query of the hmmer3 format. The chunks are only aligned to the
+    lines if the format is None.
+    """
+    total = os.path.getsize(input)
+    bounds = [0]
+    with open(input, "rb") as f:
+        while bounds[-1] + size < total:
+            f.seek(bounds[-1] + size)
+            f.readline()
+            offset, key = f.tell(), None
+            for line in iter(f.readline, b""):
+                if dbcanformat is None:
+                    break
+                if not line.startswith(b"#"):
+                    fields = line.split(b"\t") if dbcanformat else line.split()
+                    target = fields[2] if dbcanformat else (fields[0], fields[3])
+                    if key is not None and target != key:
+                        break
+                    key = target
+                offset = f.tell()
+            if offset >= total:
+                break
+            bounds.append(offset)
+    bounds.append(total)
+    return bounds
+
+
+def _expand(patterns: str | Path | Sequence[str | Path]) -> list[Path]:
+    """Expand the glob patterns of the inputs."""
+    files = []
+    for pattern in [patterns] if isinstance(patterns, (str, Path)) else patterns:
+        if Path(pattern).exists():
+            files.append(Path(pattern))
+            continue
+        matches = sorted(glob.glob(str(pattern)))
+        if not matches:
+            raise FileNotFoundError(f"{pattern} does not exist.")
+        files.extend(Path(match) for match in matches)
+    return files
+
+
+def _run(
+    input: str | Path | Sequence[str | Path],
+    output: str | Path,
+    evalue: float = 1e-15,
+    coverage: float = 0.35,
+    threads: int = 1,
+    **kwargs,
+) -> None:
+    """Process the data. The hits of multiple inputs are filtered together as in one input."""
+    results = {}
+    for file in _expand(input):
+        if threads > 1:
+            batch = parallel_eval_cov_filter(file, evalue=float(evalue), coverage=coverage, threads=threads)
+        else:
+            batch = HmmsearchParser(file).eval_cov_filter(evalue=float(evalue), coverage=coverage)
+        for gene, hits in next(batch).items():
+            results.setdefault(gene, []).extend(hits)
+    results = overlap_filter([results])
     writer(results, Path(output), header=Headers.cazyme)
 
 
 def _menu(parser: argparse.ArgumentParser) -> argparse.ArgumentParser:
     """Menu for this entry point."""
     parser.add_argument(
-        "-i", "--input", metavar="file", type=str, required=True, help="CAZyme search output in dbcan or hmmsearch format"
+        "-i",
+        "--input",
+        metavar="file",
+        type=str,
+        nargs="+",
+        required=True,
+        help="CAZyme search output(s) in dbcan or hmmsearch format, or glob patterns of them. The hits of multiple inputs are "
+        "filtered together",
     )
     parser.add_argument("-o", "--output", metavar="file", default="./cazymes.tsv", help="Output file")
     parser.add_argument("-e", "--evalue", metavar="float", default=1e-15, help="Evalue cutoff")
     parser.add_argument(
         "-c", "--coverage", metavar="float", type=float, default=0.35, help="Coverage cutoff (not applicable on diamond)"
     )
+    parser.add_argument(
+        "-t",
+        "--threads",
+        metavar="int",
+        type=int,
+        default=1,
+        help="Number of processes to filter the chunks of large inputs in parallel",
+    )
     parser.add_argument("-v", "--verbose", action="store_true", help="Verbose mode for debug")
     parser.add_argument("-V", "--version", action="version", version=VERSION)
     parser.set_defaults(func=_run)
@@ -2,15 +2,27 @@
 
 from __future__ import annotations
 
+import contextlib
+import hashlib
+import shutil
 import subprocess
+import tempfile
+import threading
 from pathlib import Path
-from typing import Any, Callable, Generator, TypeVar
+from typing import Any, BinaryIO, Callable, Generator, Sequence, TypeVar
 
 from . import DB_PATH, logger
+from ._header import Headers
+from ._input import detect_format, open_input, sequence_file
+from ._metrics import metrics
 from ._utils import CheckDB, check_binary
 
 _C = TypeVar("Callable", bound=Callable[..., Any])
 
+# Types of the columns in Headers.diamond, i.e. the standard 12 columns of the tabular output plus the lengths and coverages
+_COLUMN_TYPES = (str, str, float, int, int, int, int, int, int, int, float, float, int, int, float, float)
+_CHUNK_SIZE = 2**20
+
 
 def _diamond_bin(func: _C) -> _C:
     def wrapper(*args, **kwargs):
@@ -33,37 +45,176 @@ def diamond_build(input: str | Path, output: str | Path = DB_PATH["diamond"], *,
 @CheckDB(DB_PATH["diamond"])
 @_diamond_bin
 def diamond_search(
-    input: str | Path, *, evalue: float = 1e-102, coverage: float = 0.35, threads: int = 1
+    input: str | Path | BinaryIO,
+    *,
+    evalue: float = 1e-102,
+    coverage: float = 0.35,
+    threads: int = 1,
+    dedup: bool = False,
+    max_target_seqs: int = 1,
+    top: float | None = None,
 ) -> Generator[list, None, None]:
-    """Function for cazyme diamond blastp. Returns a generator of list of results."""
-    cmd = [
+    """Function for cazyme diamond blastp. Returns a generator of list of results typed as the columns of Headers.diamond.
+
+    Use dedup to search the identical sequences in the input only once. The compressed input is decompressed by dbcanlight and
+    piped to diamond, as well as the input given as a fasta stream. Diamond reports the best hit of each gene unless more
+    targets are requested by max_target_seqs, or all the hits within the top percentage of the best bitscore by top.
+    """
+    options = {"evalue": evalue, "coverage": coverage, "threads": threads, "max_target_seqs": max_target_seqs, "top": top}
+    if dedup:
+        return metrics.timed("diamond", _dedup_blastp(input, **options))
+    if not isinstance(input, (str, Path)) or detect_format(input) != "plain":
+        if isinstance(input, (str, Path)):
+            input = open_input(input, threads=threads)
+        return metrics.timed("diamond", _blastp(_blastp_cmd(None, **options), stdin=input))
+    return metrics.timed("diamond", _blastp(_blastp_cmd(input, **options)))
+
+
+@CheckDB(DB_PATH["diamond"])
+@_diamond_bin
+def batch_diamond_search(
+    inputs: Sequence[str | Path],
+    *,
+    evalue: float = 1e-102,
+    coverage: float = 0.35,
+    threads: int = 1,
+    dedup: bool = False,
+    max_target_seqs: int = 1,
+    top: float | None = None,
+) -> Generator[tuple[int, list[list]], None, None]:
+    """Search multiple fasta files with a single diamond run. Returns a generator of (input index, results).
+
+    Use dedup to search the identical sequences across all the inputs only once.
+    """
+    return _batch_blastp(
+        inputs, evalue=evalue, coverage=coverage, threads=threads, dedup=dedup, max_target_seqs=max_target_seqs, top=top
+    )
+
+
+def _dedup_blastp(input: str | Path, **options) -> Generator[list, None, None]:
+    """Run diamond blastp on the unique sequences and fan the hits out to every sequence in input order."""
+    for _, lines in _batch_blastp([input], dedup=True, **options):
+        yield from lines
+
+
+def _batch_blastp(
+    inputs: Sequence[str | Path], *, threads: int, dedup: bool, **options
+) -> Generator[tuple[int, list[list]], None, None]:
+    """Run diamond blastp on the sequences of all the inputs and split the hits back to each input in input order.
+
+    The evalues reported by diamond depend on the database size only, so the results are identical to searching each input.
+    """
+    with tempfile.TemporaryDirectory(prefix="dbcanlight_") as tmpdir:
+        query = Path(tmpdir) / "query.faa"
+        members = _write_query(inputs, query, dedup=dedup, threads=threads)
+        hits = {}
+        for line in _blastp(_blastp_cmd(query, threads=threads, **options)):
+            hits.setdefault(line[0], []).append(line)
+    for idx, names in enumerate(members):
+        yield idx, [[name, *line[1:]] for name, query_id in names for line in hits.get(query_id, [])]
+
+
+def _write_query(
+    inputs: Sequence[str | Path], output: Path, *, dedup: bool = False, threads: int = 1
+) -> list[list[tuple[str, str]]]:
+    """Write the sequences of all the inputs to the output fasta under unique ids, or only the unique sequences if dedup.
+
+    Return the name of every sequence of each input in order together with the id it is searched by.
+    """
+    members, query_ids = [], {}
+    n = 0
+    with open(output, "w") as f:
+        for idx, input in enumerate(inputs):
+            names = []
+            with sequence_file(input, threads=threads) as seq_file:
+                for seq in seq_file:
+                    sequence = seq.sequence.upper()
+                    digest = hashlib.blake2b(sequence.encode(), digest_size=16).digest() if dedup else n
+                    if digest not in query_ids:
+                        query_ids[digest] = f"q{len(query_ids)}"
+                        f.write(f">{query_ids[digest]}\n{sequence}\n")
+                    names.append((seq.name.decode(), query_ids[digest]))
+                    n += 1
+            members.append(names)
+    if dedup:
+        logger.info(f"Search {len(query_ids)} unique sequences out of {n} sequences.")
+    return members
+
+
+def _blastp(cmd: list[str], stdin: BinaryIO | None = None) -> Generator[list, None, None]:
+    """Run diamond blastp and yield the typed output lines. The stdin is fed to diamond as the query if given."""
+    logger.debug(f"Command: {' '.join(cmd)}")
+    with subprocess.Popen(cmd, stdin=subprocess.PIPE if stdin else None, stdout=subprocess.PIPE, stderr=subprocess.PIPE) as p:
+        if stdin:
+            feeder = threading.Thread(target=_feed, args=(stdin, p.stdin), daemon=True)
+            feeder.start()
+        stderr = []
+        drainer = threading.Thread(target=lambda: stderr.append(p.stderr.read()), daemon=True)
+        drainer.start()
+        yield from _parse_output(p.stdout)
+        p.wait()
+        drainer.join()
+        if stderr[0] or p.returncode != 0:
+            raise RuntimeError(stderr[0].decode())
+
+
+def _parse_output(stdout: BinaryIO) -> Generator[list, None, None]:
+    """Parse the tabular output of diamond by large chunks."""
+    rest = b""
+    for chunk in iter(lambda: stdout.read1(_CHUNK_SIZE), b""):
+        lines = (rest + chunk).split(b"\n")
+        rest = lines.pop()
+        for line in lines:
+            yield parse_line(line)
+    if rest.strip():
+        yield parse_line(rest)
+
+
+def parse_line(line: bytes | str) -> list:
+    """Convert a line of the diamond output to the values typed as the columns of Headers.diamond."""
+    if isinstance(line, bytes):
+        line = line.decode()
+    return [convert(value) for convert, value in zip(_COLUMN_TYPES, line.rstrip().split("\t"))]
+
+
+def sseqid_families(sseqid: str) -> list[str]:
+    """Families of the target in the diamond database, e.g. ["GT35", "2.4.1.1"] for BAA00407.1|GT35|2.4.1.1."""
+    return sseqid.split("|")[1:]
+
+
+def _feed(source: BinaryIO, pipe: BinaryIO) -> None:
+    """Copy the source to the stdin pipe of diamond and close both of them."""
+    # Diamond closes the pipe early if it fails, which is reported by its stderr instead
+    with source, contextlib.suppress(BrokenPipeError), pipe:
+        shutil.copyfileobj(source, pipe)
+
+
+def _blastp_cmd(
+    input: str | Path | None,
+    *,
+    evalue: float,
+    coverage: float,
+    threads: int,
+    max_target_seqs: int = 1,
+    top: float | None = None,
+) -> list[str]:
+    """Command line of diamond blastp against the cazyme database. Diamond reads the query from stdin if the input is None."""
+    query = ["--query", str(input)] if input is not None else []
+    targets = ["--top", str(top)] if top is not None else ["--max-target-seqs", str(max_target_seqs)]
+    return [
         "diamond",
         "blastp",
         "--db",
         str(DB_PATH["diamond"]),
-        "--query",
-        str(input),
+        *query,
         "--evalue",
         str(evalue),
         "--threads",
         str(threads),
         "--query-cover",
         str(coverage),
-        "--max-target-seqs",
-        "1",
+        *targets,
         "--outfmt",
         "6",
+        *Headers.diamond,
     ]
-    logger.debug(f"Command: {' '.join(cmd)}")
-    with subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE) as p:
-        while True:
-            stdout_line = p.stdout.readline()
-            stderr_line = p.stderr.readline()
-            if stdout_line == b"" and stderr_line == b"" and p.poll() is not None:
-                break
-
-            if stdout_line:
-                yield stdout_line.decode().strip().split("\t")
-
-            if stderr_line:
-                raise RuntimeError(stderr_line.decode())
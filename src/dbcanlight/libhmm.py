@@ -2,102 +2,718 @@
 
 from __future__ import annotations
 
+import contextlib
+import csv
+import functools
+import hashlib
+import io
 import itertools
+import json
+import time
 from pathlib import Path
-from typing import Generator
+from typing import BinaryIO, Callable, Generator, Iterable, Literal, Sequence, Tuple, Union
 
 import pyhmmer
 
-from . import DB_PATH, logger
-from ._utils import CheckDB
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows, where the concurrent presses are only made atomic
+    fcntl = None
+
+from . import DB_PATH, PRESS_CACHE, logger
+from ._cache import MemoryCache, ResultCache
+from ._input import open_input, sequence_file
+from ._metrics import available_memory, current_rss, metrics, progress
+from ._utils import CheckDB, file_md5
 from .hmmsearch_parser import overlap_filter
 from .substrate_parser import substrate_mapping
 
+SequencesLike = Union[str, Path, BinaryIO, pyhmmer.easel.DigitalSequenceBlock, Iterable[Tuple[str, str]]]
+ProfilesLike = Union[str, Path, Sequence[Union[pyhmmer.plan7.OptimizedProfile, pyhmmer.plan7.HMM]]]
+
+# Assumed maximum ratio of the profile positions an alignment spans to the residues of the target when pruning. Deletions are not
+# bounded by the model, so the pruning is approximate
+_PRUNE_SLACK = 2.0
+# Worst runtime of hmmscan relative to hmmsearch on one thread for the same sequences and profiles, measured on 1024 synthetic
+# proteins of mean length 350 against 1 to 64 profiles of length 87 (1.34 with 1 profile, 0.97-1.14 with 2 to 64 profiles)
+_SCAN_COST = 1.35
+_PRESSED_SUFFIXES = ("h3m", "h3i", "h3f", "h3p")
+# Initial and minimum number of sequences of a block, and the runtime of a block to grow up to, of the adaptive blocksize
+_AUTO_INITIAL_BLOCKSIZE = 10000
+_AUTO_MIN_BLOCKSIZE = 100
+_AUTO_BLOCK_SECONDS = 30.0
+
 
 @CheckDB(DB_PATH["cazyme_hmms"])
 def cazyme_search(
-    input: str | Path,
-    hmms: str | Path,
+    input: SequencesLike,
+    hmms: ProfilesLike,
     *,
     evalue: float = 1e-15,
     coverage: float = 0.35,
     threads: int = 1,
-    blocksize: int = 100000,
+    blocksize: int | AdaptiveBlocksize = 100000,
+    cache: ResultCache | None = None,
+    dedup: bool = False,
+    strategy: Literal["auto", "search", "scan"] = "auto",
+    prune: bool = False,
+    Z: int | None = None,
 ) -> Generator[list, None, None]:
-    """Function for cazyme hmmsearch. Returns a generator of list of results."""
-    return _search_pipeline(Path(input), Path(hmms), evalue=evalue, coverage=coverage, threads=threads, blocksize=blocksize)
+    """Function for cazyme hmmsearch. Returns a generator of list of results.
+
+    The input can be a fasta file, a DigitalSequenceBlock or an iterable of (name, sequence) and the hmms can be either a hmm file
+    or the profiles preloaded by the caller. Sequences found in the result cache are not searched again. Use dedup to search
+    the identical sequences in the input only once. The strategy picks hmmsearch or hmmscan, or the faster one for each block if
+    auto, with identical results. Specify Z, e.g. the number of sequences in the input, to compute the evalues against a fixed
+    search space so that the results do not depend on the blocksize; otherwise Z is the number of sequences of each block.
+    Pass an AdaptiveBlocksize as the blocksize to size the blocks by the memory usage and the runtime of the search. Use prune to
+    skip the profiles a sequence is likely too short to satisfy at the coverage cutoff, which is approximate (see _plan_search).
+    """
+    if dedup and not cache:
+        cache = MemoryCache()
+    if cache:
+        cache = cache.scope(mode="cazyme", database=_profiles_checksum(hmms), evalue=evalue, coverage=coverage, prune=prune)
+    return _search_pipeline(
+        input,
+        hmms,
+        evalue=evalue,
+        coverage=coverage,
+        threads=threads,
+        blocksize=blocksize,
+        cache=cache,
+        strategy=strategy,
+        prune=prune,
+        Z=Z,
+    )
 
 
 @CheckDB(DB_PATH["subs_hmms"], DB_PATH["subs_mapper"])
 def subs_search(
+    input: SequencesLike,
+    hmms: ProfilesLike,
+    *,
+    evalue: float = 1e-15,
+    coverage: float = 0.35,
+    threads: int = 1,
+    blocksize: int | AdaptiveBlocksize = 100000,
+    cache: ResultCache | None = None,
+    dedup: bool = False,
+    strategy: Literal["auto", "search", "scan"] = "auto",
+    prune: bool = False,
+    Z: int | None = None,
+) -> Generator[list, None, None]:
+    """Function for substrate hmmsearch. Returns a generator of list of results.
+
+    The input can be a fasta file, a DigitalSequenceBlock or an iterable of (name, sequence) and the hmms can be either a hmm file
+    or the profiles preloaded by the caller. Sequences found in the result cache are not searched again. Use dedup to search
+    the identical sequences in the input only once. The strategy picks hmmsearch or hmmscan, or the faster one for each block if
+    auto, with identical results. Specify Z, e.g. the number of sequences in the input, to compute the evalues against a fixed
+    search space so that the results do not depend on the blocksize; otherwise Z is the number of sequences of each block.
+    Pass an AdaptiveBlocksize as the blocksize to size the blocks by the memory usage and the runtime of the search. Use prune to
+    skip the profiles a sequence is likely too short to satisfy at the coverage cutoff, which is approximate (see _plan_search).
+    """
+    if dedup and not cache:
+        cache = MemoryCache()
+    if cache:
+        cache = cache.scope(mode="sub", database=_profiles_checksum(hmms), evalue=evalue, coverage=coverage, prune=prune)
+    results = _search_pipeline(
+        input,
+        hmms,
+        evalue=evalue,
+        coverage=coverage,
+        threads=threads,
+        blocksize=blocksize,
+        cache=cache,
+        strategy=strategy,
+        prune=prune,
+        Z=Z,
+    )
+    return metrics.timed("substrate_mapping", substrate_mapping(results))
+
+
+@CheckDB(DB_PATH["subs_hmms"], DB_PATH["subs_mapper"])
+def gated_subs_search(
+    input: SequencesLike,
+    hmms: ProfilesLike,
+    families: dict[str, set[str]],
+    *,
+    evalue: float = 1e-15,
+    coverage: float = 0.35,
+    threads: int = 1,
+    blocksize: int | AdaptiveBlocksize = 100000,
+    strategy: Literal["auto", "search", "scan"] = "auto",
+    prune: bool = False,
+    Z: int | None = None,
+    missed: list[list] | None = None,
+) -> Generator[list, None, None]:
+    """Function for substrate hmmsearch gated by the CAZy families of each gene. Returns a generator of list of results.
+
+    The families are the CAZy families hit by each gene in the cazyme results, e.g. {"gene1": {"GH5", "CBM46"}}. Each gene is
+    searched only against the substrate profiles of its families and the genes without any family are skipped, so the results
+    can miss the hits of the genes the cazyme profiles do not detect. Pass a list as missed to run the exhaustive search as well
+    and collect the hits the gating misses.
+    """
+    if isinstance(hmms, (str, Path)):
+        hmms = _load_hmms(Path(hmms))
+    profiles = {}
+    for hmm in hmms:
+        profiles.setdefault(_profile_label(hmm.name.decode()).split("_")[0], []).append(hmm)
+    order = {hmm.name.decode(): i for i, hmm in enumerate(hmms)}
+
+    for seq_block in metrics.timed("read", _sequence_blocks(input, blocksize or None, threads=threads)):
+        wall = time.perf_counter()
+        size = Z or len(seq_block)
+        groups = {}
+        for seq in seq_block:
+            for family in families.get(seq.name.decode(), ()):
+                if family in profiles:
+                    groups.setdefault(family, []).append(seq)
+        results = {}
+        for family, seqs in groups.items():
+            group = pyhmmer.easel.DigitalSequenceBlock(seq_block.alphabet, seqs)
+            hits = _hmmsearch(
+                group, profiles[family], evalue=evalue, coverage=coverage, threads=threads, Z=size, strategy=strategy, prune=prune
+            )
+            for gene, gene_hits in hits.items():
+                results.setdefault(gene, []).extend(gene_hits)
+        for gene_hits in results.values():
+            # Same order as searching all the profiles at once
+            gene_hits.sort(key=lambda hit: order[hit[0]])
+        compared = sum(len(seqs) * len(profiles[family]) for family, seqs in groups.items())
+        metrics.count("pruned_comparisons", len(seq_block) * len(hmms) - compared)
+        logger.debug(f"Gated {len(seq_block)} sequences to {compared} comparisons out of {len(seq_block) * len(hmms)}.")
+
+        lines = list(substrate_mapping(overlap_filter([results])))
+        if missed is not None:
+            exhaustive = _hmmsearch(
+                seq_block, hmms, evalue=evalue, coverage=coverage, threads=threads, Z=size, strategy=strategy, prune=prune
+            )
+            found = {tuple(line) for line in lines}
+            missed.extend(line for line in substrate_mapping(overlap_filter([exhaustive])) if tuple(line) not in found)
+        if progress.enabled:
+            progress.advance(
+                sequences=len(seq_block), residues=sum(len(seq) for seq in seq_block), wall=time.perf_counter() - wall
+            )
+        yield from lines
+
+
+def batch_search(
+    inputs: Sequence[str | Path],
+    hmms: ProfilesLike,
+    *,
+    mode: Literal["cazyme", "sub"] = "cazyme",
+    evalue: float = 1e-15,
+    coverage: float = 0.35,
+    threads: int = 1,
+    blocksize: int = 100000,
+    cache: ResultCache | None = None,
+    dedup: bool = False,
+    strategy: Literal["auto", "search", "scan"] = "auto",
+    prune: bool = False,
+    Z: Sequence[int | None] | None = None,
+) -> Generator[tuple[int, list[list]], None, None]:
+    """Search multiple fasta files in one go with the profiles loaded once. Returns a generator of (input index, results).
+
+    The sequences of small inputs are packed together into blocks of the blocksize so the threads are fully used. The results of
+    an input are yielded once all its sequences are searched, and are identical to the results of searching the input alone.
+    Use dedup to search the identical sequences across all the inputs only once. Specify the Z of each input to compute its
+    evalues against a fixed search space, otherwise the Z is the number of sequences of each block.
+    """
+    if isinstance(blocksize, AdaptiveBlocksize):
+        raise ValueError("The adaptive blocksize is not applicable on the batch search.")
+    if dedup and not cache:
+        cache = MemoryCache()
+    if cache:
+        cache = cache.scope(mode=mode, database=_profiles_checksum(hmms), evalue=evalue, coverage=coverage, prune=prune)
+    if isinstance(hmms, (str, Path)):
+        hmms = _load_hmms(Path(hmms))
+
+    finished = {}
+    for packed in metrics.timed("read", _packed_blocks(inputs, blocksize or None, threads=threads)):
+        blocks = [(idx, seq_block) for idx, seq_block in packed if seq_block is not None]
+        sequences = pyhmmer.easel.DigitalSequenceBlock(
+            pyhmmer.easel.Alphabet.amino(), (seq for _, seq_block in blocks for seq in seq_block)
+        )
+        logger.debug(f"Hmmsearch on {len(sequences)} sequences from {len({idx for idx, _ in blocks})} inputs...")
+        wall = time.perf_counter()
+        hits = iter(
+            _unique_hmmsearch(
+                sequences, hmms, cache=cache, evalue=evalue, coverage=coverage, threads=threads, strategy=strategy, prune=prune
+            )
+            if sequences
+            else []
+        )
+        metrics.count("sequences", len(sequences))
+        if progress.enabled:
+            progress.advance(
+                sequences=len(sequences), residues=sum(len(seq) for seq in sequences), wall=time.perf_counter() - wall
+            )
+        for idx, seq_block in packed:
+            if seq_block is None:
+                yield idx, finished.pop(idx, [])
+                continue
+            results = {}
+            for seq in seq_block:
+                _fan_out(results, seq, next(hits), Z=Z[idx] if Z and Z[idx] else len(seq_block), evalue=evalue)
+            lines = overlap_filter([results])
+            if mode == "sub":
+                lines = substrate_mapping(lines)
+            finished.setdefault(idx, []).extend(lines)
+
+
+def _packed_blocks(
+    inputs: Sequence[str | Path], blocksize: int | None, *, threads: int = 1
+) -> Generator[list[tuple[int, pyhmmer.easel.DigitalSequenceBlock | None]], None, None]:
+    """Read the inputs by the blocks they would be searched alone and pack them until reaching the blocksize.
+
+    Each packed block is a list of (input index, block), where the block is None once the input is exhausted.
+    """
+    packed, size = [], 0
+    for idx, input in enumerate(inputs):
+        for seq_block in _sequence_blocks(input, blocksize, threads=threads):
+            packed.append((idx, seq_block))
+            size += len(seq_block)
+            if blocksize and size >= blocksize:
+                yield packed
+                packed, size = [], 0
+        packed.append((idx, None))
+    if packed:
+        yield packed
+
+
+def update_search(
     input: str | Path,
     hmms: str | Path,
+    previous: str | Path,
     *,
+    checksums: dict[str, str],
+    mode: Literal["cazyme", "sub"] = "cazyme",
     evalue: float = 1e-15,
     coverage: float = 0.35,
     threads: int = 1,
-    blocksize: int = 100000,
+    blocksize: int | AdaptiveBlocksize = 100000,
+    strategy: Literal["auto", "search", "scan"] = "auto",
+    prune: bool = False,
+    Z: int | None = None,
 ) -> Generator[list, None, None]:
-    """Function for substrate hmmsearch. Returns a generator of list of results."""
-    return substrate_mapping(
-        _search_pipeline(Path(input), Path(hmms), evalue=evalue, coverage=coverage, threads=threads, blocksize=blocksize)
-    )
+    """Update the previous results made with the profiles of the given checksums to the current hmm file.
+
+    Only the profiles added or changed since then are searched against all the sequences. The genes that got hits from these
+    profiles, or had hits from the changed or removed profiles, are searched against the rest of the profiles as well and
+    filtered again, while the previous results of the other genes are kept as they are. The results are identical to searching
+    the current hmm file from scratch with the same cutoffs and Z (or blocksize if Z is not specified).
+    """
+    current = profile_checksums(Path(hmms))
+    changed = {label for label, checksum in current.items() if checksums.get(label) != checksum}
+    outdated = changed | (set(checksums) - set(current))
+    logger.info(f"{len(changed)} profiles added or changed and {len(outdated - changed)} profiles removed.")
+
+    gene_column = 2 if mode == "cazyme" else 5
+    previous_results = {}
+    with open(previous) as f:
+        reader = csv.reader(f, delimiter="\t")
+        next(reader, None)
+        for line in reader:
+            previous_results.setdefault(line[gene_column], []).append(line)
+
+    changed_hmms, unchanged_hmms = [], []
+    for hmm in _load_hmms(Path(hmms)):
+        (changed_hmms if _profile_label(hmm.name.decode()) in changed else unchanged_hmms).append(hmm)
+
+    for seq_block in _sequence_blocks(input, blocksize or None, threads=threads):
+        size = Z or len(seq_block)
+        results = {}
+        if changed_hmms:
+            results = _hmmsearch(
+                seq_block, changed_hmms, evalue=evalue, coverage=coverage, threads=threads, Z=size, strategy=strategy, prune=prune
+            )
+        affected = set(results)
+        affected.update(
+            name
+            for name in (seq.name.decode() for seq in seq_block)
+            if any(_profile_label(line[0]) in outdated for line in previous_results.get(name, []))
+        )
+        if affected and unchanged_hmms:
+            subset = pyhmmer.easel.DigitalSequenceBlock(
+                seq_block.alphabet, (seq for seq in seq_block if seq.name.decode() in affected)
+            )
+            hits = _hmmsearch(
+                subset, unchanged_hmms, evalue=evalue, coverage=coverage, threads=threads, Z=size, strategy=strategy, prune=prune
+            )
+            for gene, gene_hits in hits.items():
+                results.setdefault(gene, []).extend(gene_hits)
+        logger.debug(f"Update {len(affected)} genes out of {len(seq_block)} sequences.")
+
+        lines = overlap_filter([results])
+        if mode == "sub":
+            lines = substrate_mapping(lines)
+        updated = {}
+        for line in lines:
+            updated.setdefault(line[gene_column], []).append(line)
+        for name in (seq.name.decode() for seq in seq_block):
+            if name not in affected and name in previous_results:
+                updated[name] = previous_results[name]
+        for gene in sorted(updated):
+            yield from updated[gene]
+
+
+def profile_checksums(hmm_file: Path) -> dict[str, str]:
+    """Return the checksum of each profile in the hmm file keyed by the profile name reported in the results.
+
+    The checksums are read from the manifest written next to the hmm file by the build module, or computed if the hmm file is
+    modified since then.
+    """
+    stat = hmm_file.stat()
+    try:
+        with open(_manifest_path(hmm_file)) as f:
+            data = json.load(f)
+        if (data["size"], data["mtime_ns"]) == (stat.st_size, stat.st_mtime_ns):
+            return data["profiles"]
+    except (OSError, ValueError, KeyError):
+        pass
+    logger.debug(f"Computing the checksum of each profile in {hmm_file}...")
+    return _compute_profile_checksums(hmm_file)
+
+
+def write_profile_checksums(hmm_file: Path) -> None:
+    """Compute the checksum of each profile in the hmm file and write them to the manifest next to the hmm file."""
+    stat = hmm_file.stat()
+    checksums = _compute_profile_checksums(hmm_file)
+    with open(_manifest_path(hmm_file), "w") as f:
+        json.dump({"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "profiles": checksums}, f, indent=4)
+
+
+def _manifest_path(hmm_file: Path) -> Path:
+    return Path(f"{hmm_file}.profiles.json")
 
 
-def press_hmms(hmm_file: Path) -> None:
-    """Press hmm into a database."""
-    hmms = _load_hmms(hmm_file)
+def _compute_profile_checksums(hmm_file: Path) -> dict[str, str]:
+    checksums = {}
+    with pyhmmer.plan7.HMMFile(hmm_file) as f:
+        for hmm in f:
+            buffer = io.BytesIO()
+            hmm.write(buffer)
+            # Skip the format version and creation date which do not affect the search
+            lines = [line for line in buffer.getvalue().splitlines()[1:] if not line.startswith(b"DATE")]
+            checksums[_profile_label(hmm.name.decode())] = hashlib.md5(b"\n".join(lines)).hexdigest()
+    return checksums
+
+
+def count_sequences(fasta: str | Path, *, threads: int = 1) -> int:
+    """Count the sequences in a plain or compressed fasta by the header lines without parsing the sequences."""
+    count, last = 0, b"\n"
+    with open_input(fasta, threads=threads) as f:
+        for chunk in iter(lambda: f.read(2**20), b""):
+            count += chunk.count(b"\n>") + (last == b"\n" and chunk[:1] == b">")
+            last = chunk[-1:]
+    return count
+
+
+def _profile_label(name: str) -> str:
+    """Name of the profile reported in the results, e.g. GH5_4 for GH5_4.hmm and CBM46_e1 for CBM46_e1.hmm|CBM46:103|..."""
+    return name.split("|")[0].rstrip(".hmm")  # noqa: B005 - same as the writer
+
+
+def press_hmms(hmm_file: Path, *, prefix: Path | None = None) -> None:
+    """Press hmm into a database, next to the hmm file unless the prefix of the pressed files is given.
+
+    The checksum, size and mtime of the hmm file are recorded in <prefix>.press.json to tell whether the pressed files match the
+    hmm file without hashing it again while it is not modified.
+    """
+    prefix = prefix or hmm_file
+    stat = hmm_file.stat()
+    with pyhmmer.plan7.HMMFile(hmm_file) as f:
+        hmms = list(f)
     logger.debug(f"Pressing {hmm_file}...")
-    pyhmmer.hmmpress(hmms, hmm_file)
+    pyhmmer.hmmpress(hmms, prefix)
+    with open(f"{prefix}.press.json", "w") as f:
+        json.dump({"md5": _hmm_md5(hmm_file), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}, f, indent=4)
+
+
+class AdaptiveBlocksize:
+    """Blocksize adapted to the memory usage and the runtime of the blocks searched so far.
+
+    Pass it as the blocksize of the search functions. The block is doubled whenever the previous one is searched within the
+    target seconds, as long as the number of sequences fits in the memory limit by the memory grown per sequence of the largest
+    block so far. The block is halved once the memory grows close to the limit. The memory limit defaults to the memory
+    available to the process.
+    """
+
+    def __init__(
+        self,
+        *,
+        mem_limit: int | None = None,
+        initial: int = _AUTO_INITIAL_BLOCKSIZE,
+        minimum: int = _AUTO_MIN_BLOCKSIZE,
+        target_seconds: float = _AUTO_BLOCK_SECONDS,
+    ) -> None:
+        self.mem_limit = mem_limit or available_memory()
+        self.size = max(initial, minimum)
+        self.minimum = minimum
+        self.target_seconds = target_seconds
+        self._baseline = self._rss = self._started = None
+        self._largest = 0
+
+    def next_size(self) -> int:
+        """Size of the next block, adjusted by the memory and the runtime of the previous block."""
+        rss, now = current_rss(), time.perf_counter()
+        if self._started is None:
+            # The memory before the first block, e.g. taken by the profiles
+            self._baseline = rss
+        else:
+            self._adjust(rss, now - self._started)
+        self._rss, self._started = rss, now
+        return self.size
+
+    def _adjust(self, rss: int | None, wall: float) -> None:
+        self._largest = max(self._largest, self.size)
+        size = self.size * 2 if wall < self.target_seconds else self.size
+        if self.mem_limit and rss is not None and self._baseline is not None:
+            if rss > self.mem_limit * 0.9 and rss > self._rss:
+                size = self.size // 2
+            # The RSS seldom shrinks after the memory is freed, so it is attributed to the largest block
+            per_seq = (rss - self._baseline) / self._largest
+            if per_seq > 0:
+                size = min(size, int((self.mem_limit * 0.8 - self._baseline) / per_seq))
+        size = max(size, self.minimum)
+        if size != self.size:
+            logger.debug(f"Adjust the blocksize from {self.size} to {size} ({wall:.1f}s, {(rss or 0) / 2**20:.0f} MB).")
+            self.size = size
 
 
 def _search_pipeline(
-    input: Path,
-    hmms: Path,
+    input: SequencesLike,
+    hmms: ProfilesLike,
     *,
     evalue: float = 1e-15,
     coverage: float = 0.35,
     threads: int = 1,
-    blocksize: int = 100000,
+    blocksize: int | AdaptiveBlocksize = 100000,
+    formatted: bool = True,
+    callback: Callable[[pyhmmer.plan7.OptimizedProfile | pyhmmer.plan7.HMM, int], None] | None = None,
+    cache: ResultCache | MemoryCache | None = None,
+    strategy: Literal["auto", "search", "scan"] = "auto",
+    prune: bool = False,
+    Z: int | None = None,
 ) -> Generator[list, None, None]:
     """Hmmsearch pipeline."""
-    hmms = _load_hmms(hmms)
-    results = _load_seqs_and_hmmsearch(input, hmms, evalue=evalue, coverage=coverage, threads=threads, blocksize=blocksize)
-    results = overlap_filter(results)
+    if isinstance(hmms, (str, Path)):
+        hmms = _load_hmms(Path(hmms))
+    results = _load_seqs_and_hmmsearch(
+        input,
+        hmms,
+        evalue=evalue,
+        coverage=coverage,
+        threads=threads,
+        blocksize=blocksize,
+        callback=callback,
+        cache=cache,
+        strategy=strategy,
+        prune=prune,
+        Z=Z,
+    )
+    results = metrics.timed("overlap_filter", overlap_filter(results, formatted=formatted))
     return results
 
 
 def _load_hmms(hmm_file: Path) -> list[pyhmmer.plan7.OptimizedProfile | pyhmmer.plan7.HMM]:
-    """Load hmm profiles."""
-    f = pyhmmer.plan7.HMMFile(hmm_file)
+    """Load hmm profiles. The hmm file without matching pressed files is pressed into the press cache once and loaded from it."""
+    pressed = _pressed_prefix(hmm_file)
+    f = pyhmmer.plan7.HMMFile(pressed or hmm_file)
     if f.is_pressed():
         f = f.optimized_profiles()
         f.rewind()
-        logger.debug(f"Load {hmm_file} with pressed mode.")
+        logger.debug(f"Load {pressed} with pressed mode.")
     else:
         logger.debug(f"Load {hmm_file} with regular mode.")
     return list(f)
 
 
+def _pressed_prefix(hmm_file: Path) -> Path | None:
+    """Prefix of the pressed files matching the hmm file, pressing it into the press cache if not pressed.
+
+    The pressed files next to the hmm file are used if they were pressed from the same hmm file, or are not older than the hmm
+    file if pressed without the checksum recorded, e.g. by the hmmpress of HMMER. Otherwise the pressed files in the press cache
+    are used, which are kept under the checksum of the hmm file. Return None if the hmm file cannot be pressed. The checksums are
+    kept in the .press.json of the pressed files only, so the search writes nothing outside of the press cache.
+    """
+    if all(Path(f"{hmm_file}.{suffix}").is_file() for suffix in _PRESSED_SUFFIXES):
+        info = _press_info(hmm_file)
+        if info is None:
+            if min(Path(f"{hmm_file}.{suffix}").stat().st_mtime for suffix in _PRESSED_SUFFIXES) >= hmm_file.stat().st_mtime:
+                return hmm_file
+        elif info["md5"] == _hmm_md5(hmm_file, info):
+            return hmm_file
+        logger.warning(f"The pressed files of {hmm_file} are outdated and not used. Run the build module to press it again.")
+    md5 = _hmm_md5(hmm_file)
+    prefix = PRESS_CACHE / md5 / hmm_file.name
+    if _pressed_md5(prefix) == md5:
+        return prefix
+    try:
+        prefix.parent.mkdir(parents=True, exist_ok=True)
+        with _file_lock(prefix.parent / ".lock"):
+            # Pressed by another process while waiting for the lock
+            if _pressed_md5(prefix) != md5:
+                logger.info(f"Pressing {hmm_file} into {prefix.parent} for the later searches...")
+                press_hmms(hmm_file, prefix=prefix)
+    except OSError as err:
+        logger.warning(f"Cannot press {hmm_file} into {PRESS_CACHE}: {err}")
+        return None
+    return prefix
+
+
+def _press_info(prefix: Path) -> dict | None:
+    """Checksum, size and mtime of the hmm file recorded when pressed. Return None if not recorded."""
+    try:
+        with open(f"{prefix}.press.json") as f:
+            info = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return info if isinstance(info, dict) and "md5" in info else None
+
+
+def _pressed_md5(prefix: Path) -> str | None:
+    """Checksum of the hmm file recorded when pressed. Return None if not recorded."""
+    info = _press_info(prefix)
+    return info["md5"] if info else None
+
+
+def _hmm_md5(hmm_file: Path, info: dict | None = None) -> str:
+    """Checksum of the hmm file. Reuse the one recorded when pressed if the size and mtime of the hmm file are unchanged."""
+    stat = hmm_file.stat()
+    if info and info.get("size") == stat.st_size and info.get("mtime_ns") == stat.st_mtime_ns:
+        return info["md5"]
+    return _file_md5(str(hmm_file.resolve()), stat.st_size, stat.st_mtime_ns)
+
+
+@functools.lru_cache(maxsize=None)
+def _file_md5(path: str, size: int, mtime_ns: int) -> str:
+    """Checksum of the file, hashed once per process for each size and mtime of the file."""
+    return file_md5(Path(path))
+
+
+@contextlib.contextmanager
+def _file_lock(path: Path) -> Generator[None, None, None]:
+    """Hold an exclusive lock on the file across the processes."""
+    with open(path, "a") as f:
+        if fcntl:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _profiles_checksum(hmms: ProfilesLike) -> str:
+    """Checksum that identifies the profiles. Use the md5 of the file if the profiles are given as a hmm file."""
+    if isinstance(hmms, (str, Path)):
+        return _hmm_md5(Path(hmms))
+    h = hashlib.md5()
+    for hmm in hmms:
+        h.update(hmm.name)
+        h.update(str(hmm.M).encode())
+        h.update(hmm.consensus.encode())
+    return h.hexdigest()
+
+
+def _sequence_blocks(
+    input: SequencesLike, blocksize: int | AdaptiveBlocksize | None, *, threads: int = 1
+) -> Generator[pyhmmer.easel.DigitalSequenceBlock, None, None]:
+    """Read the query sequences by batch from a plain or compressed fasta file, a fasta stream or the sequences in memory.
+
+    The size of each block is taken from the adaptive blocksize when the block is read.
+    """
+    next_size = blocksize.next_size if isinstance(blocksize, AdaptiveBlocksize) else lambda: blocksize
+    if isinstance(input, io.BufferedReader) and not input.peek(1):
+        # pyhmmer refuses to read an empty stream
+        input.close()
+    elif isinstance(input, (str, Path, io.BufferedReader)):
+        with sequence_file(input, digital=True, threads=threads) as seq_file:
+            while True:
+                seq_block = seq_file.read_block(sequences=next_size())
+                if not seq_block:
+                    break
+                yield seq_block
+    elif isinstance(input, pyhmmer.easel.DigitalSequenceBlock):
+        start = 0
+        while start < len(input):
+            size = next_size() or len(input)
+            yield input[start : start + size]
+            start += size
+    else:
+        alphabet = pyhmmer.easel.Alphabet.amino()
+        seqs = iter(input)
+        while True:
+            seq_block = pyhmmer.easel.DigitalSequenceBlock(
+                alphabet,
+                (
+                    pyhmmer.easel.TextSequence(name=name.encode(), sequence=seq).digitize(alphabet)
+                    for name, seq in itertools.islice(seqs, next_size())
+                ),
+            )
+            if not seq_block:
+                break
+            yield seq_block
+
+
 def _load_seqs_and_hmmsearch(
-    input: Path,
+    input: SequencesLike,
     hmms: list[pyhmmer.plan7.OptimizedProfile | pyhmmer.plan7.HMM],
     *,
     evalue: float = 1e-15,
     coverage: float = 0.35,
     threads: int = 1,
-    blocksize: int = 100000,
+    blocksize: int | AdaptiveBlocksize = 100000,
+    callback: Callable[[pyhmmer.plan7.OptimizedProfile | pyhmmer.plan7.HMM, int], None] | None = None,
+    cache: ResultCache | MemoryCache | None = None,
+    strategy: Literal["auto", "search", "scan"] = "auto",
+    prune: bool = False,
+    Z: int | None = None,
 ) -> Generator[dict[str, list[list]], None, None]:
-    """Load query sequences and run hmmsearch by batch."""
+    """Load query sequences and run hmmsearch by batch. The callback is called every time a profile is searched.
+
+    Sequences found in the cache are skipped and their cached hits are merged back to the results.
+    """
     blocksize = blocksize or None
-    with pyhmmer.easel.SequenceFile(input, digital=True) as seq_file:
-        for batch in itertools.count():
-            seq_block = seq_file.read_block(sequences=blocksize)
-            if not seq_block:
-                break
-            if blocksize:
-                logger.debug(f"Hmmsearch on sequence {batch * blocksize + 1}-{batch * blocksize + len(seq_block)}...")
-            yield _hmmsearch(seq_block, hmms, evalue=evalue, coverage=coverage, threads=threads)
+    searched = 0
+    for batch, seq_block in enumerate(metrics.timed("read", _sequence_blocks(input, blocksize, threads=threads))):
+        if blocksize:
+            logger.debug(f"Hmmsearch on sequence {searched + 1}-{searched + len(seq_block)}...")
+        searched += len(seq_block)
+        wall, cpu = time.perf_counter(), time.process_time()
+        if cache:
+            search = functools.partial(_cached_hmmsearch, cache=cache)
+        else:
+            search = _hmmsearch
+        results = search(
+            seq_block,
+            hmms,
+            evalue=evalue,
+            coverage=coverage,
+            threads=threads,
+            callback=callback,
+            strategy=strategy,
+            prune=prune,
+            Z=Z,
+        )
+        logger.info(f"Found {len(results)} genes have hits.")
+        if metrics.enabled or progress.enabled:
+            wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+            residues = sum(len(seq) for seq in seq_block)
+            progress.advance(sequences=len(seq_block), residues=residues, wall=wall)
+            metrics.count("sequences", len(seq_block))
+            metrics.count("residues", residues)
+            metrics.block(
+                block=batch,
+                sequences=len(seq_block),
+                residues=residues,
+                genes=len(results),
+                wall_seconds=wall,
+                cpu_seconds=cpu,
+            )
+        yield results
 
 
 def _hmmsearch(
@@ -107,32 +723,287 @@ def _hmmsearch(
     evalue: float = 1e-15,
     coverage: float = 0.35,
     threads: int = 1,
+    callback: Callable[[pyhmmer.plan7.OptimizedProfile | pyhmmer.plan7.HMM, int], None] | None = None,
+    Z: int | None = None,
+    strategy: Literal["auto", "search", "scan"] = "search",
+    prune: bool = False,
+) -> dict[str, list[list]]:
+    """Run hmmsearch. Specify Z to compute the evalues as if Z sequences were searched instead of the given sequences.
+
+    Use prune to group the sequences by length and search each group only against the profiles it is likely to satisfy at the
+    coverage cutoff, which can miss hits (see _plan_search). Use the strategy to run hmmscan instead, or auto to pick the faster
+    one for each group. Both give identical results but hmmscan calls the callback every time a sequence is scanned instead of
+    every time a profile is searched, so auto keeps hmmsearch when a callback is given.
+    """
+    Z = Z or len(sequences)
+    results = {}
+    for group, profiles in _plan_search(sequences, hmms, coverage=coverage) if prune else [(sequences, hmms)]:
+        group_strategy = strategy
+        if strategy == "auto":
+            group_strategy = "search" if callback else _choose_strategy(group, profiles, threads=threads)
+        if group_strategy == "scan":
+            results.update(_hmmscan(group, profiles, evalue=evalue, coverage=coverage, threads=threads, callback=callback, Z=Z))
+        else:
+            results.update(
+                _run_hmmsearch(group, profiles, evalue=evalue, coverage=coverage, threads=threads, callback=callback, Z=Z)
+            )
+    return results
+
+
+def _plan_search(
+    sequences: pyhmmer.easel.SequenceBlock, hmms: pyhmmer.plan7.OptimizedProfile | list[pyhmmer.plan7.HMM], *, coverage: float
+) -> list[tuple[pyhmmer.easel.SequenceBlock, list[pyhmmer.plan7.OptimizedProfile | pyhmmer.plan7.HMM]]]:
+    """Group the sequences by length and pair each group with the profiles it is likely to satisfy at the coverage cutoff.
+
+    A domain passes the cutoff if it spans at least coverage x M positions of a profile of length M. Each position is either
+    matched to a residue of the target or deleted, and the model does not bound the number of deletions, so no target length
+    rules a profile out for sure. The plan assumes an alignment spans at most _PRUNE_SLACK times as many positions as the
+    residues of the target and skips a profile for the targets shorter than coverage x M / _PRUNE_SLACK. This is approximate: the
+    domains with more deletions than that are missed. The short sequences are bucketed by powers of 2 of their lengths and the
+    rest, usually the most, are searched against all the profiles together.
+    """
+    minimum = [coverage * hmm.M / _PRUNE_SLACK for hmm in hmms]
+    longest = max(minimum, default=0)
+    buckets, full = {}, []
+    for seq in sequences:
+        if len(seq) < longest:
+            buckets.setdefault(len(seq).bit_length(), []).append(seq)
+        else:
+            full.append(seq)
+    if not buckets:
+        return [(sequences, hmms)]
+
+    plan, pruned = [], 0
+    for bucket, seqs in sorted(buckets.items()):
+        profiles = [hmm for hmm, length in zip(hmms, minimum) if length < 2**bucket]
+        pruned += len(seqs) * (len(hmms) - len(profiles))
+        if profiles:
+            plan.append((pyhmmer.easel.DigitalSequenceBlock(sequences.alphabet, seqs), profiles))
+    if full:
+        plan.append((pyhmmer.easel.DigitalSequenceBlock(sequences.alphabet, full), hmms))
+    metrics.count("pruned_comparisons", pruned)
+    logger.debug(f"Skip {pruned} comparisons of the sequences too short to pass the coverage cutoff.")
+    return plan
+
+
+def _run_hmmsearch(
+    sequences: pyhmmer.easel.SequenceBlock,
+    hmms: pyhmmer.plan7.OptimizedProfile | list[pyhmmer.plan7.HMM],
+    *,
+    evalue: float,
+    coverage: float,
+    threads: int,
+    callback: Callable[[pyhmmer.plan7.OptimizedProfile | pyhmmer.plan7.HMM, int], None] | None,
+    Z: int,
 ) -> dict[str, list[list]]:
-    """Run hmmsearch."""
+    """Run pyhmmer.hmmsearch and extract the domains passing the cutoffs."""
     results = {}
-    for hits in pyhmmer.hmmsearch(hmms, sequences, cpus=threads):
-        cog = hits.query.name.decode()
-        cog_length = hits.query.M
-        for hit in hits:
-            for domain in hit.domains:
-                hmm_from = domain.alignment.hmm_from
-                hmm_to = domain.alignment.hmm_to
-                cov = (hmm_to - hmm_from) / cog_length
-                if domain.i_evalue > evalue or cov < coverage:
-                    continue
-                results.setdefault(hit.name.decode(), []).append(
-                    [
-                        cog,
-                        cog_length,
-                        hit.name.decode(),
-                        hit.length,
-                        domain.i_evalue,
-                        hmm_from,
-                        hmm_to,
-                        domain.alignment.target_from,
-                        domain.alignment.target_to,
-                        cov,
-                    ]
-                )
-    logger.info(f"Found {len(results)} genes have hits.")
+    options = _thresholds(evalue, Z)
+    for hits in metrics.timed("hmmsearch", pyhmmer.hmmsearch(hmms, sequences, cpus=threads, callback=callback, **options)):
+        with metrics.stage("extract"):
+            cog = hits.query.name.decode()
+            cog_length = hits.query.M
+            for hit in hits.reported:
+                gene = None
+                for domain in hit.domains.reported:
+                    alignment = domain.alignment
+                    cov = (alignment.hmm_to - alignment.hmm_from) / cog_length
+                    if cov < coverage:
+                        continue
+                    gene = gene or hit.name.decode()
+                    results.setdefault(gene, []).append(
+                        [
+                            cog,
+                            cog_length,
+                            gene,
+                            hit.length,
+                            domain.i_evalue,
+                            alignment.hmm_from,
+                            alignment.hmm_to,
+                            alignment.target_from,
+                            alignment.target_to,
+                            cov,
+                        ]
+                    )
     return results
+
+
+def _hmmscan(
+    sequences: pyhmmer.easel.SequenceBlock,
+    hmms: pyhmmer.plan7.OptimizedProfile | list[pyhmmer.plan7.HMM],
+    *,
+    evalue: float,
+    coverage: float,
+    threads: int,
+    callback: Callable[[pyhmmer.easel.DigitalSequence, int], None] | None,
+    Z: int,
+) -> dict[str, list[list]]:
+    """Run pyhmmer.hmmscan and return the results in the same layout and order as _run_hmmsearch."""
+    order = {hmm.name: (i, hmm.M) for i, hmm in enumerate(hmms)}
+    results = {}
+    options = _thresholds(evalue, Z)
+    for hits in metrics.timed("hmmscan", pyhmmer.hmmscan(sequences, hmms, cpus=threads, callback=callback, **options)):
+        with metrics.stage("extract"):
+            gene = hits.query.name.decode()
+            gene_length = len(hits.query)
+            rows = []
+            # hmmscan sorts the hits of a sequence by evalue while hmmsearch reports them by the order of the profiles
+            for hit in sorted(hits.reported, key=lambda hit: order[hit.name][0]):
+                cog = None
+                cog_length = order[hit.name][1]
+                for domain in hit.domains.reported:
+                    alignment = domain.alignment
+                    cov = (alignment.hmm_to - alignment.hmm_from) / cog_length
+                    if cov < coverage:
+                        continue
+                    cog = cog or hit.name.decode()
+                    rows.append(
+                        [
+                            cog,
+                            cog_length,
+                            gene,
+                            gene_length,
+                            domain.i_evalue,
+                            alignment.hmm_from,
+                            alignment.hmm_to,
+                            alignment.target_from,
+                            alignment.target_to,
+                            cov,
+                        ]
+                    )
+            if rows:
+                results[gene] = rows
+    return results
+
+
+def _thresholds(evalue: float, Z: int) -> dict[str, float]:
+    """Reporting thresholds of pyhmmer that leave out the domains over the evalue cutoff before they reach Python.
+
+    The domains are reported by their conditional evalue, which equals the evalue in the results once domZ is set to Z. The
+    per-target threshold is kept at the HMMER default unless the cutoff is looser, since the evalue of a sequence can be larger
+    than the evalue of its best domain after the composition bias correction.
+    """
+    return {"Z": Z, "domZ": Z, "E": max(evalue, 10.0), "domE": evalue}
+
+
+def _choose_strategy(
+    sequences: pyhmmer.easel.SequenceBlock, hmms: pyhmmer.plan7.OptimizedProfile | list[pyhmmer.plan7.HMM], *, threads: int = 1
+) -> Literal["search", "scan"]:
+    """Pick hmmsearch or hmmscan for the group.
+
+    Hmmsearch splits the work by profile across the threads and hmmscan by sequence, so they keep min(threads, profiles) and
+    min(threads, sequences) threads busy. Hmmscan is picked when it keeps more threads busy than hmmsearch by more than its extra
+    cost on a single thread, _SCAN_COST, e.g. a custom database or a gated family of a handful of profiles searched with many
+    threads. Hmmsearch is kept on a single thread.
+    """
+    busy = min(threads, len(sequences)) / min(threads, max(len(hmms), 1))
+    strategy = "scan" if busy > _SCAN_COST else "search"
+    logger.debug(f"Use {strategy} strategy for {len(sequences)} sequences against {len(hmms)} profiles.")
+    return strategy
+
+
+def _cached_hmmsearch(
+    sequences: pyhmmer.easel.DigitalSequenceBlock,
+    hmms: pyhmmer.plan7.OptimizedProfile | list[pyhmmer.plan7.HMM],
+    *,
+    cache: ResultCache | MemoryCache,
+    evalue: float = 1e-15,
+    coverage: float = 0.35,
+    threads: int = 1,
+    callback: Callable[[pyhmmer.plan7.OptimizedProfile | pyhmmer.plan7.HMM, int], None] | None = None,
+    strategy: Literal["auto", "search", "scan"] = "auto",
+    prune: bool = False,
+    Z: int | None = None,
+) -> dict[str, list[list]]:
+    """Run hmmsearch on the unique sequences not found in the cache and fan the hits out to every sequence.
+
+    The evalue of a domain is its p-value times Z, the number of sequences in the block unless specified. The cache stores the
+    p-values of all the domains that can pass the evalue cutoff under any Z, so the results are identical to searching the whole
+    block.
+    """
+    results = {}
+    hits = _unique_hmmsearch(
+        sequences,
+        hmms,
+        cache=cache,
+        evalue=evalue,
+        coverage=coverage,
+        threads=threads,
+        callback=callback,
+        strategy=strategy,
+        prune=prune,
+    )
+    for seq, seq_hits in zip(sequences, hits):
+        _fan_out(results, seq, seq_hits, Z=Z or len(sequences), evalue=evalue)
+    return results
+
+
+def _unique_hmmsearch(
+    sequences: pyhmmer.easel.DigitalSequenceBlock,
+    hmms: pyhmmer.plan7.OptimizedProfile | list[pyhmmer.plan7.HMM],
+    *,
+    cache: ResultCache | MemoryCache | None = None,
+    evalue: float = 1e-15,
+    coverage: float = 0.35,
+    threads: int = 1,
+    callback: Callable[[pyhmmer.plan7.OptimizedProfile | pyhmmer.plan7.HMM, int], None] | None = None,
+    strategy: Literal["auto", "search", "scan"] = "auto",
+    prune: bool = False,
+) -> list[list[list]]:
+    """Search each unique sequence not found in the cache once and return the hits of every sequence in order.
+
+    The hits hold the p-value in place of the evalue and include every domain with a p-value under the evalue cutoff, which is
+    the loosest cutoff a domain can pass in any block. Use _fan_out to turn them into the results of a block.
+    """
+    Z = len(sequences)
+    cache = cache or MemoryCache()
+    with metrics.stage("cache"):
+        keys = [cache.key(seq) for seq in sequences]
+        cached = cache.get(list(dict.fromkeys(keys)))
+    missed = {}
+    for seq, key in zip(sequences, keys):
+        if key not in cached:
+            missed.setdefault(key, seq)
+    metrics.count("cache_hits", Z - len(missed))
+    logger.debug(f"Search {len(missed)} unique sequences not found in the cache out of {Z} sequences.")
+    if missed:
+        unique = list(missed.values())
+        if len({seq.name for seq in unique}) < len(unique):
+            # The hits are collected by name, so rename the sequences if the names are not unique
+            unique = [seq.copy() for seq in unique]
+            for i, seq in enumerate(unique):
+                seq.name = str(i).encode()
+        unique = pyhmmer.easel.DigitalSequenceBlock(sequences.alphabet, unique)
+        searched = _hmmsearch(
+            unique,
+            hmms,
+            evalue=evalue * Z,
+            coverage=coverage,
+            threads=threads,
+            callback=callback,
+            Z=Z,
+            strategy=strategy,
+            prune=prune,
+        )
+        entries = {
+            key: [[hit[0], hit[1], hit[4] / Z, *hit[5:]] for hit in searched.get(seq.name.decode(), [])]
+            for key, seq in zip(missed, unique)
+        }
+        with metrics.stage("cache"):
+            cache.put(entries)
+        cached.update(entries)
+    return [cached[key] for key in keys]
+
+
+def _fan_out(
+    results: dict[str, list[list]], sequence: pyhmmer.easel.DigitalSequence, hits: list[list], *, Z: int, evalue: float
+) -> None:
+    """Add the hits returned by _unique_hmmsearch to the results of a block of Z sequences."""
+    name = sequence.name.decode()
+    hits = [
+        [cog, cog_length, name, len(sequence), pvalue * Z, *coords]
+        for cog, cog_length, pvalue, *coords in hits
+        if pvalue * Z <= evalue
+    ]
+    if hits:
+        results.setdefault(name, []).extend(hits)
@@ -2,27 +2,47 @@
 
 from __future__ import annotations
 
+import contextlib
 import csv
-import hashlib
+import json
 import os
 import re
+import sys
 from pathlib import Path
-from typing import Generator
+from typing import Generator, NamedTuple
 
 from ._header import Headers
 
-from . import AVAIL_MODES, CFG_DIR, DB_PATH, _libbuild, logger
-from ._utils import fetch_database_metadata, writer
-from .libdiamond import diamond_search
-from .libhmm import cazyme_search, subs_search
+from . import AVAIL_MODES, CFG_DIR, COMPRESSION_SUFFIXES, DB_PATH, FASTA_SUFFIXES, _libbuild, logger
+from ._cache import DEFAULT_CACHE_SIZE, ResultCache
+from ._index import FastaIndex
+from ._input import detect_format
+from ._metrics import metrics, profiler, record_metrics
+from ._metrics import progress as search_progress
+from ._store import ResultStore
+from ._utils import fetch_database_metadata, http_cache, parse_size, sort_lines, writer
+from .libdiamond import batch_diamond_search, diamond_search, sseqid_families
+from .libhmm import (
+    AdaptiveBlocksize,
+    batch_search,
+    cazyme_search,
+    count_sequences,
+    gated_subs_search,
+    profile_checksums,
+    subs_search,
+    update_search,
+)
 
 
-def build(force: bool = False, threads: int = 1, **kwargs) -> None:
+@record_metrics("build")
+def build(force: bool = False, threads: int = 1, offline: bool = False, **kwargs) -> None:
     """
     Download and build the required databases.
 
     Clear the database files that already exist in the config folder. (~/.dbcanlight) Download from the dbcan website and use
-    hmmpress to build the databases for hmm profile. Use the threads option to download parallelly.
+    hmmpress to build the databases for hmm profile. Use the threads option to download parallelly. Downloads are skipped if the
+    server reports the files are not modified since the last build. Use the offline option to check the databases against the
+    cached or bundled metadata without accessing the network.
     """
     if not os.access(CFG_DIR, os.W_OK):
         raise PermissionError(f"The config folder {CFG_DIR} is not writable.")
@@ -31,7 +51,9 @@ def build(force: bool = False, threads: int = 1, **kwargs) -> None:
         logger.warning("Specified more than 4 CPUs. Use only 4 at most.")
         threads = 4
 
-    db_urls = fetch_database_metadata()
+    cache = http_cache()
+    with metrics.stage("fetch_metadata"):
+        db_urls = fetch_database_metadata(cache=cache, offline=offline)
 
     logger.info("Checking databases...")
     for dbname, db_file in DB_PATH.items():
@@ -43,26 +65,68 @@ def build(force: bool = False, threads: int = 1, **kwargs) -> None:
 
         if force:
             print("force rebuild")
-        elif not db_file.is_file():
+            cache.forget(db_urls[dbname][0])
+        elif not db_file.is_file() or not filepath.is_file():
             print("not found")
-        elif hashlib.md5(open(filepath, "rb").read()).hexdigest() != db_urls[dbname][1]:
+        elif cache.md5(filepath) != db_urls[dbname][1]:
             print("update required")
         else:
             print("ok")
             continue
+        if offline:
+            logger.warning("Offline mode. Skip downloading %s.", filepath)
+            continue
         logger.info("Downloading %s from %s...", filepath, db_urls[dbname][0])
-        getattr(_libbuild, dbname)(db_urls[dbname][0], filepath, threads=threads)
+        with metrics.stage(f"build_{dbname}"):
+            getattr(_libbuild, dbname)(db_urls[dbname][0], filepath, md5=db_urls[dbname][1], threads=threads)
+        if filepath.is_file() and cache.md5(filepath) != db_urls[dbname][1]:
+            logger.warning("The checksum of %s does not match the database metadata.", filepath)
+
+
+class _SearchOptions(NamedTuple):
+    """Options of the hmmsearch shared by the search of an input, a part of it and the input list."""
 
+    evalue: float
+    coverage: float
+    threads: int
+    blocksize: int | AdaptiveBlocksize
+    strategy: str
+    prune: bool
+    Z: int | None
 
+
+@record_metrics("search")
 def search(
-    input: str | Path,
+    input: str | Path | None,
     output: str | Path,
     *,
     mode: str = "cazyme",
     evalue: str | float = "AUTO",
     coverage: float = 0.35,
     threads: int = 1,
-    blocksize: int = 100000,
+    blocksize: int | str = 100000,
+    profile: str | Path | None = None,
+    cache: str | Path | None = None,
+    cache_size: int = DEFAULT_CACHE_SIZE,
+    dedup: bool = False,
+    strategy: str = "auto",
+    prune: bool = False,
+    Z: int | None = None,
+    gate: str | Path | bool | None = None,
+    verify_gate: bool = False,
+    start: str | None = None,
+    shard: str | None = None,
+    max_target_seqs: int = 1,
+    top: float | None = None,
+    db: str | Path | None = None,
+    sample: str | None = None,
+    sorted_output: bool = False,
+    progress: str | Path | None = None,
+    progress_interval: float = 30.0,
+    record_profiles: bool = False,
+    update_from: str | Path | None = None,
+    input_list: str | Path | None = None,
+    run_conclude: bool = False,
     **kwargs,
 ) -> None:
     """
@@ -70,37 +134,441 @@ def search(
 
     Use "cazyme" mode to report the CAZyme families predicted by HMM; "sub" mode to report the potential substrates; and "diamond"
     mode to report the CAZyme families predicted by DIAMOND. (--tools hmmer/dbcansub/diamond in the original run_dbcan)
+
+    Search many genomes in one go with the input list instead of the input, or a part of a large input with the start and shard
+    options. The evalues are computed against the number of sequences in the whole input unless Z is specified, so the results
+    do not depend on the blocksize or the part searched.
+
+    Use the strategy option to run hmmsearch or hmmscan on each block. The default auto picks hmmscan when it keeps more threads
+    busy than hmmsearch, e.g. for a custom database of a handful of profiles. The results are identical in any case. Use prune to
+    skip the profiles a sequence is likely too short to satisfy at the coverage cutoff, which is faster on fragmented ORFs but
+    approximate.
     """
-    if mode != "diamond" and blocksize < 0:
+    _check_search_args(
+        mode,
+        blocksize=blocksize,
+        Z=Z,
+        gate=gate,
+        verify_gate=verify_gate,
+        max_target_seqs=max_target_seqs,
+        top=top,
+        update_from=update_from,
+        part=bool(start or shard),
+        input_list=input_list,
+    )
+    if mode == "diamond":
+        for name, value in (("blocksize", blocksize), ("cache", cache), ("Z", Z), ("progress", progress), ("prune", prune)):
+            if value:
+                logger.warning(f'Parameter "{name}" is not applicable on diamond.')
+        progress = None
+    if evalue == "AUTO":
+        evalue = 1e-102 if mode == "diamond" else 1e-15
+    options = _SearchOptions(
+        evalue=float(evalue),
+        coverage=coverage,
+        threads=threads,
+        blocksize=_adaptive_blocksize(blocksize) if isinstance(blocksize, str) and mode != "diamond" else blocksize,
+        strategy=strategy,
+        prune=prune,
+        Z=Z,
+    )
+    with ResultCache(cache, max_size=cache_size * 2**20) if cache and mode != "diamond" else contextlib.nullcontext() as cache:
+        if input_list:
+            return _search_batch(
+                input_list,
+                output,
+                mode=mode,
+                options=options,
+                cache=cache,
+                dedup=dedup,
+                max_target_seqs=max_target_seqs,
+                top=top,
+                db=db,
+                sorted_output=sorted_output,
+                progress=progress,
+                progress_interval=progress_interval,
+                record_profiles=record_profiles,
+                run_conclude=run_conclude,
+            )
+
+        indexed, begin, end = FastaIndex.load(input), 0, None
+        if start or shard:
+            with metrics.stage("index"):
+                indexed = FastaIndex.open_or_build(input)
+            begin, end = _search_range(indexed, start=start, shard=shard)
+            logger.info(
+                f"Search sequence {begin + 1}-{end} ({sum(indexed.residues[begin:end])} residues) "
+                f"out of {len(indexed)} sequences in {input}."
+            )
+        if mode != "diamond" and not Z:
+            options = options._replace(Z=_sequence_count(input, indexed, blocksize=blocksize, threads=threads))
+
+        def sequences():
+            """Open the sequences in the range if searching a part of the input."""
+            return indexed.open(begin, end) if start or shard else input
+
+        missed = None
+        if mode == "diamond":
+            results = diamond_search(
+                sequences(),
+                evalue=options.evalue,
+                coverage=coverage,
+                threads=threads,
+                dedup=dedup,
+                max_target_seqs=max_target_seqs,
+                top=top,
+            )
+        elif update_from:
+            results = _update(input, update_from, mode=mode, options=options)
+        elif gate:
+            if cache or dedup:
+                logger.warning('Parameter "cache" and "dedup" are not applicable with "gate".')
+            families = _gate_families(sequences(), output, gate, options=options, record_profiles=record_profiles)
+            missed = [] if verify_gate else None
+            results = gated_subs_search(sequences(), DB_PATH["subs_hmms"], families, missed=missed, **options._asdict())
+        else:
+            search_func, hmm_file = (cazyme_search, "cazyme_hmms") if mode == "cazyme" else (subs_search, "subs_hmms")
+            results = search_func(sequences(), DB_PATH[hmm_file], cache=cache, dedup=dedup, **options._asdict())
+
+        if sorted_output:
+            results = sort_lines(results, key=_gene_column(mode))
+        total, estimated = _progress_total(input, indexed, begin=begin, end=end) if progress else (None, False)
+        output = Path(output) / AVAIL_MODES[mode]
+        with ResultStore(db) if db else contextlib.nullcontext() as store:
+            if store:
+                results = store.record_hits(results, sample=sample or _sample_name(output.parent), mode=mode)
+            with profiler(profile), search_progress.track(progress, total=total, estimated=estimated, interval=progress_interval):
+                written = writer(results, output, header=getattr(Headers, mode))
+        if record_profiles and mode != "diamond" and output.is_file():
+            _write_search_info(
+                output, mode=mode, options=options, gated=bool(gate), sequences=(begin + 1, end) if start or shard else None
+            )
+        if missed is not None:
+            _write_missed(missed, output.with_name("substrates.missed.tsv"), sorted_output=sorted_output)
+        return written
+
+
+def _check_search_args(
+    mode: str,
+    *,
+    blocksize: int | str,
+    Z: int | None,
+    gate: str | Path | bool | None,
+    verify_gate: bool,
+    max_target_seqs: int,
+    top: float | None,
+    update_from: str | Path | None,
+    part: bool,
+    input_list: str | Path | None,
+) -> None:
+    """Raise on the invalid or conflicting search options and warn about the ones not applicable."""
+    if mode not in AVAIL_MODES:
+        raise KeyError(f"{mode} is not an available mode.")
+    if isinstance(blocksize, str):
+        if input_list:
+            raise ValueError('Parameter "blocksize" cannot be "auto" with "input_list".')
+    elif mode != "diamond" and blocksize < 0:
         raise ValueError(f"blocksize={blocksize} which is smaller than 0.")
-    if mode == "cazyme":
-        evalue = 1e-15 if evalue == "AUTO" else evalue
-        results = cazyme_search(
-            input, DB_PATH["cazyme_hmms"], evalue=evalue, coverage=coverage, threads=threads, blocksize=blocksize
+    if mode != "diamond" and Z is not None and Z < 1:
+        raise ValueError(f"Z={Z} which is smaller than 1.")
+    if gate and (mode != "sub" or input_list or update_from):
+        raise ValueError('Parameter "gate" is only applicable on sub mode with a single input.')
+    if verify_gate and not gate:
+        logger.warning('Parameter "verify_gate" is only applicable with "gate".')
+    if mode != "diamond" and (max_target_seqs != 1 or top is not None):
+        logger.warning('Parameter "max_target_seqs" and "top" are only applicable on diamond.')
+    if update_from:
+        if mode == "diamond":
+            raise ValueError('Parameter "update_from" is not applicable on diamond.')
+        if input_list:
+            raise ValueError('Parameter "update_from" is not applicable with "input_list".')
+        if part:
+            raise ValueError('Parameter "start" and "shard" are not applicable with "update_from".')
+
+
+def _adaptive_blocksize(blocksize: str) -> AdaptiveBlocksize:
+    """Blocksize adapted to the runtime and the memory usage from "auto" or "auto:<memory limit>", e.g. "auto:16G"."""
+    auto, _, mem_limit = blocksize.partition(":")
+    if auto != "auto":
+        raise ValueError(f'blocksize={blocksize} which is neither an integer nor "auto[:<memory limit>]".')
+    blocksize = AdaptiveBlocksize(mem_limit=parse_size(mem_limit) if mem_limit else None)
+    if blocksize.mem_limit:
+        logger.info(f"Adapt the blocksize to the runtime and the memory limit of {blocksize.mem_limit / 2**30:.1f} GB.")
+    return blocksize
+
+
+def _write_missed(missed: list[list], output: Path, *, sorted_output: bool) -> None:
+    """Report and output the hits missed by the gated substrate search."""
+    if missed:
+        logger.warning(f"The gating missed {len(missed)} hits of {len({line[5] for line in missed})} genes.")
+    else:
+        logger.info("The gating missed no hits.")
+    if sorted_output:
+        missed = sort_lines(missed, key=_gene_column("sub"))
+    writer(missed, output, header=Headers.sub)
+
+
+def _gate_families(
+    input: str | Path, output: str | Path, gate: str | Path | bool, *, options: _SearchOptions, record_profiles: bool
+) -> dict[str, set[str]]:
+    """Read the CAZy families hit by each gene from the cazyme results.
+
+    Run the cazyme search first if the results are not given and not found under the output folder.
+    """
+    cazymes = Path(output) / AVAIL_MODES["cazyme"] if gate is True else Path(gate)
+    if gate is True and not cazymes.is_file():
+        logger.info(f"{cazymes} not found. Search the cazyme database first...")
+        writer(cazyme_search(input, DB_PATH["cazyme_hmms"], **options._asdict()), cazymes, header=Headers.cazyme)
+        if record_profiles:
+            _write_search_info(cazymes, mode="cazyme", options=options)
+
+    families = {}
+    with open(cazymes) as f:
+        reader = csv.reader(f, delimiter="\t")
+        next(reader, None)
+        for line in reader:
+            families.setdefault(line[2], set()).add(line[0].split("_")[0])
+    logger.info(f"Gate the substrate search by the CAZy families of {len(families)} genes in {cazymes}.")
+    return families
+
+
+def _read_input_list(input_list: str | Path, output: str | Path) -> list[tuple[Path, Path]]:
+    """Return the pairs of the input fasta and its output folder from a folder of fasta or a tsv of the inputs and outputs.
+
+    The paths are absolute. The relative paths in the tsv are relative to the folder of the tsv.
+    """
+    input_list, output = Path(input_list).resolve(), Path(output).resolve()
+
+    def split(file: Path) -> tuple[str, str]:
+        name = file.name
+        stem, _, suffix = name.rpartition(".")
+        if stem and suffix in COMPRESSION_SUFFIXES:
+            name = stem
+            stem, _, suffix = name.rpartition(".")
+        return (stem, suffix) if stem else (name, "")
+
+    if input_list.is_dir():
+        files = sorted(file for file in input_list.iterdir() if file.is_file() and split(file)[1] in FASTA_SUFFIXES)
+        pairs = [(file, output / split(file)[0]) for file in files]
+    else:
+        pairs = []
+        with open(input_list) as f:
+            for line in csv.reader(f, delimiter="\t"):
+                if not line or not line[0].strip() or line[0].startswith("#"):
+                    continue
+                file = (input_list.parent / line[0].strip()).resolve()
+                folder = line[1].strip() if len(line) > 1 else ""
+                pairs.append((file, (input_list.parent / folder).resolve() if folder else output / split(file)[0]))
+    if not pairs:
+        raise FileNotFoundError(f"No input found in {input_list}.")
+    outputs = [folder for _, folder in pairs]
+    if len(set(outputs)) < len(outputs):
+        raise ValueError(f"Multiple inputs in {input_list} are output to the same folder.")
+    return pairs
+
+
+def _search_batch(
+    input_list: str | Path,
+    output: str | Path,
+    *,
+    mode: str,
+    options: _SearchOptions,
+    cache: ResultCache | None,
+    dedup: bool,
+    max_target_seqs: int,
+    top: float | None,
+    db: str | Path | None,
+    sorted_output: bool,
+    progress: str | Path | None,
+    progress_interval: float,
+    record_profiles: bool,
+    run_conclude: bool,
+) -> None:
+    """Search the genomes in the input list in one go and output the results to the folder of each genome."""
+    pairs = _read_input_list(input_list, output)
+    inputs = [file for file, _ in pairs]
+    logger.info(f"Searching {len(inputs)} inputs listed in {input_list}...")
+    if mode == "diamond":
+        results = batch_diamond_search(
+            inputs,
+            evalue=options.evalue,
+            coverage=options.coverage,
+            threads=options.threads,
+            dedup=dedup,
+            max_target_seqs=max_target_seqs,
+            top=top,
         )
-    elif mode == "sub":
-        evalue = 1e-15 if evalue == "AUTO" else evalue
-        results = subs_search(input, DB_PATH["subs_hmms"], evalue=evalue, coverage=coverage, threads=threads, blocksize=blocksize)
-    elif mode == "diamond":
-        if abs(blocksize) > 0:
-            logger.warning('Parameter "blocksize" is not applicable on diamond.')
-        evalue = 1e-102 if evalue == "AUTO" else evalue
-        results = diamond_search(input, evalue=evalue, coverage=coverage, threads=threads)
     else:
-        raise KeyError(f"{mode} is not an available mode.")
-    header = getattr(Headers, mode)
-    output = Path(output) / AVAIL_MODES[mode]
+        sizes = [options.Z or _sequence_count(file, blocksize=options.blocksize, threads=options.threads) for file in inputs]
+        hmm_file = DB_PATH["cazyme_hmms"] if mode == "cazyme" else DB_PATH["subs_hmms"]
+        results = batch_search(inputs, hmm_file, mode=mode, cache=cache, dedup=dedup, **options._replace(Z=sizes)._asdict())
+    totals = [_progress_total(file, FastaIndex.load(file)) for file in inputs] if progress else []
+    tracker = search_progress.track(
+        progress,
+        total=None if any(total is None for total, _ in totals) else sum(total for total, _ in totals),
+        estimated=any(estimated for _, estimated in totals),
+        interval=progress_interval,
+    )
+    with ResultStore(db) if db else contextlib.nullcontext() as store, tracker:
+        for idx, lines in results:
+            folder = pairs[idx][1]
+            if sorted_output:
+                lines = sort_lines(lines, key=_gene_column(mode))
+            if store:
+                lines = store.record_hits(lines, sample=_sample_name(folder), mode=mode)
+            writer(lines, folder / AVAIL_MODES[mode], header=getattr(Headers, mode))
+            if record_profiles and mode != "diamond":
+                _write_search_info(folder / AVAIL_MODES[mode], mode=mode, options=options._replace(Z=sizes[idx]))
+            if run_conclude:
+                if sum((folder / file_name).is_file() for file_name in AVAIL_MODES.values()) >= 2:
+                    conclude.__wrapped__(folder, db=db)
+                else:
+                    logger.debug(f"Skip concluding {folder} which has the results of less than 2 modes.")
+
+
+def _progress_total(
+    input: str | Path, indexed: FastaIndex | None, *, begin: int = 0, end: int | None = None
+) -> tuple[int | None, bool]:
+    """Number of residues to search in the input and whether it is estimated.
+
+    The number is taken from the index if indexed, otherwise estimated by the size of the plain fasta. It is unknown for the
+    compressed fasta.
+    """
+    if indexed:
+        return sum(indexed.residues[begin:end]), False
+    if detect_format(input) == "plain":
+        return os.path.getsize(input), True
+    return None, False
+
+
+def _sequence_count(
+    input: str | Path, indexed: FastaIndex | None = None, *, blocksize: int | str, threads: int = 1
+) -> int | None:
+    """Number of sequences of the input to compute the evalues against, or None to count the sequences of each block.
+
+    The number is taken from the index if indexed. Otherwise the input is counted ahead only if it is searched in blocks, as the
+    single block of the whole input is counted as it is read.
+    """
+    indexed = indexed or FastaIndex.load(input)
+    if indexed:
+        return len(indexed)
+    if blocksize == 0:
+        return None
+    with metrics.stage("count"):
+        logger.info(f"Counting the sequences in {input}. Index the input or specify Z to skip this pass.")
+        count = count_sequences(input, threads=threads)
+    logger.info(f"Found {count} sequences in {input}.")
+    return count
+
+
+def _gene_column(mode: str) -> int:
+    """Column of the gene ID in the results of the mode."""
+    return getattr(Headers, mode).index("qseqid" if mode == "diamond" else "Gene_ID")
+
+
+def _sample_name(output: str | Path) -> str:
+    """Name of the sample stored in the results database, i.e. the name of its output folder."""
+    return Path(output).resolve().name
+
+
+def _search_info_file(output: Path) -> Path:
+    """File that records the profiles and cutoffs used to make the results."""
+    return output.with_suffix(".profiles.json")
+
+
+def _write_search_info(
+    output: Path,
+    *,
+    mode: str,
+    options: _SearchOptions,
+    gated: bool = False,
+    sequences: tuple[int, int] | None = None,
+) -> None:
+    """Record the checksum of each profile and the cutoffs next to the results so that they can be updated later."""
+    hmm_file = DB_PATH["cazyme_hmms"] if mode == "cazyme" else DB_PATH["subs_hmms"]
+    info = {
+        "evalue": options.evalue,
+        "coverage": options.coverage,
+        "blocksize": "auto" if isinstance(options.blocksize, AdaptiveBlocksize) else options.blocksize,
+        "Z": options.Z,
+        "prune": options.prune,
+        "gated": gated,
+        "sequences": sequences,
+        "profiles": profile_checksums(hmm_file),
+    }
+    with open(_search_info_file(output), "w") as f:
+        json.dump(info, f, indent=4)
+
+
+def _update(input: str | Path, update_from: str | Path, *, mode: str, options: _SearchOptions) -> Generator[list, None, None]:
+    """Update the previous results in the given folder to the current database."""
+    previous = Path(update_from) / AVAIL_MODES[mode]
+    try:
+        with open(_search_info_file(previous)) as f:
+            info = json.load(f)
+    except FileNotFoundError:
+        raise FileNotFoundError(
+            f"{_search_info_file(previous)} not found. Only the results made by dbcanlight with the profile checksums recorded "
+            "can be updated."
+        )
+    if info.get("gated"):
+        raise ValueError(f"{previous} was made by the gated substrate search and cannot be updated.")
+    if info.get("sequences"):
+        raise ValueError(f"{previous} was made by searching a part of the input and cannot be updated.")
+    for key in ("evalue", "coverage", "Z"):
+        value = getattr(options, key)
+        if info.get(key) != value:
+            logger.warning(f"The previous results were made with {key}={info.get(key)} but got {value}. The results may differ.")
+    hmm_file = DB_PATH["cazyme_hmms"] if mode == "cazyme" else DB_PATH["subs_hmms"]
+    return update_search(
+        input,
+        hmm_file,
+        previous,
+        checksums=info["profiles"],
+        mode=mode,
+        **options._asdict(),
+    )
+
 
-    return writer(results, output, header=header)
+def _search_range(index: FastaIndex, *, start: str | None, shard: str | None) -> tuple[int, int]:
+    """Range [begin, end) of the sequences to search from the sequence ID or 1-based position and the shard (k/n)."""
+    begin = 0
+    if start:
+        begin = int(start) - 1 if start.isdigit() else index.find(start)
+        if not 0 <= begin < len(index):
+            raise ValueError(f"start={start} which is out of the {len(index)} sequences.")
+    if not shard:
+        return begin, len(index)
+    k, _, n = shard.partition("/")
+    if not (k.isdigit() and n.isdigit() and 1 <= int(k) <= int(n)):
+        raise ValueError(f'shard={shard} which is not in the form of "k/n" with 1 <= k <= n.')
+    return index.shard(int(k) - 1, int(n), start=begin)
+
+
+@record_metrics("index")
+def index(input: str | Path, **kwargs) -> None:
+    """
+    Index the byte offsets of the sequences of a plain protein fasta for the search module to seek to any sequence.
+
+    The index is written next to the fasta (<fasta>.dbi) in a single pass and is invalidated once the fasta is modified. The
+    search module uses it to start from any sequence (--start) and to split the input into shards balanced by the number of
+    residues (--shard).
+    """
+    with metrics.stage("index"):
+        fasta_index = FastaIndex.build(input)
+        fasta_index.save()
+    logger.info(f"Indexed {len(fasta_index)} sequences ({sum(fasta_index.residues)} residues) to {fasta_index.path}.")
 
 
-def conclude(output: str | Path, **kwargs) -> None:
+@record_metrics("conclude")
+def conclude(output: str | Path, db: str | Path | None = None, sample: str | None = None, **kwargs) -> None:
     """
     Conclude the results made by each module.
 
     Please make sure the predictions made by each module are included in the same folder and keep the original file names. (since
     the conclude module rely on the file name to identify the files and the corresponding tools that made it) The output
-    "overview.tsv" will be output to the same folder.
+    "overview.tsv" will be output to the same folder. Use the db option to store the overview in a SQLite database under the sample
+    name (the name of the folder by default) for the query module to look up across the samples.
     """
 
     def sort_helper(string: str):
@@ -131,7 +599,7 @@ def conclude(output: str | Path, **kwargs) -> None:
         file_path = Path(output) / file_name
         if file_path.is_file():
             logger.info(f"Processing {file_path}...")
-            with open(file_path) as f:
+            with metrics.stage(f"read_{mode}"), open(file_path) as f:
                 reader = csv.reader(f, delimiter="\t")
                 next(reader, None)
                 for line in reader:
@@ -140,7 +608,7 @@ def conclude(output: str | Path, **kwargs) -> None:
                     elif mode == "sub":
                         gene, fams, ecs, subs = line[5], [line[0]], line[2].split("|"), line[3].split(",")
                     elif mode == "diamond":
-                        gene, fams = line[0], line[1].split("|")[1:]
+                        gene, fams = line[0], sseqid_families(line[1])
                     results.setdefault(gene, {r: set() for r in tuple(AVAIL_MODES.keys()) + ("ec", "substrate")})
 
                     [results[gene][mode].add(fam) for fam in fams]
@@ -153,5 +621,51 @@ def conclude(output: str | Path, **kwargs) -> None:
     if avail_results < 2:
         raise RuntimeError(f"Required at least 2 results to conclude but got {avail_results}. Aborted.")
     results = summarize(results)
-
+    if db:
+        with ResultStore(db) as store:
+            return writer(
+                store.record_overview(results, sample=sample or _sample_name(output)),
+                Path(output) / "overview.tsv",
+                header=Headers.overview,
+            )
     return writer(results, Path(output) / "overview.tsv", header=Headers.overview)
+
+
+@record_metrics("query")
+def query(
+    db: str | Path,
+    *,
+    mode: str | None = None,
+    family: list[str] | None = None,
+    substrate: list[str] | None = None,
+    ec: list[str] | None = None,
+    sample: list[str] | None = None,
+    gene: list[str] | None = None,
+    output: str | Path | None = None,
+    **kwargs,
+) -> int:
+    """
+    Query the results stored in the SQLite database by the search and conclude modules with the db option.
+
+    Report the overview rows of the genes in all the samples that have all the given families, substrates and ECs, or the hits of
+    the given mode, together with the sample names. Output to stdout unless an output file is given. Return the number of rows.
+    """
+    if not Path(db).is_file():
+        raise FileNotFoundError(f"{db} not found.")
+    header = ("Sample", *(getattr(Headers, mode) if mode else Headers.overview))
+    with ResultStore(db) as store, metrics.stage("query"):
+        rows = store.query(
+            mode=mode, family=family or (), substrate=substrate or (), ec=ec or (), sample=sample or (), gene=gene or ()
+        )
+        f = open(output, "w") if output else sys.stdout
+        try:
+            f.write("\t".join(header) + "\n")
+            n = 0
+            for row in rows:
+                f.write("\t".join(row) + "\n")
+                n += 1
+        finally:
+            if output:
+                f.close()
+    logger.info(f"Found {n} rows in {db}.")
+    return n
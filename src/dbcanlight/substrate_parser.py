@@ -19,8 +19,8 @@ from .hmmsearch_parser import HmmsearchParser
 
 
 @CheckDB(DB_PATH["subs_mapper"])
-def substrate_mapping(results: Sequence[list] | Iterator[list]) -> Generator[list, None, None]:
-    """Map the hmm profiles to the corresponding substrates."""
+def substrate_mapping(results: Sequence[list] | Iterator[list], *, formatted: bool = True) -> Generator[list, None, None]:
+    """Map the hmm profiles to the corresponding substrates. Set formatted to False to keep the coverage as float."""
 
     def get_subs_dict() -> dict[set]:
         subs_dict = {}
@@ -69,7 +69,7 @@ def substrate_mapping(results: Sequence[list] | Iterator[list]) -> Generator[lis
             ("|").join(sub_ec) if sub_ec else "-",
             (",").join(list(substrate)) if substrate else "-",
             *line[1:-1],
-            f"{float(line[-1]):0.3}",
+            f"{float(line[-1]):0.3}" if formatted else float(line[-1]),
         ]
 
 
@@ -0,0 +1,181 @@
+from __future__ import annotations
+
+import asyncio
+import gc
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+
+import pyhmmer
+import pytest
+
+from dbcanlight import DB_PATH
+from dbcanlight.api import (
+    CazymeHit,
+    DiamondHit,
+    Profiles,
+    SubstrateHit,
+    _retrieve_exception,
+    diamond_search_async,
+    load_profiles,
+    search_async,
+    search_sequences,
+    to_frame,
+)
+from dbcanlight.libhmm import cazyme_search
+
+input = Path("tests/data/example.faa")
+
+
+@pytest.fixture(scope="module")
+def sequences() -> list[tuple[str, str]]:
+    with pyhmmer.easel.SequenceFile(input) as f:
+        return [(seq.name.decode(), seq.sequence) for seq in f]
+
+
+def test_search_sequences_cazyme(sequences: list[tuple[str, str]]):
+    r = search_sequences(sequences, "cazyme")
+    assert len(r) == 1 and isinstance(r[0], CazymeHit)
+    assert isinstance(r[0].evalue, float) and isinstance(r[0].gene_start, int)
+    expect = next(iter(cazyme_search(input, DB_PATH["cazyme_hmms"])))
+    assert [r[0].gene_id, f"{r[0].evalue:0.1e}", r[0].gene_start] == [expect[2], expect[4], expect[7]]
+
+
+def test_search_sequences_sub(sequences: list[tuple[str, str]]):
+    r = search_sequences(sequences, "sub")
+    assert len(r) == 2 and isinstance(r[0], SubstrateHit)
+    assert r[0].dbcan_subfam == "CBM46_e1"
+
+
+def test_search_sequences_digital_block():
+    with pyhmmer.easel.SequenceFile(input, digital=True) as f:
+        block = f.read_block()
+    r = search_sequences(block, "cazyme", blocksize=1)
+    assert [hit.gene_id for hit in r] == [hit.gene_id for hit in search_sequences(block, "cazyme")]
+
+
+def test_search_sequences_concurrent(sequences: list[tuple[str, str]]):
+    profiles = load_profiles("sub")
+    expect = search_sequences(sequences, "sub", profiles=profiles)
+    with ThreadPoolExecutor(4) as executor:
+        results = list(executor.map(lambda _: search_sequences(sequences, "sub", profiles=profiles), range(8)))
+    assert all(r == expect for r in results)
+
+
+def test_search_sequences_diamond(sequences: list[tuple[str, str]]):
+    r = search_sequences(sequences, "diamond")
+    assert len(r) == 1 and isinstance(r[0], DiamondHit)
+
+
+def test_load_profiles_shared():
+    profiles = load_profiles("cazyme")
+    assert load_profiles("cazyme") is profiles
+    with profiles.acquire() as hmms, profiles.acquire() as other:
+        # The loaded profiles are only copied and the copies are not shared by the overlapping searches
+        assert all(copy is not profiles._profiles for copy in (hmms, other)) and other is not hmms
+    with profiles.acquire() as again:
+        assert again is hmms or again is other
+
+
+def _search_forked(sequences: list[tuple[str, str]]) -> tuple[int, list]:
+    return id(load_profiles("sub")), search_sequences(sequences, "sub")
+
+
+@pytest.mark.skipif("fork" not in multiprocessing.get_all_start_methods(), reason="fork is not available")
+def test_load_profiles_forked(sequences: list[tuple[str, str]]):
+    profiles = load_profiles("sub")
+    expect = search_sequences(sequences, "sub")
+    with ProcessPoolExecutor(2, mp_context=multiprocessing.get_context("fork")) as executor:
+        results = list(executor.map(_search_forked, [sequences] * 2))
+    assert all(r == (id(profiles), expect) for r in results)
+
+
+_forked_profiles: Profiles | None = None
+
+
+def _acquire_forked(_) -> int:
+    with _forked_profiles.acquire() as hmms:
+        return id(hmms)
+
+
+@pytest.mark.skipif("fork" not in multiprocessing.get_all_start_methods(), reason="fork is not available")
+def test_profiles_forked_not_copied():
+    global _forked_profiles
+    _forked_profiles = Profiles(DB_PATH["subs_hmms"])
+    with ProcessPoolExecutor(2, mp_context=multiprocessing.get_context("fork")) as executor:
+        forked = list(executor.map(_acquire_forked, range(4)))
+    # The workers borrow the copy put into the pool before forking instead of copying the profiles again
+    with _forked_profiles.acquire() as hmms:
+        assert forked == [id(hmms)] * 4
+
+
+def test_load_profiles_keyerror():
+    with pytest.raises(KeyError, match=r".+ is not an available mode for hmmsearch."):
+        load_profiles("diamond")
+
+
+def test_to_frame(sequences: list[tuple[str, str]]):
+    pd = pytest.importorskip("pandas")
+    df = to_frame(search_sequences(sequences, "cazyme"))
+    assert isinstance(df, pd.DataFrame)
+    assert tuple(df.columns) == CazymeHit._fields
+
+
+def test_search_async(sequences: list[tuple[str, str]]):
+    async def run():
+        return await asyncio.gather(*(search_async(sequences, "sub", profiles=profiles) for _ in range(4)))
+
+    profiles = load_profiles("sub")
+    expect = search_sequences(sequences, "sub", profiles=profiles)
+    assert all(r == expect for r in asyncio.run(run()))
+
+
+def test_search_async_cancel(sequences: list[tuple[str, str]]):
+    searched = []
+
+    def callback(query, total):
+        searched.append(query)
+        time.sleep(0.1)
+
+    async def run():
+        asyncio.get_running_loop().set_exception_handler(lambda loop, context: errors.append(context))
+        task = asyncio.ensure_future(search_async(sequences * 20, "cazyme", profiles=profiles, callback=callback))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        # Let the search abort in the worker thread
+        await asyncio.sleep(0.3)
+        gc.collect()
+
+    errors = []
+    with pyhmmer.plan7.HMMFile(DB_PATH["cazyme_hmms"]) as f:
+        profiles = Profiles(list(f) * 10)
+    asyncio.run(run())
+    assert len(searched) < 10
+    assert not errors
+
+
+def test_retrieve_exception():
+    async def run():
+        loop = asyncio.get_running_loop()
+        loop.set_exception_handler(lambda loop, context: errors.append(context))
+        future = loop.create_future()
+        future.add_done_callback(_retrieve_exception)
+        future.set_exception(RuntimeError())
+        await asyncio.sleep(0)
+        del future
+        gc.collect()
+
+    errors = []
+    asyncio.run(run())
+    assert not errors
+
+
+def test_diamond_search_async(sequences: list[tuple[str, str]]):
+    async def run():
+        return [hit async for hit in diamond_search_async(sequences)]
+
+    r = asyncio.run(run())
+    assert len(r) == 1 and isinstance(r[0], DiamondHit)
@@ -0,0 +1,74 @@
+from __future__ import annotations
+
+import multiprocessing
+import sqlite3
+from pathlib import Path
+
+import pyhmmer
+import pytest
+
+from dbcanlight._cache import ResultCache
+
+input = Path("tests/data/example.faa")
+
+
+@pytest.fixture(scope="module")
+def sequences() -> pyhmmer.easel.DigitalSequenceBlock:
+    with pyhmmer.easel.SequenceFile(input, digital=True) as f:
+        return f.read_block()
+
+
+def _put(path: Path, job: int) -> None:
+    with ResultCache(path) as cache:
+        for i in range(50):
+            cache.put({f"{job}_{i}".encode(): [["CBM46.hmm", 87, i * 1e-20, 1, 87, 1, 90, 0.99]]})
+
+
+def test_key(tmp_path: Path, sequences: pyhmmer.easel.DigitalSequenceBlock):
+    cache = ResultCache(tmp_path / "cache.sqlite")
+    renamed = sequences[0].copy()
+    renamed.name = b"renamed"
+    assert cache.key(sequences[0]) == cache.key(renamed)
+    assert cache.key(sequences[0]) != cache.key(sequences[1])
+    assert cache.scope(evalue=1e-15).key(sequences[0]) != cache.scope(evalue=1e-10).key(sequences[0])
+
+
+def test_get_put(tmp_path: Path):
+    hits = {b"a": [["CBM46.hmm", 87, 1e-20, 1, 87, 1, 90, 0.99]], b"b": []}
+    ResultCache(tmp_path / "cache.sqlite").put(hits)
+    assert ResultCache(tmp_path / "cache.sqlite").get([b"a", b"b", b"c"]) == hits
+
+
+def test_lru_eviction(tmp_path: Path):
+    cache = ResultCache(tmp_path / "cache.sqlite", max_size=800)
+    for i in range(5):
+        cache.put({str(i).encode(): [["x" * 150]]})
+    cache.get([b"0"])
+    cache.put({b"5": [["x" * 150]]})
+    assert cache.size() <= 800
+    assert set(cache.get([str(i).encode() for i in range(6)])) == {b"0", b"3", b"4", b"5"}
+
+
+def test_size(tmp_path: Path):
+    def stored(path: Path) -> int:
+        with sqlite3.connect(path) as conn:
+            return conn.execute("SELECT SUM(size) FROM results").fetchone()[0]
+
+    with ResultCache(tmp_path / "cache.sqlite", max_size=800) as cache:
+        cache.put({b"a": [["x" * 100]], b"b": []})
+        cache.put({b"a": [["x" * 10]]})
+        for i in range(5):
+            cache.put({str(i).encode(): [["x" * 150]]})
+        assert cache.size() == stored(tmp_path / "cache.sqlite") <= 800
+    # Seed the total of a cache made without it
+    with sqlite3.connect(tmp_path / "cache.sqlite") as conn:
+        conn.execute("DROP TABLE meta")
+    with ResultCache(tmp_path / "cache.sqlite") as cache:
+        assert cache.size() == stored(tmp_path / "cache.sqlite")
+
+
+def test_concurrent_access(tmp_path: Path):
+    with multiprocessing.get_context("spawn").Pool(4) as pool:
+        pool.starmap(_put, [(tmp_path / "cache.sqlite", job) for job in range(4)])
+    cache = ResultCache(tmp_path / "cache.sqlite")
+    assert len(cache.get([f"{job}_{i}".encode() for job in range(4) for i in range(50)])) == 200
@@ -7,6 +7,8 @@ from pathlib import Path
 import pytest
 
 import dbcanlight
+import dbcanlight._utils
+import dbcanlight.libhmm
 
 
 class PackMetadata:
@@ -39,6 +41,23 @@ def hide_metadata(persistent_tmp_path: Path):
     obj.unpack_metadata()
 
 
+@pytest.fixture(scope="session", autouse=True)
+def press_cache(persistent_tmp_path: Path):
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr(dbcanlight.libhmm, "PRESS_CACHE", persistent_tmp_path / "pressed")
+        yield
+
+
+@pytest.fixture(scope="session", autouse=True)
+def http_cache(persistent_tmp_path: Path):
+    # Keep the http cache out of the database folder under the repository
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr(dbcanlight._utils, "CFG_DIR", persistent_tmp_path)
+        dbcanlight._utils.http_cache.cache_clear()
+        yield
+    dbcanlight._utils.http_cache.cache_clear()
+
+
 @pytest.fixture(scope="class")
 def class_shared_tmpdir(tmp_path_factory: pytest.TempPathFactory):
     return tmp_path_factory.mktemp("shared_tmpdir")
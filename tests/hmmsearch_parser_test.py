@@ -1,13 +1,14 @@
 from __future__ import annotations
 
 from itertools import product
+from pathlib import Path
 from typing import Generator
 
 import pytest
 
 import dbcanlight.hmmsearch_parser as hmmsearch_parser
 from dbcanlight import VERSION
-from dbcanlight.hmmsearch_parser import HmmsearchParser, main, overlap_filter
+from dbcanlight.hmmsearch_parser import HmmsearchParser, main, overlap_filter, parallel_eval_cov_filter
 
 
 class TestHmmsearchParser:
@@ -38,6 +39,36 @@ class TestHmmsearchParser:
             HmmsearchParser("tests/data/bedpe.tsv")
 
 
+@pytest.mark.parametrize("input", ("tests/data/hmmsearch_output", "tests/data/cazymes.tsv"))
+@pytest.mark.parametrize("chunk_size", (1, 1000))
+def test_parallel_eval_cov_filter(input: str, chunk_size: int):
+    expect = list(overlap_filter(HmmsearchParser(input).eval_cov_filter(evalue=1e-15, coverage=0.35)))
+    results = parallel_eval_cov_filter(input, evalue=1e-15, coverage=0.35, threads=2, chunk_size=chunk_size)
+    assert list(overlap_filter(results)) == expect
+
+
+def test_chunk_bounds():
+    bounds = hmmsearch_parser._chunk_bounds("tests/data/hmmsearch_output", False, size=1000)
+    with open("tests/data/hmmsearch_output", "rb") as f:
+        data = f.read()
+    for begin, end in zip(bounds[1:-1], bounds[2:]):
+        # Each chunk starts at a line of a target different from the last line of the previous chunk
+        prev, line = data[:begin].splitlines()[-1].split(), data[begin:end].splitlines()[0].split()
+        assert (prev[0], prev[3]) != (line[0], line[3])
+
+
+def test_run_multiple_inputs(tmp_path: Path):
+    for idx in range(2):
+        (tmp_path / f"hmmsearch_output{idx}").write_bytes(Path("tests/data/hmmsearch_output").read_bytes())
+    hmmsearch_parser._run("tests/data/hmmsearch_output", tmp_path / "single.tsv")
+    hmmsearch_parser._run([str(tmp_path / "hmmsearch_output*")], tmp_path / "multiple.tsv", threads=2)
+    single = (tmp_path / "single.tsv").read_text().splitlines()
+    # The duplicated hits of the same gene are filtered together
+    assert (tmp_path / "multiple.tsv").read_text().splitlines() == single
+    with pytest.raises(FileNotFoundError):
+        hmmsearch_parser._run([str(tmp_path / "missing*")], tmp_path / "missing.tsv")
+
+
 def test_overlap_filter():
     input = [
         {
@@ -89,5 +120,5 @@ def test_main(input: str, output: str, monkeypatch: Generator, capsys: pytest.Ca
     assert main(["-i", input, "-o", output]) == 0
     captured: str = capsys.readouterr().out
     captured = captured.split("\n")
-    assert f"input: {input}" in captured
+    assert f"input: {[input]}" in captured
     assert f"output: {output}" in captured
@@ -0,0 +1,74 @@
+from __future__ import annotations
+
+import os
+import shutil
+from pathlib import Path
+
+import pyhmmer
+import pytest
+
+from dbcanlight._index import FastaIndex
+
+input = Path("tests/data/example.faa")
+
+
+@pytest.fixture
+def fasta(tmp_path: Path) -> Path:
+    return Path(shutil.copy(input, tmp_path / "example.faa"))
+
+
+def test_build(fasta: Path):
+    index = FastaIndex.build(fasta)
+    with pyhmmer.easel.SequenceFile(fasta) as f:
+        sequences = list(f)
+    assert index.names == [seq.name.decode() for seq in sequences]
+    assert list(index.residues) == [len(seq.sequence) for seq in sequences]
+    assert sum(index.lengths) == fasta.stat().st_size
+
+    index.save()
+    loaded = FastaIndex.load(fasta)
+    assert loaded.names == index.names and loaded.offsets == index.offsets and loaded.residues == index.residues
+
+
+def test_load_outdated(fasta: Path):
+    FastaIndex.build(fasta).save()
+    assert FastaIndex.load(fasta) is not None
+    os.utime(fasta, ns=(0, 0))
+    assert FastaIndex.load(fasta) is None
+
+
+@pytest.mark.parametrize("size", (4, 40, 100, -1))
+def test_load_truncated(fasta: Path, size: int):
+    index = FastaIndex.build(fasta)
+    index.save()
+    data = index.path.read_bytes()
+    # Keep the size and mtime of the fasta in the header valid when truncated past it
+    index.path.write_bytes(data[:size])
+    assert FastaIndex.load(fasta) is None
+    rebuilt = FastaIndex.open_or_build(fasta)
+    assert rebuilt.names == index.names and rebuilt.offsets == index.offsets
+    assert FastaIndex.load(fasta) is not None
+
+
+def test_open_or_build_unwritable(fasta: Path, monkeypatch: pytest.MonkeyPatch):
+    # Stand in for a read-only folder, which root can write anyway
+    monkeypatch.setattr("dbcanlight._index._index_path", lambda fasta: Path(fasta).parent / "missing" / "example.faa.dbi")
+    index = FastaIndex.open_or_build(fasta)
+    assert len(index) == len(FastaIndex.build(fasta)) and not index.path.exists()
+
+
+def test_shard(fasta: Path):
+    index = FastaIndex.build(fasta)
+    for shards in range(1, 7):
+        ranges = [index.shard(k, shards) for k in range(shards)]
+        assert ranges[0][0] == 0 and ranges[-1][1] == len(index)
+        assert all(ranges[k][1] == ranges[k + 1][0] for k in range(shards - 1))
+    assert index.shard(0, 2, start=1)[0] == 1
+
+
+def test_open(fasta: Path):
+    index = FastaIndex.build(fasta)
+    with index.open(1, 3) as f, pyhmmer.easel.SequenceFile(f, format="fasta") as seq_file:
+        assert [seq.name.decode() for seq in seq_file] == index.names[1:3]
+    with index.open(2, 2) as f:
+        assert f.read() == b""
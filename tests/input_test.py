@@ -0,0 +1,68 @@
+from __future__ import annotations
+
+import gzip
+import struct
+import sys
+import zlib
+from pathlib import Path
+
+import pytest
+
+from dbcanlight import DB_PATH
+from dbcanlight._input import detect_format, open_input
+from dbcanlight.libhmm import cazyme_search
+
+input = Path("tests/data/example.faa")
+
+
+def _write_bgzf(path: Path, data: bytes, blocksize: int = 100) -> None:
+    with open(path, "wb") as f:
+        for start in range(0, len(data) + 1, blocksize):
+            chunk = data[start : start + blocksize]
+            compressor = zlib.compressobj(wbits=-15)
+            deflated = compressor.compress(chunk) + compressor.flush()
+            header = b"\x1f\x8b\x08\x04" + bytes(6) + struct.pack("<HBBHH", 6, 66, 67, 2, len(deflated) + 25)
+            f.write(header + deflated + struct.pack("<II", zlib.crc32(chunk), len(chunk)))
+
+
+def test_open_input(tmp_path: Path):
+    data = input.read_bytes()
+    with open(tmp_path / "multi.faa.gz", "wb") as f:
+        f.write(gzip.compress(data[:100]) + gzip.compress(data[100:]))
+    _write_bgzf(tmp_path / "example.faa.bgz", data)
+
+    assert detect_format(input) == "plain"
+    assert detect_format(tmp_path / "multi.faa.gz") == "gzip"
+    assert detect_format(tmp_path / "example.faa.bgz") == "bgzf"
+    for file in (input, tmp_path / "multi.faa.gz"):
+        with open_input(file) as f:
+            assert f.read() == data
+    with open_input(tmp_path / "example.faa.bgz", threads=3) as f:
+        assert f.read() == data
+
+
+def test_open_input_truncated(tmp_path: Path):
+    (tmp_path / "example.faa.gz").write_bytes(gzip.compress(input.read_bytes())[:-10])
+    with pytest.raises(EOFError), open_input(tmp_path / "example.faa.gz") as f:
+        f.read()
+
+
+def test_open_input_zstd(tmp_path: Path):
+    zstandard = pytest.importorskip("zstandard")
+    (tmp_path / "example.faa.zst").write_bytes(zstandard.ZstdCompressor().compress(input.read_bytes()))
+    assert detect_format(tmp_path / "example.faa.zst") == "zstd"
+    with open_input(tmp_path / "example.faa.zst") as f:
+        assert f.read() == input.read_bytes()
+
+
+def test_open_input_zstd_missing(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setitem(sys.modules, "zstandard", None)
+    (tmp_path / "example.faa.zst").write_bytes(b"\x28\xb5\x2f\xfd" + bytes(8))
+    with pytest.raises(ImportError, match=r"pip install 'dbcanlight\[zstd\]'"):
+        open_input(tmp_path / "example.faa.zst")
+
+
+def test_search_compressed(tmp_path: Path):
+    _write_bgzf(tmp_path / "example.faa.bgz", input.read_bytes())
+    expect = list(cazyme_search(input, DB_PATH["cazyme_hmms"]))
+    assert list(cazyme_search(tmp_path / "example.faa.bgz", DB_PATH["cazyme_hmms"], threads=2)) == expect
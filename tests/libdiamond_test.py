@@ -1,9 +1,11 @@
 from __future__ import annotations
 
+import io
 from pathlib import Path
 
+import dbcanlight.libdiamond as libdiamond
 from dbcanlight._header import Headers
-from dbcanlight.libdiamond import diamond_build, diamond_search
+from dbcanlight.libdiamond import _blastp, _blastp_cmd, diamond_build, diamond_search, sseqid_families
 
 
 def test_diamond_build():
@@ -14,3 +16,32 @@ def test_diamond_search():
     r = list(diamond_search(Path("tests/data/example.faa")))
     assert len(r) == 1
     assert len(r[0]) == len(Headers.diamond)
+
+
+def test_dedup_blastp(tmp_path: Path, monkeypatch):
+    input = tmp_path / "duplicated.faa"
+    input.write_text(">a\nMKV\n>b\nMKL\n>c\nmkv\n>d\nMKV\n")
+
+    def mock_blastp(cmd):
+        query = Path(cmd[cmd.index("--query") + 1]).read_text()
+        assert query == ">q0\nMKV\n>q1\nMKL\n"
+        yield ["q0", "subject", "100.0", "3", "0", "0", "1", "3", "1", "3", "1e-200", "10.0"]
+
+    monkeypatch.setattr(libdiamond, "_blastp", mock_blastp)
+    r = list(libdiamond._dedup_blastp(input, evalue=1e-102, coverage=0.35, threads=1))
+    assert [line[0] for line in r] == ["a", "c", "d"]
+
+
+def test_blastp(tmp_path: Path):
+    line = b"gene1\tBAA00407.1|GT35|2.4.1.1\t100\t966\t0\t0\t1\t966\t1\t966\t0.0\t1931\t966\t966\t100\t100\n"
+    r = list(_blastp(["cat"], stdin=io.BufferedReader(io.BytesIO(line * 3))))
+    assert len(r) == 3 and len(r[0]) == len(Headers.diamond)
+    assert r[0][:4] == ["gene1", "BAA00407.1|GT35|2.4.1.1", 100.0, 966] and r[0][-2:] == [100.0, 100.0]
+    assert sseqid_families(r[0][1]) == ["GT35", "2.4.1.1"]
+
+
+def test_blastp_cmd():
+    cmd = _blastp_cmd("query.faa", evalue=1e-102, coverage=0.35, threads=1, max_target_seqs=5)
+    assert cmd[cmd.index("--max-target-seqs") + 1] == "5" and cmd[-len(Headers.diamond) :] == list(Headers.diamond)
+    cmd = _blastp_cmd(None, evalue=1e-102, coverage=0.35, threads=1, top=10)
+    assert "--top" in cmd and "--max-target-seqs" not in cmd and "--query" not in cmd
@@ -1,10 +1,28 @@
 from __future__ import annotations
 
+import gzip
 from pathlib import Path
 
+import pyhmmer
+import pytest
+
+import dbcanlight.libhmm as libhmm
 from dbcanlight import DB_PATH
+from dbcanlight._cache import ResultCache
 from dbcanlight._header import Headers
-from dbcanlight.libhmm import cazyme_search, subs_search
+from dbcanlight._utils import HttpCache, file_md5, writer
+from dbcanlight.libhmm import (
+    AdaptiveBlocksize,
+    _choose_strategy,
+    _hmmsearch,
+    _sequence_blocks,
+    cazyme_search,
+    count_sequences,
+    gated_subs_search,
+    profile_checksums,
+    subs_search,
+    update_search,
+)
 
 input = Path("tests/data/example.faa")
 
@@ -19,3 +37,235 @@ def test_subs_search():
     r = list(subs_search(input, DB_PATH["subs_hmms"]))
     assert len(r) == 2
     assert len(r[0]) == len(Headers.sub)
+
+
+def test_cazyme_search_cached(tmp_path: Path, monkeypatch):
+    cache = ResultCache(tmp_path / "cache.sqlite")
+    expect = list(cazyme_search(input, DB_PATH["cazyme_hmms"], blocksize=2))
+    assert list(cazyme_search(input, DB_PATH["cazyme_hmms"], blocksize=2, cache=cache)) == expect
+
+    # Reuse the cached hits with a different blocksize, which changes the evalues
+    expect = list(cazyme_search(input, DB_PATH["cazyme_hmms"]))
+    monkeypatch.setattr(libhmm, "_hmmsearch", lambda *args, **kwargs: pytest.fail("Cached sequences searched again."))
+    assert list(cazyme_search(input, DB_PATH["cazyme_hmms"], cache=cache)) == expect
+
+
+def test_cazyme_search_dedup(tmp_path: Path, monkeypatch):
+    duplicated = tmp_path / "duplicated.faa"
+    with pyhmmer.easel.SequenceFile(input) as f, open(duplicated, "w") as out:
+        for seq in f:
+            for i in range(3):
+                out.write(f">{seq.name.decode()}_{i}\n{seq.sequence}\n")
+    expect = list(cazyme_search(duplicated, DB_PATH["cazyme_hmms"], blocksize=5))
+
+    searched = []
+    _hmmsearch = libhmm._hmmsearch
+
+    def mock_hmmsearch(sequences, *args, **kwargs):
+        searched.extend(seq.name.decode() for seq in sequences)
+        return _hmmsearch(sequences, *args, **kwargs)
+
+    monkeypatch.setattr(libhmm, "_hmmsearch", mock_hmmsearch)
+    assert list(cazyme_search(duplicated, DB_PATH["cazyme_hmms"], blocksize=5, dedup=True)) == expect
+    assert len(searched) == 4
+    assert len(expect) == 3
+
+
+@pytest.mark.parametrize("blocksize", (0, 2))
+def test_search_strategy(blocksize: int):
+    hmms = [hmm for file in (DB_PATH["subs_hmms"], DB_PATH["cazyme_hmms"]) for hmm in pyhmmer.plan7.HMMFile(file)]
+    expect = list(cazyme_search(input, hmms, blocksize=blocksize, strategy="search"))
+    assert list(cazyme_search(input, hmms, blocksize=blocksize, strategy="scan")) == expect
+    assert list(cazyme_search(input, hmms, blocksize=blocksize, strategy="auto", threads=4)) == expect
+
+
+def test_choose_strategy():
+    hmms = list(pyhmmer.plan7.HMMFile(DB_PATH["cazyme_hmms"]))
+    with pyhmmer.easel.SequenceFile(input, digital=True) as f:
+        sequences = f.read_block()
+
+    assert _choose_strategy(sequences, hmms, threads=1) == "search"
+    # One profile keeps one of the threads busy in hmmsearch while hmmscan keeps all of them busy
+    assert _choose_strategy(sequences, hmms, threads=4) == "scan"
+    # As many sequences as profiles keep as many threads busy, which does not make up for the extra cost of hmmscan
+    assert _choose_strategy(sequences[:2], hmms * 2, threads=4) == "search"
+
+
+def test_search_scan_callback():
+    def callback(query, total):
+        raise InterruptedError
+
+    with pyhmmer.easel.SequenceFile(input, digital=True) as f:
+        sequences = f.read_block()
+    # The callback aborts the scan as well
+    with pytest.raises(InterruptedError):
+        _hmmsearch(sequences, list(pyhmmer.plan7.HMMFile(DB_PATH["cazyme_hmms"])), callback=callback, strategy="scan")
+
+
+@pytest.mark.parametrize("evalue", (1e-15, 1e-3, 100))
+def test_hmmsearch_thresholds(evalue: float):
+    hmms = list(pyhmmer.plan7.HMMFile(DB_PATH["subs_hmms"]))
+    with pyhmmer.easel.SequenceFile(input, digital=True) as f:
+        sequences = f.read_block()
+    expect = {}
+    for hits in pyhmmer.hmmsearch(hmms, sequences, E=1000):
+        for hit in hits:
+            for domain in hit.domains:
+                cov = (domain.alignment.hmm_to - domain.alignment.hmm_from) / hits.query.M
+                if domain.i_evalue <= evalue and cov >= 0.35:
+                    expect.setdefault(hit.name.decode(), []).append((domain.i_evalue, domain.alignment.target_from))
+    results = _hmmsearch(sequences, hmms, evalue=evalue)
+    assert {gene: [(hit[4], hit[7]) for hit in hits] for gene, hits in results.items()} == expect
+
+
+@pytest.mark.parametrize("coverage", (0.35, 0.9))
+def test_search_pruned(monkeypatch, coverage: float):
+    fragments = []
+    with pyhmmer.easel.SequenceFile(input) as f:
+        for seq in f:
+            fragments.extend((f"{seq.name.decode()}_{i}", seq.sequence[i : i + 60]) for i in range(0, len(seq.sequence), 30))
+    hmms = [hmm for file in (DB_PATH["subs_hmms"], DB_PATH["cazyme_hmms"]) for hmm in pyhmmer.plan7.HMMFile(file)]
+    sequences = pyhmmer.easel.DigitalSequenceBlock(
+        pyhmmer.easel.Alphabet.amino(),
+        (pyhmmer.easel.TextSequence(name=name.encode(), sequence=seq).digitize(hmms[0].alphabet) for name, seq in fragments),
+    )
+    pairs = {
+        (seq.name, hmm.name)
+        for group, profiles in libhmm._plan_search(sequences, hmms, coverage=coverage)
+        for seq in group
+        for hmm in profiles
+    }
+    pruned = [(seq, hmm) for seq in sequences for hmm in hmms if (seq.name, hmm.name) not in pairs]
+    assert all(len(seq) * libhmm._PRUNE_SLACK < coverage * hmm.M for seq, hmm in pruned)
+    assert pruned or coverage < 0.5
+
+    # The pruning is approximate but misses none of the hits of these fragments
+    expect = list(cazyme_search(fragments, hmms, coverage=coverage, blocksize=0))
+    assert list(cazyme_search(fragments, hmms, coverage=coverage, blocksize=0, prune=True)) == expect
+
+    # Not pruned unless asked
+    monkeypatch.setattr(libhmm, "_plan_search", None)
+    assert list(cazyme_search(fragments, hmms, coverage=coverage, blocksize=0)) == expect
+
+
+def test_gated_subs_search():
+    expect = list(subs_search(input, DB_PATH["subs_hmms"]))
+    families = {line[2]: {line[0].split("_")[0].rstrip(".hmm")} for line in cazyme_search(input, DB_PATH["cazyme_hmms"])}
+    missed = []
+    assert list(gated_subs_search(input, DB_PATH["subs_hmms"], families, missed=missed)) == expect
+    assert missed == []
+
+    assert list(gated_subs_search(input, DB_PATH["subs_hmms"], {}, missed=missed)) == []
+    assert missed == expect
+
+
+def test_count_sequences(tmp_path: Path):
+    with gzip.open(tmp_path / "example.faa.gz", "wb") as f:
+        f.write(input.read_bytes())
+    assert count_sequences(input) == count_sequences(tmp_path / "example.faa.gz") == input.read_text().count(">")
+
+
+def test_search_fixed_Z():
+    expect = list(subs_search(input, DB_PATH["subs_hmms"], blocksize=0, Z=1000))
+    assert list(subs_search(input, DB_PATH["subs_hmms"], blocksize=1, Z=1000)) == expect
+    assert list(subs_search(input, DB_PATH["subs_hmms"], blocksize=1, Z=1000, dedup=True)) == expect
+    assert expect and expect != list(subs_search(input, DB_PATH["subs_hmms"], blocksize=0))
+
+
+@pytest.mark.parametrize("previous, current", (((0,), (0, 1)), ((0, 1), (0,)), ((0, 1), (1,))))
+def test_update_search(tmp_path: Path, previous: tuple[int], current: tuple[int]):
+    profiles = []
+    for db in ("cazyme_hmms", "subs_hmms"):
+        with pyhmmer.plan7.HMMFile(DB_PATH[db]) as f:
+            profiles.extend(f)
+    hmm_files = {}
+    for release, idx in (("previous", previous), ("current", current)):
+        hmm_files[release] = tmp_path / f"{release}.hmm"
+        with open(hmm_files[release], "wb") as f:
+            for i in idx:
+                profiles[i].write(f)
+
+    writer(cazyme_search(input, hmm_files["previous"], blocksize=2), tmp_path / "previous.tsv", header=Headers.cazyme)
+    writer(cazyme_search(input, hmm_files["current"], blocksize=2), tmp_path / "expect.tsv", header=Headers.cazyme)
+    updated = update_search(
+        input,
+        hmm_files["current"],
+        tmp_path / "previous.tsv",
+        checksums=profile_checksums(hmm_files["previous"]),
+        blocksize=2,
+    )
+    writer(updated, tmp_path / "updated.tsv", header=Headers.cazyme)
+    assert (tmp_path / "updated.tsv").read_text() == (tmp_path / "expect.tsv").read_text()
+
+
+def test_adaptive_blocksize(monkeypatch):
+    # Doubled while fast, halved under the memory pressure and capped by the memory per sequence of the largest block
+    rss = iter((100, 200, 300, 950, 950))
+    monkeypatch.setattr(libhmm, "current_rss", lambda: next(rss))
+    blocksize = libhmm.AdaptiveBlocksize(mem_limit=1000, initial=2, minimum=1)
+    assert [blocksize.next_size() for _ in range(5)] == [2, 4, 8, 4, 6]
+    monkeypatch.setattr(libhmm, "current_rss", lambda: 100)
+    blocksize = libhmm.AdaptiveBlocksize(mem_limit=1000, initial=2, minimum=1, target_seconds=0)
+    assert [blocksize.next_size() for _ in range(3)] == [2, 2, 2]
+
+
+@pytest.mark.parametrize("kind", ("file", "block", "pairs"))
+def test_search_adaptive_blocksize(kind: str):
+    with pyhmmer.easel.SequenceFile(input, digital=True) as f:
+        block = f.read_block()
+    sequences = {
+        "file": input,
+        "block": block,
+        "pairs": [(seq.name.decode(), seq.alphabet.decode(seq.sequence)) for seq in block],
+    }[kind]
+    blocksize = AdaptiveBlocksize(mem_limit=2**50, initial=1, minimum=1)
+    assert [len(seq_block) for seq_block in _sequence_blocks(sequences, blocksize)] == [1, 2, 1]
+    expect = list(subs_search(input, DB_PATH["subs_hmms"], blocksize=0, Z=1000))
+    blocksize = AdaptiveBlocksize(initial=1, minimum=1)
+    assert list(subs_search(sequences, DB_PATH["subs_hmms"], blocksize=blocksize, Z=1000)) == expect
+
+
+def test_profile_checksums(tmp_path: Path, monkeypatch):
+    hmm_file = tmp_path / "cazyme.hmm"
+    hmm_file.write_bytes(DB_PATH["cazyme_hmms"].read_bytes())
+    expect = libhmm.profile_checksums(hmm_file)
+    assert not libhmm._manifest_path(hmm_file).exists()
+    libhmm.write_profile_checksums(hmm_file)
+    # Read from the manifest unless the hmm file is modified
+    compute = libhmm._compute_profile_checksums
+    monkeypatch.setattr(libhmm, "_compute_profile_checksums", lambda *args: pytest.fail("Computed again."))
+    assert libhmm.profile_checksums(hmm_file) == expect
+    monkeypatch.setattr(libhmm, "_compute_profile_checksums", compute)
+    with open(hmm_file, "a") as f:
+        f.write("\n")
+    assert libhmm.profile_checksums(hmm_file) == expect
+
+
+def test_load_hmms_pressed(tmp_path: Path, monkeypatch):
+    monkeypatch.setattr(libhmm, "PRESS_CACHE", tmp_path / "pressed")
+    # The checksums are kept with the pressed files instead of the http cache of the build module
+    monkeypatch.setattr(HttpCache, "save", lambda self: pytest.fail("Wrote the http cache."))
+    hmm_file = tmp_path / "cazyme.hmm"
+    hmm_file.write_bytes(DB_PATH["cazyme_hmms"].read_bytes())
+    with pyhmmer.plan7.HMMFile(hmm_file) as f:
+        expect = list(cazyme_search(input, list(f)))
+
+    # Pressed into the cache once
+    hmms = libhmm._load_hmms(hmm_file)
+    assert all(isinstance(hmm, pyhmmer.plan7.OptimizedProfile) for hmm in hmms)
+    assert list(cazyme_search(input, hmm_file)) == expect
+    press_hmms = libhmm.press_hmms
+    monkeypatch.setattr(libhmm, "press_hmms", lambda *args, **kwargs: pytest.fail("Pressed again."))
+    assert libhmm._pressed_prefix(hmm_file).parent.parent == tmp_path / "pressed"
+    monkeypatch.setattr(libhmm, "press_hmms", press_hmms)
+
+    # The pressed files next to the hmm file are used unless the hmm file is changed, without hashing it again
+    libhmm.press_hmms(hmm_file)
+    libhmm._file_md5.cache_clear()
+    monkeypatch.setattr(libhmm, "file_md5", lambda *args: pytest.fail("Hashed again."))
+    assert libhmm._pressed_prefix(hmm_file) == hmm_file
+    monkeypatch.setattr(libhmm, "file_md5", file_md5)
+    with open(hmm_file, "a") as f:
+        f.write("\n")
+    assert libhmm._pressed_prefix(hmm_file).parent.parent == tmp_path / "pressed"
+    assert list(cazyme_search(input, hmm_file)) == expect
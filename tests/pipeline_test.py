@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 import hashlib
+import json
 import shutil
 from pathlib import Path
 from typing import Generator
@@ -10,7 +11,7 @@ import pytest
 import dbcanlight
 import dbcanlight.pipeline as pipeline
 from dbcanlight._header import Headers
-from dbcanlight.pipeline import build, conclude, search
+from dbcanlight.pipeline import build, conclude, index, query, search
 
 
 def get_file_checksum(file: str | Path) -> str:
@@ -30,7 +31,7 @@ def base_db_urls():
 
 @pytest.fixture
 def patch_build(monkeypatch: Generator):
-    def mock_download(url: str, filepath: Path, *, threads):
+    def mock_download(url: str, filepath: Path, *, md5, threads):
         print(f"Download database from mock/{url} to {filepath}")
 
     for dbname in dbcanlight.DB_PATH:
@@ -39,7 +40,7 @@ def patch_build(monkeypatch: Generator):
 
 class TestBuild:
     def test_build_already_exist(self, monkeypatch: Generator, capsys: pytest.CaptureFixture, patch_build, base_db_urls):
-        def mock_fetch_database_metadata():
+        def mock_fetch_database_metadata(**kwargs):
             db_urls = {}
             for dbname, file in base_db_urls.items():
                 db_urls[dbname] = [file, get_file_checksum(file)]
@@ -53,7 +54,7 @@ class TestBuild:
             assert f"{dbname} ok" in captured
 
     def test_build_need_update(self, monkeypatch: Generator, capsys: pytest.CaptureFixture, patch_build, base_db_urls):
-        def mock_fetch_database_metadata():
+        def mock_fetch_database_metadata(**kwargs):
             db_urls = {}
             for dbname, file in base_db_urls.items():
                 if dbname == "subs_hmms":
@@ -76,7 +77,7 @@ class TestBuild:
     def test_build_not_found(
         self, tmp_path: Path, monkeypatch: Generator, capsys: pytest.CaptureFixture, patch_build, base_db_urls
     ):
-        def mock_fetch_database_metadata():
+        def mock_fetch_database_metadata(**kwargs):
             db_urls = {}
             for dbname, file in base_db_urls.items():
                 if dbname == "cazyme_hmms":
@@ -128,6 +129,150 @@ class TestSearch:
         with pytest.raises(ValueError, match=r"blocksize=.+ which is smaller than 0."):
             search(self.input, tmp_path, mode=mode, blocksize=-1)
 
+    @pytest.mark.parametrize("mode", ("cazyme", "sub"))
+    def test_search_input_list(self, tmp_path: Path, mode: str):
+        sequences = self.input.read_text().split(">")[1:]
+        (tmp_path / "inputs").mkdir()
+        for i in range(3):
+            (tmp_path / "inputs" / f"genome{i}.faa").write_text("".join(f">{seq}" for seq in sequences[i:]))
+        search(None, tmp_path / "batch", mode=mode, blocksize=2, input_list=tmp_path / "inputs")
+
+        output = dbcanlight.AVAIL_MODES[mode]
+        for i in range(3):
+            search(tmp_path / "inputs" / f"genome{i}.faa", tmp_path / "single", mode=mode, blocksize=2)
+            assert (tmp_path / "batch" / f"genome{i}" / output).read_text() == (tmp_path / "single" / output).read_text()
+
+    def test_read_input_list(self, tmp_path: Path):
+        tmp_path = tmp_path.resolve()
+        manifest = tmp_path / "manifest.tsv"
+        manifest.write_text(f"# genomes\na.faa\tout_a\n{tmp_path}/genomes/../b.fasta.gz\n\n")
+        # The relative paths are relative to the manifest instead of the working directory
+        assert pipeline._read_input_list(manifest, "output") == [
+            (tmp_path / "a.faa", tmp_path / "out_a"),
+            (tmp_path / "b.fasta.gz", Path("output/b").resolve()),
+        ]
+        manifest.write_text("a.faa\nother/a.faa\n")
+        with pytest.raises(ValueError, match=r"Multiple inputs in .+ are output to the same folder."):
+            pipeline._read_input_list(manifest, "output")
+
+    @pytest.mark.parametrize("mode", ("cazyme", "sub"))
+    def test_search_update_from(self, tmp_path: Path, mode: str):
+        search(self.input, tmp_path / "previous", mode=mode, record_profiles=True)
+        search(self.input, tmp_path / "updated", mode=mode, update_from=tmp_path / "previous")
+        output = dbcanlight.AVAIL_MODES[mode]
+        # Recorded only when asked and nothing is written next to the database
+        assert not (tmp_path / "updated" / output).with_suffix(".profiles.json").exists()
+        assert not list(dbcanlight.DB_PATH["cazyme_hmms"].parent.glob("*.profiles.json"))
+        assert (tmp_path / "updated" / output).read_text() == (tmp_path / "previous" / output).read_text()
+
+        (tmp_path / "previous" / output).with_suffix(".profiles.json").unlink()
+        with pytest.raises(FileNotFoundError, match=r".+ not found. Only the results made by dbcanlight"):
+            search(self.input, tmp_path / "updated", mode=mode, update_from=tmp_path / "previous")
+
+    def test_search_gate(self, tmp_path: Path):
+        search(self.input, tmp_path / "exhaustive", mode="sub")
+        search(self.input, tmp_path / "gated", mode="sub", gate=True, verify_gate=True, record_profiles=True)
+        assert (tmp_path / "gated" / "cazymes.tsv").is_file()
+        assert (tmp_path / "gated" / "substrates.tsv").read_text() == (tmp_path / "exhaustive" / "substrates.tsv").read_text()
+        assert (tmp_path / "gated" / "substrates.missed.tsv").read_text() == "\t".join(Headers.sub) + "\n"
+
+        with pytest.raises(ValueError, match=r".+ was made by the gated substrate search and cannot be updated."):
+            search(self.input, tmp_path / "updated", mode="sub", update_from=tmp_path / "gated")
+        with pytest.raises(ValueError, match=r'Parameter "gate" is only applicable on sub mode'):
+            search(self.input, tmp_path / "gated", mode="cazyme", gate=True)
+
+    @pytest.mark.parametrize("mode", ("cazyme", "sub"))
+    def test_search_shard(self, tmp_path: Path, mode: str):
+        input = shutil.copy(self.input, tmp_path / "example.faa")
+        search(input, tmp_path / "whole", mode=mode)
+        lines = []
+        for k in range(1, 4):
+            search(input, tmp_path / str(k), mode=mode, shard=f"{k}/3")
+            lines.extend((tmp_path / str(k) / dbcanlight.AVAIL_MODES[mode]).read_text().splitlines()[1:])
+        assert sorted(lines) == sorted((tmp_path / "whole" / dbcanlight.AVAIL_MODES[mode]).read_text().splitlines()[1:])
+        assert (tmp_path / "example.faa.dbi").is_file()
+
+        search(input, tmp_path / "start", mode=mode, start="3", record_profiles=True)
+        with pytest.raises(ValueError, match=r".+ was made by searching a part of the input and cannot be updated."):
+            search(input, tmp_path / "updated", mode=mode, update_from=tmp_path / "start")
+        with pytest.raises(ValueError, match=r'shard=0/3 which is not in the form of "k/n"'):
+            search(input, tmp_path, mode=mode, shard="0/3")
+
+    def test_search_db(self, tmp_path: Path):
+        for mode in ("cazyme", "sub"):
+            search(self.input, tmp_path / "sample1", mode=mode, db=tmp_path / "results.sqlite")
+        conclude(tmp_path / "sample1", db=tmp_path / "results.sqlite")
+        assert query(tmp_path / "results.sqlite", family=["CBM46"], ec=["3.2.1.4"], output=tmp_path / "query.tsv") == 1
+        assert (tmp_path / "query.tsv").read_text().splitlines()[1].startswith("sample1\t")
+        assert query(tmp_path / "results.sqlite", mode="sub", family=["CBM46_e1"]) == 2
+
+    def test_search_evalue_string(self, tmp_path: Path):
+        # The command line passes the evalue as a string
+        search(self.input, tmp_path / "string", mode="cazyme", evalue="1e-15")
+        search(self.input, tmp_path / "default", mode="cazyme")
+        assert (tmp_path / "string" / "cazymes.tsv").read_text() == (tmp_path / "default" / "cazymes.tsv").read_text()
+
+    def test_search_count(self, tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+        search(self.input, tmp_path / "blocks", mode="sub", blocksize=2)
+        shutil.copy(self.input, tmp_path / "example.faa")
+        index(tmp_path / "example.faa")
+        # The input is counted ahead only if it is searched in blocks and not indexed
+        monkeypatch.setattr(pipeline, "count_sequences", lambda *args, **kwargs: pytest.fail("The input was counted."))
+        search(self.input, tmp_path / "whole", mode="sub", blocksize=0)
+        search(tmp_path / "example.faa", tmp_path / "indexed", mode="sub", blocksize=2)
+        expected = (tmp_path / "blocks" / "substrates.tsv").read_text()
+        assert (tmp_path / "whole" / "substrates.tsv").read_text() == expected
+        assert (tmp_path / "indexed" / "substrates.tsv").read_text() == expected
+
+    def test_search_sorted_output(self, tmp_path: Path):
+        search(self.input, tmp_path, mode="sub", blocksize=2, sorted_output=True)
+        lines = (tmp_path / "substrates.tsv").read_text().splitlines()[1:]
+        genes = [line.split("\t")[5] for line in lines]
+        assert genes == sorted(genes)
+        search(self.input, tmp_path / "unsorted", mode="sub", blocksize=2)
+        assert sorted(lines) == sorted((tmp_path / "unsorted" / "substrates.tsv").read_text().splitlines()[1:])
+
+    def test_search_auto_blocksize(self, tmp_path: Path):
+        search(self.input, tmp_path, mode="sub", blocksize="auto:64G", record_profiles=True)
+        search(self.input, tmp_path / "fixed", mode="sub", blocksize=0)
+        assert (tmp_path / "substrates.tsv").read_text() == (tmp_path / "fixed" / "substrates.tsv").read_text()
+        assert json.loads((tmp_path / "substrates.profiles.json").read_text())["blocksize"] == "auto"
+        with pytest.raises(ValueError, match=r'blocksize=adaptive which is neither an integer nor "auto\[:<memory limit>\]".'):
+            search(self.input, tmp_path, mode="sub", blocksize="adaptive")
+
+    @pytest.mark.parametrize("mode", ("cazyme", "sub"))
+    def test_search_metrics(self, tmp_path: Path, mode: str):
+        search(self.input, tmp_path, mode=mode, blocksize=2, metrics=tmp_path / "metrics.json")
+        metrics = json.loads((tmp_path / "metrics.json").read_text())
+        assert metrics["command"] == "search" and metrics["mode"] == mode
+        assert metrics["counters"]["sequences"] == 4
+        assert {"read", "hmmsearch", "extract", "overlap_filter", "writer"} <= set(metrics["stages"])
+        assert len(metrics["blocks"]) == 2
+
+    def test_search_progress(self, tmp_path: Path):
+        # The folder of the progress file is made if it does not exist yet
+        search(self.input, tmp_path, mode="cazyme", blocksize=2, progress=tmp_path / "logs" / "progress.jsonl")
+        reports = [json.loads(line) for line in (tmp_path / "logs" / "progress.jsonl").read_text().splitlines()]
+        assert [report["blocks"] for report in reports] == [1, 2, 2]
+        assert reports[0]["estimated_total"] and reports[0]["eta_seconds"] is not None
+        assert reports[-1]["done"] and reports[-1]["fraction"] == 1.0
+        assert reports[-1]["sequences"] == 4 and reports[-1]["residues"] == reports[-1]["total_residues"]
+
+    def test_search_progress_indexed(self, tmp_path: Path, capsys: pytest.CaptureFixture):
+        shutil.copy(self.input, tmp_path / "example.faa")
+        index(tmp_path / "example.faa")
+        search(tmp_path / "example.faa", tmp_path, mode="sub", blocksize=2, progress="-")
+        lines = capsys.readouterr().err.splitlines()
+        assert lines[0].startswith("58.3% 1.49k/2.55k residues")
+        assert lines[-1].startswith("100.0% 2.55k/2.55k residues")
+
+    def test_search_metrics_prometheus(self, tmp_path: Path):
+        search(self.input, tmp_path, mode="cazyme", metrics=tmp_path / "metrics.prom", profile=tmp_path / "search.prof")
+        assert 'dbcanlight_stage_wall_seconds{command="search",mode="cazyme",stage="hmmsearch"}' in (
+            tmp_path / "metrics.prom"
+        ).read_text()
+        assert (tmp_path / "search.prof").is_file()
+
     def test_search_keyerror(self, tmp_path: Path):
         with pytest.raises(KeyError, match=r".+ is not an available mode."):
             search(self.input, tmp_path, mode="Invalidmode")
@@ -0,0 +1,52 @@
+from __future__ import annotations
+
+from pathlib import Path
+
+import pytest
+
+from dbcanlight._store import ResultStore
+
+OVERVIEW = [
+    ["gene1", "3.2.1.4:6", "GH5_4(66-346)+CBM46(375-460)", "CBM46_e1+GH5_e222", "3.2.1.4+CBM46+GH5_4", "cellulose", 3],
+    ["gene2", "1.10.3.2:77", "AA1_1(37-337)", "AA1_e33", "AA1_1", "lignin", 3],
+]
+CAZYMES = [["CBM46", 87, "gene1", 569, 1.6e-33, 1, 86, 375, 460, 0.977], ["AA1_1", 300, "gene2", 520, 1e-100, 1, 300, 37, 337, 1]]
+
+
+def test_record_and_query(tmp_path: Path):
+    with ResultStore(tmp_path / "results.sqlite") as store:
+        assert list(store.record_overview(OVERVIEW, sample="s1")) == OVERVIEW
+        list(store.record_overview(OVERVIEW[:1], sample="s2"))
+        for sample in ("s1", "s2"):
+            assert list(store.record_hits(CAZYMES, sample=sample, mode="cazyme")) == CAZYMES
+
+        assert [row[:2] for row in store.query(family=["GH5_4"], substrate=["cellulose"])] == [["s1", "gene1"], ["s2", "gene1"]]
+        assert [row[:2] for row in store.query(ec=["1.10.3.2"])] == [["s1", "gene2"]]
+        assert list(store.query(family=["GH5_4"], substrate=["lignin"])) == []
+        assert [row[:4] for row in store.query(mode="cazyme", family=["AA1_1"])] == [
+            ["s1", "AA1_1", "300", "gene2"],
+            ["s2", "AA1_1", "300", "gene2"],
+        ]
+        with pytest.raises(ValueError, match=r"The substrates and ECs can only be queried from the overview."):
+            list(store.query(mode="cazyme", substrate=["cellulose"]))
+
+        # Storing the results of a sample again replaces the previous ones
+        list(store.record_hits(CAZYMES[:1], sample="s1", mode="cazyme"))
+        assert [row[:2] for row in store.query(mode="cazyme", sample=["s1"])] == [["s1", "CBM46"]]
+
+
+def test_record_interrupted(tmp_path: Path):
+    with ResultStore(tmp_path / "results.sqlite") as store:
+        list(store.record_hits(CAZYMES, sample="s1", mode="cazyme"))
+        lines = store.record_hits(CAZYMES[:1], sample="s1", mode="cazyme")
+        next(lines)
+        lines.close()
+        # The previous results are kept until all the new ones are stored
+        assert [row[1] for row in store.query(mode="cazyme", sample=["s1"])] == ["CBM46", "AA1_1"]
+
+
+def test_record_hits_unformatted(tmp_path: Path):
+    # The lines are stored as written by the writer without relying on it to rename the profiles in place
+    with ResultStore(tmp_path / "results.sqlite") as store:
+        list(store.record_hits([["CBM46.hmm", *CAZYMES[0][1:]]], sample="s1", mode="cazyme"))
+        assert [row[1] for row in store.query(mode="cazyme")] == ["CBM46"]
@@ -0,0 +1,212 @@
+from __future__ import annotations
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Generator
+
+import pytest
+
+import dbcanlight
+import dbcanlight._libbuild as _libbuild
+import dbcanlight._utils as _utils
+from dbcanlight import _cgroup_quota
+from dbcanlight._utils import CheckDB, HttpCache, fetch_database_metadata, parse_size, sort_lines
+
+METADATA = {"cazyme_hmms": ["http://mock/cazyme.hmm", "fakemd5checksum"]}
+CONTENT = b"mock database content\n"
+
+
+class MockServer(ThreadingHTTPServer):
+    """Local stand-in of the database servers which supports conditional requests."""
+
+    etag = '"v1"'
+    max_age = 0
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), MockHandler)
+        self.requests: list[tuple[str, str, int]] = []
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_port}"
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def _respond(self, body: bytes | None):
+        if self.headers.get("If-None-Match") == self.server.etag:
+            status = 304
+        else:
+            status = 200
+        self.server.requests.append((self.command, self.path, status))
+        self.send_response(status)
+        self.send_header("ETag", self.server.etag)
+        self.send_header("Cache-Control", f"max-age={self.server.max_age}")
+        if status == 200:
+            body = body or b""
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            if self.command == "GET":
+                self.wfile.write(body)
+        else:
+            self.end_headers()
+
+    def do_HEAD(self):
+        self._respond(CONTENT)
+
+    def do_GET(self):
+        if self.path == "/database_metadata.json":
+            self._respond(json.dumps(METADATA).encode())
+        else:
+            self._respond(CONTENT)
+
+
+@pytest.fixture
+def server():
+    server = MockServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def cache(tmp_path: Path, monkeypatch: Generator, server: MockServer) -> HttpCache:
+    cache = HttpCache(tmp_path / "http_cache.json")
+    monkeypatch.setattr(_utils, "DATABASE_METADATA", f"{server.url}/database_metadata.json")
+    monkeypatch.setattr(_libbuild, "http_cache", lambda: cache)
+    return cache
+
+
+class TestFetchDatabaseMetadata:
+    def test_conditional_request(self, server: MockServer, cache: HttpCache):
+        assert fetch_database_metadata(cache) == METADATA
+        assert fetch_database_metadata(cache) == METADATA
+        assert [status for *_, status in server.requests] == [200, 304]
+
+    def test_fresh_cache(self, server: MockServer, cache: HttpCache):
+        server.max_age = 300
+        fetch_database_metadata(cache)
+        fetch_database_metadata(cache)
+        assert len(server.requests) == 1
+
+    def test_persistent_cache(self, tmp_path: Path, server: MockServer, cache: HttpCache):
+        fetch_database_metadata(cache)
+        assert fetch_database_metadata(HttpCache(tmp_path / "http_cache.json")) == METADATA
+        assert [status for *_, status in server.requests] == [200, 304]
+
+    def test_offline(self, server: MockServer, cache: HttpCache):
+        assert fetch_database_metadata(cache, offline=True) == _utils.bundled_metadata()
+        fetch_database_metadata(cache)
+        assert fetch_database_metadata(cache, offline=True) == METADATA
+        assert len(server.requests) == 1
+
+    def test_server_unreachable(self, cache: HttpCache, monkeypatch: Generator):
+        monkeypatch.setattr(_utils, "DATABASE_METADATA", "http://127.0.0.1:9/database_metadata.json")
+        assert fetch_database_metadata(cache) == _utils.bundled_metadata()
+
+    def test_bundled_metadata(self):
+        # The copy in the repository root is the one fetched by the released versions
+        assert _utils.bundled_metadata() == json.loads(Path("database_metadata.json").read_text())
+
+
+class TestDownload:
+    def test_download_not_modified(self, tmp_path: Path, server: MockServer, cache: HttpCache):
+        url, db_file = f"{server.url}/cazyme.hmm", tmp_path / "cazyme.hmm"
+        _libbuild._download(url, db_file)
+        assert db_file.read_bytes() == CONTENT
+        server.requests.clear()
+        _libbuild._download(url, db_file)
+        assert server.requests == [("HEAD", "/cazyme.hmm", 304)]
+
+    def test_download_modified(self, tmp_path: Path, server: MockServer, cache: HttpCache):
+        url, db_file = f"{server.url}/cazyme.hmm", tmp_path / "cazyme.hmm"
+        _libbuild._download(url, db_file)
+        server.etag = '"v2"'
+        server.requests.clear()
+        _libbuild._download(url, db_file)
+        assert ("GET", "/cazyme.hmm", 200) in server.requests
+
+    def test_download_local_modified(self, tmp_path: Path, server: MockServer, cache: HttpCache):
+        url, db_file = f"{server.url}/cazyme.hmm", tmp_path / "cazyme.hmm"
+        _libbuild._download(url, db_file)
+        db_file.write_bytes(b"corrupted")
+        server.requests.clear()
+        _libbuild._download(url, db_file)
+        assert db_file.read_bytes() == CONTENT
+        assert ("GET", "/cazyme.hmm", 200) in server.requests
+
+    def test_download_md5_mismatch(self, tmp_path: Path, server: MockServer, cache: HttpCache):
+        url, db_file = f"{server.url}/cazyme.hmm", tmp_path / "cazyme.hmm"
+        server.max_age = 300
+        _libbuild._download(url, db_file)
+        assert cache.fresh(url)
+        server.requests.clear()
+        _libbuild._download(url, db_file, md5="fakemd5checksum")
+        assert server.requests[-1] == ("GET", "/cazyme.hmm", 200)
+
+
+def test_md5_memoized(tmp_path: Path, monkeypatch: Generator):
+    cache = HttpCache(tmp_path / "http_cache.json")
+    file = tmp_path / "db"
+    file.write_bytes(CONTENT)
+    md5 = cache.md5(file)
+    monkeypatch.setattr(_utils.hashlib, "md5", None)
+    assert HttpCache(tmp_path / "http_cache.json").md5(file) == md5
+
+
+def test_cgroup_quota(tmp_path: Path):
+    assert _cgroup_quota(tmp_path) is None
+    (tmp_path / "cpu.max").write_text("max 100000\n")
+    assert _cgroup_quota(tmp_path) is None
+    (tmp_path / "cpu.max").write_text("150000 100000\n")
+    assert _cgroup_quota(tmp_path) == 1.5
+
+    (tmp_path / "cpu.max").unlink()
+    (tmp_path / "cpu").mkdir()
+    (tmp_path / "cpu" / "cpu.cfs_quota_us").write_text("200000\n")
+    (tmp_path / "cpu" / "cpu.cfs_period_us").write_text("100000\n")
+    assert _cgroup_quota(tmp_path) == 2
+
+
+def test_available_cpus(monkeypatch: Generator):
+    monkeypatch.setattr(dbcanlight, "_cgroup_quota", lambda: 1.5)
+    monkeypatch.setattr(dbcanlight.os, "sched_getaffinity", lambda pid: set(range(8)), raising=False)
+    monkeypatch.delenv("SLURM_CPUS_PER_TASK", raising=False)
+    monkeypatch.delenv("SLURM_CPUS_ON_NODE", raising=False)
+    assert dbcanlight._available_cpus() == (2, "cgroup")
+    monkeypatch.setenv("SLURM_CPUS_ON_NODE", "16")
+    monkeypatch.setenv("SLURM_CPUS_PER_TASK", "1")
+    assert dbcanlight._available_cpus() == (1, "SLURM_CPUS_PER_TASK")
+
+
+@pytest.mark.parametrize("buffer_size", (100, 3))
+def test_sort_lines(buffer_size: int):
+    lines = [[f"gene{i % 4}", i] for i in range(10)]
+    assert [[str(x) for x in line] for line in sort_lines(lines, key=0, buffer_size=buffer_size)] == [
+        [f"gene{i % 4}", str(i)] for i in sorted(range(10), key=lambda i: i % 4)
+    ]
+
+
+def test_parse_size():
+    assert parse_size("1024") == parse_size(1024) == parse_size("1k") == 1024
+    assert parse_size("1.5G") == parse_size("1536MB") == 1536 * 2**20
+    with pytest.raises(ValueError):
+        parse_size("1X")
+
+
+def test_check_db(tmp_path: Path):
+    @CheckDB(tmp_path / "a.hmm", tmp_path / "b.hmm")
+    def func() -> bool:
+        return True
+
+    (tmp_path / "a.hmm").touch()
+    with pytest.raises(FileNotFoundError, match=r"Database file missing .*b\.hmm\. "):
+        func()
+    (tmp_path / "b.hmm").touch()
+    assert func()